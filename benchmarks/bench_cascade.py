@@ -0,0 +1,107 @@
+"""
+Scan latency and recall of the tiled detection cascade against the single full frame pass
+Every image (or frame sampled from a video) is scanned by a plain detection engine and by the cascade,
+both on the configured backend, target and input size
+
+Recall needs labelled objects in a sidecar <image>.json next to each image:
+    {"objects": [{"name": "cup", "box": [x, y, w, h]}, ...]}
+A labelled object counts as found when a detection of the same class overlaps it by at least --iou.
+Unlabelled sources still report latency and how many detections the tiles added
+
+Run from the repository root:
+    python benchmarks/bench_cascade.py table/*.jpg
+    python benchmarks/bench_cascade.py clips/desk.mp4 --frames 30 --workers 4 --output cascade.json
+"""
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from time import perf_counter
+import json
+import os
+import queue
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config as c
+import object_detect as ssd
+from dnn_tune import iou, load_frames
+from replay import percentiles
+
+
+def load_labels(source):
+    """ Labelled (name, box) pairs from the sidecar json, None if the source has none """
+    path = os.path.splitext(source)[0] + '.json'
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return [(obj['name'], obj['box']) for obj in json.load(f)['objects']]
+
+
+def found(labels, detections, names, threshold):
+    """ Number of labelled objects matched by a detection of the same class """
+    ids, _, boxes = detections
+    detected = [(names[i - 1], box) for i, box in zip(ids.tolist(), boxes.tolist())]
+    return sum(any(name == d_name and iou(box, d_box) >= threshold for d_name, d_box in detected)
+               for name, box in labels)
+
+
+def scan(engine, image):
+    """ One blocking scan, returns latency in seconds and the NMS filtered detections """
+    start = perf_counter()
+    raw = engine.submit(image, block=True).result()
+    return perf_counter() - start, ssd.suppress(*raw)
+
+
+def run(sources, frames, threshold):
+    """ Scans every sample with both engines and summarises latency, detections and recall """
+    names = ssd.load_classes().coco_names
+    single = ssd.DetectionEngine().start()
+    tiles = queue.Queue(maxsize=c.scan_tile_workers * c.detect_max_pending)
+    cascade = ssd.CascadeEngine(ssd.DetectionEngine().start(),
+                                [ssd.DetectionEngine(requests=tiles).start() for _ in range(c.scan_tile_workers)])
+    cascade.start().ready.wait()
+    single.ready.wait()
+    results = dict((mode, dict(latency=[], detections=0, found=0)) for mode in ('single_pass', 'cascade'))
+    labelled = 0
+    for source in sources:
+        labels = load_labels(source)
+        samples = load_frames([source], frames)
+        labelled += len(labels) * len(samples) if labels else 0
+        for image in samples:
+            for mode, engine in (('single_pass', single), ('cascade', cascade)):
+                latency, detections = scan(engine, image)
+                results[mode]['latency'].append(latency)
+                results[mode]['detections'] += len(detections[0])
+                results[mode]['found'] += found(labels, detections, names, threshold) if labels else 0
+    single.stop()
+    stats = cascade.stats()
+    cascade.stop()
+    summary = dict(sources=sources, backend=c.detect_backend, target=c.detect_target,
+                   input_size=list(c.detect_input_size), tile_size=c.scan_tile_size, tile_workers=c.scan_tile_workers,
+                   tiles_per_scan=stats['tiles_per_scan'], labelled_objects=labelled)
+    for mode, result in results.items():
+        summary[mode] = dict(scan_latency=percentiles(result['latency']), detections=result['detections'],
+                             recall=result['found'] / labelled if labelled else None)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Compare the tiled detection cascade with a single full frame pass")
+    parser.add_argument('sources', nargs='+', help="Images (with optional sidecar labels) or videos")
+    parser.add_argument('--frames', type=int, default=20, help="Frames sampled from each video")
+    parser.add_argument('--workers', type=int, help="Tile detection engines to run in parallel")
+    parser.add_argument('--tile-size', type=int, help="Tile width and height in frame pixels")
+    parser.add_argument('--iou', type=float, default=0.5, help="IoU for a detection to match a labelled object")
+    parser.add_argument('--output', help="Write results json here instead of stdout")
+    args = parser.parse_args()
+
+    c.scan_tile_workers = args.workers or c.scan_tile_workers
+    c.scan_tile_size = args.tile_size or c.scan_tile_size
+    # Engine start-up output goes to the null device so stdout stays machine readable
+    with open(os.devnull, 'w') as null, redirect_stdout(null):
+        result = run(args.sources, args.frames, args.iou)
+    report = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
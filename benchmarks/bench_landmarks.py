@@ -0,0 +1,77 @@
+"""
+Micro-benchmark of the per-frame landmark and distance kernel
+Compares the original list based implementation with the vectorised landmarks module
+Drawing and console output are excluded from both so only the computation is measured
+Run from the repository root: python benchmarks/bench_landmarks.py
+"""
+from math import sqrt
+from timeit import repeat
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config as c
+from landmarks import LandmarkBuffer, guidance_measure, NUM_LANDMARKS
+
+
+class FakeLandmark:
+    """ Mimics a MediaPipe NormalizedLandmark """
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+class FakeHand:
+    """ Mimics a MediaPipe NormalizedLandmarkList """
+    def __init__(self):
+        self.landmark = [FakeLandmark(random.random(), random.random()) for _ in range(NUM_LANDMARKS)]
+
+
+class FakeResults:
+    """ Mimics the MediaPipe hands solution output """
+    def __init__(self, hands):
+        self.multi_hand_landmarks = [FakeHand() for _ in range(hands)]
+
+
+def legacy_frame(results, selection):
+    """ Original implementation: list of [idx, x, y], per element sqrt, repeated min and centre """
+    landmark_list = []
+    for hand in results.multi_hand_landmarks:
+        for idx2, landmark in enumerate(hand.landmark):
+            landmark_list.append([idx2, int(landmark.x * c.cam_width), int(landmark.y * c.cam_height)])
+    dists = [0] * len(landmark_list)
+    for idx, lm in enumerate(landmark_list):
+        dists[idx] = int(round(sqrt((lm[1] - (selection[0] + (selection[2] / 2))) ** 2 +
+                                    (lm[2] - (selection[1] + (selection[3] / 2))) ** 2), 0))
+    target_distance = min(dists)
+    closest = landmark_list[dists.index(min(dists))]
+    target_x = int(round(selection[0] + (selection[2] / 2), 0))
+    target_y = int(round(selection[1] + (selection[3] / 2), 0))
+    tol = c.target_tolerance
+    a = 'r' if closest[1] < target_x - tol else 'l' if closest[1] > target_x + tol else 'x'
+    b = 'bw' if closest[2] < target_y - tol else 'fw' if closest[2] > target_y + tol else 'y'
+    return closest, target_distance, (a, b)
+
+
+def vectorised_frame(buffer, results, selection):
+    """ New implementation: preallocated array and single vectorised pass """
+    landmarks = buffer.fill(results)
+    return guidance_measure(landmarks, selection)
+
+
+if __name__ == "__main__":
+    random.seed(0)
+    selection = (300, 200, 80, 60)
+    runs = 10000
+    for hands in (1, 2):
+        results = FakeResults(hands)
+        buffer = LandmarkBuffer(max_hands=hands)
+        # Both implementations must agree before timing means anything
+        old = legacy_frame(results, selection)
+        new = vectorised_frame(buffer, results, selection)
+        assert old[1] == new[3] and old[2] == (new[4], new[5]) and tuple(old[0][1:]) == new[2], (old, new)
+        legacy = min(repeat(lambda: legacy_frame(results, selection), number=runs, repeat=5)) / runs
+        vector = min(repeat(lambda: vectorised_frame(buffer, results, selection), number=runs, repeat=5)) / runs
+        print(f"{hands} hand(s): legacy {legacy * 1e6:.1f} us/frame, vectorised {vector * 1e6:.1f} us/frame, "
+              f"speedup {legacy / vector:.2f}x")
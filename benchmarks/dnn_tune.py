@@ -0,0 +1,173 @@
+"""
+Tunes the SSD object detector for this machine
+Benchmarks every cv2.dnn backend/target pair this OpenCV build can run, at each input size, on sample
+frames from recorded video or images. Each configuration's detections (after NMS) are compared with the
+reference configuration (OpenCV backend, CPU target, 320x320 input) and the fastest configuration whose
+agreement stays within the tolerance is saved to c.detect_profile, which config.py loads at startup
+
+Run from the repository root:
+    python benchmarks/dnn_tune.py clips/*.mp4
+    python benchmarks/dnn_tune.py frames/*.jpg --sizes 256,288,320 --tolerance 0.95 --output tune.json
+Agreement is the mean per frame F1 score of detections matched to the reference by class and IoU, so 1.0
+means every reference object was found with no extras. Delete the profile to return to the config defaults
+"""
+from argparse import ArgumentParser
+from datetime import datetime
+from time import perf_counter
+import json
+import os
+import platform
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import numpy as np
+import cv2
+import config as c
+import object_detect as ssd
+from frame_prep import FramePrep
+
+reference_config = ('opencv', 'cpu', (320, 320))
+
+
+def load_frames(sources, count):
+    """ Up to count frames spread evenly over each video, image files are used whole """
+    frames = []
+    for source in sources:
+        image = cv2.imread(source)
+        if image is not None:
+            frames.append(image)
+            continue
+        cap = cv2.VideoCapture(source)
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        for idx in np.linspace(0, max(total - 1, 0), num=min(count, max(total, 1)), dtype=int):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(idx))
+            ok, image = cap.read()
+            frames.append(image) if ok else None
+        cap.release()
+    return frames
+
+
+def configurations(sizes):
+    """ (backend, target, input size) for every pair OpenCV reports as available """
+    for backend, backend_id in ssd.dnn_backends.items():
+        try:
+            available = set(cv2.dnn.getAvailableTargets(backend_id))
+        except cv2.error:
+            continue
+        for target, target_id in ssd.dnn_targets.items():
+            if target_id in available:
+                for size in sizes:
+                    yield backend, target, size
+
+
+def iou(a, b):
+    """ Intersection over union of two (x, y, w, h) boxes """
+    w = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    h = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+    inter = max(w, 0) * max(h, 0)
+    union = a[2] * a[3] + b[2] * b[3] - inter
+    return inter / union if union > 0 else 0.0
+
+
+def agreement(reference, result, threshold):
+    """ F1 score of one frame's detections against the reference, matched greedily by class and IoU """
+    ref_ids, _, ref_boxes = reference
+    ids, _, boxes = result
+    if len(ref_ids) == 0 and len(ids) == 0:
+        return 1.0
+    unmatched = list(range(len(ids)))
+    matches = 0
+    for ref_id, ref_box in zip(ref_ids, ref_boxes.tolist()):
+        scores = [(iou(ref_box, boxes[i].tolist()), i) for i in unmatched if ids[i] == ref_id]
+        best = max(scores, default=(0.0, None))
+        if best[0] >= threshold:
+            unmatched.remove(best[1])
+            matches += 1
+    return 2 * matches / (len(ref_ids) + len(ids))
+
+
+def benchmark(config, frames, repeats):
+    """ Latencies in seconds and NMS filtered detections per frame for one configuration """
+    backend, target, size = config
+    model = ssd.create_model(backend, target, size)
+    prep = FramePrep()
+    # First inference allocates buffers (and compiles kernels on GPU targets), it is not timed
+    ssd.detect_frame(model, prep.load(frames[0]), size)
+    latencies, detections = [], []
+    for frame in frames:
+        for _ in range(repeats):
+            start = perf_counter()
+            # Preprocessing is included as its cost also depends on the input size
+            raw = ssd.detect_frame(model, prep.load(frame), size)
+            latencies.append(perf_counter() - start)
+        detections.append(ssd.suppress(*raw))
+    return latencies, detections
+
+
+def tune(frames, sizes, repeats, tolerance, iou_threshold):
+    """ Benchmarks every configuration and picks the fastest one within tolerance of the reference """
+    _, reference = benchmark(reference_config, frames, 1)
+    results = []
+    for config in configurations(sizes):
+        backend, target, size = config
+        entry = dict(backend=backend, target=target, input_size=list(size))
+        try:
+            latencies, detections = benchmark(config, frames, repeats)
+        except cv2.error as err:
+            # Listed targets can still fail for this model (unsupported layers, missing drivers)
+            entry['error'] = str(err).strip().splitlines()[-1]
+            results.append(entry)
+            continue
+        scores = [agreement(ref, det, iou_threshold) for ref, det in zip(reference, detections)]
+        entry.update(p50_ms=1000 * float(np.percentile(latencies, 50)),
+                     p95_ms=1000 * float(np.percentile(latencies, 95)),
+                     agreement=float(np.mean(scores)), min_agreement=float(np.min(scores)))
+        entry['accepted'] = entry['agreement'] >= tolerance
+        results.append(entry)
+    accepted = [entry for entry in results if entry.get('accepted')]
+    best = min(accepted, key=lambda entry: entry['p50_ms'], default=None)
+    return best, results
+
+
+def save_profile(best, path, frames, tolerance):
+    """ Writes the chosen configuration where config.py looks for it """
+    profile = dict(detect_backend=best['backend'], detect_target=best['target'],
+                   detect_input_size=best['input_size'], p50_ms=best['p50_ms'], agreement=best['agreement'],
+                   tolerance=tolerance, frames=frames, opencv=cv2.__version__, machine=platform.processor()
+                   or platform.machine(), tuned=datetime.now().isoformat(timespec='seconds'))
+    with open(path, 'w') as f:
+        json.dump(profile, f, indent=2)
+    return profile
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Pick the fastest cv2.dnn backend, target and input size for the detector")
+    parser.add_argument('sources', nargs='+', help="Recorded video files or images to sample frames from")
+    parser.add_argument('--frames', type=int, default=20, help="Frames sampled from each video")
+    parser.add_argument('--sizes', default='256,288,320,384', help="Square input sizes to try, comma separated")
+    parser.add_argument('--repeats', type=int, default=3, help="Timed inferences per frame")
+    parser.add_argument('--tolerance', type=float, default=0.9, help="Minimum mean agreement with the reference")
+    parser.add_argument('--iou', type=float, default=0.5, help="IoU for a detection to match the reference")
+    parser.add_argument('--profile', default=c.detect_profile, help="Where to save the chosen configuration")
+    parser.add_argument('--dry-run', action='store_true', help="Report results without saving the profile")
+    parser.add_argument('--output', help="Write results json here instead of stdout")
+    args = parser.parse_args()
+
+    samples = load_frames(args.sources, args.frames)
+    if not samples:
+        sys.exit("No frames could be read from the sources")
+    chosen, tried = tune(samples, [(int(s), int(s)) for s in args.sizes.split(',')], args.repeats,
+                         args.tolerance, args.iou)
+    report = dict(frames=len(samples), reference=dict(backend=reference_config[0], target=reference_config[1],
+                                                      input_size=list(reference_config[2])),
+                  tolerance=args.tolerance, configurations=tried, chosen=chosen, profile=None)
+    if chosen is not None and not args.dry_run:
+        save_profile(chosen, args.profile, len(samples), args.tolerance)
+        report['profile'] = args.profile
+    report = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
+    sys.exit(0 if chosen is not None else 1)
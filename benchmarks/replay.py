@@ -0,0 +1,291 @@
+"""
+Deterministic replay benchmark for the guidance loop
+Drives video_thread.GuidancePipeline (hand tracking, tracker update, calc_min_dist, guidance_feedback)
+from recorded video files with the speech, glove and tone sinks replaced by recorders (and no display unless asked for)
+
+Each video needs the selected object's starting box, either from a sidecar <video>.json file containing
+{"target": [x, y, w, h]} or from --target
+
+Run from the repository root:
+    python benchmarks/replay.py clips/*.mp4 --output bench.json
+    python benchmarks/replay.py clips/*.mp4 --baseline bench.json --tolerance 0.15
+The second form exits with status 1 if any stage p95, cue latency p95 or FPS regresses beyond tolerance
+Adding --headless skips overlay drawing, compare cpu_ms_per_frame with and without it to see the saving
+The replay opens no window unless --display is given, which runs the guidance display thread (VideoShow) on
+every frame as live guidance does. Its imshow/waitKey cost is then part of cpu_ms_per_frame, so compare a
+--display run with a --headless one to see the full saving of headless mode (needs a desktop session)
+State filters run on video time (frame index over the file's frame rate) so inference decisions and cues are
+the same on every machine, wall clock time is only used for latency and FPS
+The filters section shows how often hand and object tracking inference ran against the prediction error
+of the state filters, sweep --max-interval (or compare with --no-filter) to see the tradeoff
+--processes replays through the multi-process shared memory pipeline instead, compare its fps and frame
+latency with the default single process run (its cpu_ms_per_frame covers the guidance process only)
+FPS is sustained throughput, timed from the first completed frame so worker start-up is excluded
+"""
+from contextlib import nullcontext
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from time import perf_counter, process_time
+from types import ModuleType
+import atexit
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import numpy as np
+import cv2
+import config as c
+
+
+class CueRecorder:
+    """ Collects every cue the guidance system emits with the time it was emitted """
+    def __init__(self):
+        self.cues = []
+
+    def record(self, sink, value):
+        self.cues.append((perf_counter(), sink, value))
+
+
+recorder = CueRecorder()
+
+
+class StubPlayer:
+    """ Stands in for speech_output.SpeechPlayer """
+    def wait_idle(self, timeout=None):
+        return True
+
+
+class StubSurah:
+    """ Stands in for the voice assistant, never speaking so cue gating depends on the frame count only """
+    def __init__(self):
+        self.dict = dict(acquired="Target acquired.", guide_comp="Guidance complete.")
+        self.player = StubPlayer()
+
+    def respond(self, text, is_thread, cue=False):
+        recorder.record('voice', text)
+
+    def is_speaking(self):
+        return False
+
+    def prewarm(self, phrases):
+        return None
+
+
+class StubSerial:
+    """ Stands in for the glove's serial connection """
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def write(self, data):
+        recorder.record('glove', data)
+
+    def close(self):
+        pass
+
+
+def install_stub_sinks():
+    """ Replaces the speech and glove modules before the pipeline imports them, tones go to a recording sink """
+    voice = ModuleType('voice_assistant')
+    voice.surah = StubSurah()
+    serial = ModuleType('serial')
+    serial.Serial = StubSerial
+    sys.modules.update({'voice_assistant': voice, 'serial': serial})
+    if c.guidance_mode == 'beep':
+        import tone
+        with open(os.devnull, 'w') as null, redirect_stdout(null):
+            tone.init(sink='null')
+        play = tone.engine.play
+        tone.engine.play = lambda target_distance: recorder.record('beep', play(target_distance))
+
+
+def percentiles(samples):
+    """ p50/p95/p99 in milliseconds """
+    if not samples:
+        return dict(count=0, p50_ms=None, p95_ms=None, p99_ms=None)
+    p50, p95, p99 = np.percentile(np.asarray(samples) * 1000, [50, 95, 99])
+    return dict(count=len(samples), p50_ms=float(p50), p95_ms=float(p95), p99_ms=float(p99))
+
+
+def load_target(video, target):
+    """ Starting box for the selected object from --target or the sidecar json """
+    if target is not None:
+        return tuple(int(v) for v in target.split(','))
+    with open(os.path.splitext(video)[0] + '.json') as f:
+        return tuple(int(v) for v in json.load(f)['target'])
+
+
+def filter_samples(state_filter):
+    """ Frames, measurements and prediction errors of a state filter """
+    return [state_filter.frames, state_filter.measurements, list(state_filter.errors)]
+
+
+def filter_summary(frames, measurements, errors):
+    """ Inference rate against prediction error """
+    summary = dict(frames=frames, inferences=measurements, inference_ratio=measurements / frames if frames else 0.0)
+    if errors:
+        mean, p95 = float(np.mean(errors)), float(np.percentile(errors, 95))
+        summary.update(mean_error_px=mean, p95_error_px=p95)
+    return summary
+
+
+def replay(video, target, processes=False, display=False):
+    """ Runs the pipeline over every frame of one video and returns the raw samples """
+    import guidance_system as gs
+    import hand_track as ht
+    import object_detect as ssd
+    import video_thread as vt
+    from camera import Frame
+
+    ht.init() if ht.mp_hands is None else None
+    gs.init_glove() if c.guidance_mode == 'glove' and gs.glove is None else None
+    detections = ssd.Detections()
+    detections.selected_object = 'target'
+    detections.selected_bound_box = target
+    cap = cv2.VideoCapture(video)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    samples = dict((stage, []) for stage in vt.GuidancePipeline.stages)
+    samples['frame'] = []
+    cue_latency = []
+    frames = 0
+    timed = dict(frames=0, started=None, cpu_started=None)
+
+    def record():
+        """ Collects samples for every frame the pipeline completed in the last step """
+        for latency, timings in pipeline.completed:
+            samples['frame'].append(latency)
+            for stage in pipeline.stages:
+                samples[stage].append(timings[stage])
+        if pipeline.cue_latency is not None:
+            cue_latency.append(pipeline.cue_latency)
+        # Throughput is timed from the first completed frame
+        if timed['started'] is None and pipeline.completed:
+            # Process CPU time covers every thread, including the tracker worker
+            timed.update(started=perf_counter(), cpu_started=process_time())
+        elif timed['started'] is not None:
+            timed['frames'] += len(pipeline.completed)
+
+    with nullcontext() if processes else ht.mp_hands.Hands(min_detection_confidence=c.mp_detect_conf,
+                                                           min_tracking_confidence=c.mp_track_conf,
+                                                           max_num_hands=c.max_hands) as hands:
+        if processes:
+            # Publisher waits for a free slot rather than dropping frames so every frame is replayed
+            pipeline = vt.MultiProcessPipeline(detections, block=True)
+        else:
+            pipeline = vt.GuidancePipeline(hands, detections, sync_tracker=True,
+                                           clock=lambda latest: latest.id / fps)
+        video_shower = vt.VideoShow().start() if display else None
+        while True:
+            grabbed, image = cap.read()
+            if not grabbed:
+                break
+            # Frame is "captured" once decoded, matching the camera service timestamp (used for latency only)
+            latest = Frame(frames, perf_counter(), image)
+            shown = pipeline.step(latest)
+            video_shower.post(shown) if video_shower is not None and shown is not None else None
+            record()
+            frames += 1
+        # Frames still in flight in the worker processes
+        while processes and pipeline.pending:
+            pipeline.step()
+            if not pipeline.completed:
+                break
+            record()
+        video_shower.stop() if video_shower is not None else None
+        elapsed = perf_counter() - timed['started'] if timed['started'] is not None else 0.0
+        cpu = process_time() - timed['cpu_started'] if timed['cpu_started'] is not None else 0.0
+        pipeline.close()
+    cap.release()
+    filters = {}
+    if pipeline.hand_filter is not None:
+        filters = dict(hand=filter_samples(pipeline.hand_filter), target=filter_samples(pipeline.box_filter))
+    return samples, cue_latency, timed['frames'], elapsed, cpu, filters
+
+
+def run(videos, target, mode, processes=False, display=False):
+    """ Replays all videos and summarises the results """
+    c.guidance_mode = mode
+    install_stub_sinks()
+    # Stage timings come from spans, so they must be on whatever the config says, and nothing else may
+    # write to stdout while the results are printed
+    import telemetry as tm
+    tm.configure(level=tm.WARNING, spans=True)
+    atexit.unregister(tm.dump_summary)
+    samples, cue_latency, frames, elapsed, cpu, filters = {}, [], 0, 0.0, 0.0, {}
+    for video in videos:
+        # Pipeline logging goes to the null device so stdout stays machine readable
+        with open(os.devnull, 'w') as null, redirect_stdout(null):
+            video_samples, video_cues, video_frames, video_elapsed, video_cpu, video_filters = \
+                replay(video, load_target(video, target), processes, display)
+        for stage, values in video_samples.items():
+            samples.setdefault(stage, []).extend(values)
+        for name, (f_frames, f_measurements, f_errors) in video_filters.items():
+            total = filters.setdefault(name, [0, 0, []])
+            total[0] += f_frames
+            total[1] += f_measurements
+            total[2].extend(f_errors)
+        cue_latency.extend(video_cues)
+        frames += video_frames
+        elapsed += video_elapsed
+        cpu += video_cpu
+    return dict(videos=videos, guidance_mode=mode, tracker_backend=c.tracker_backend, headless=c.headless,
+                display=display,
+                pipeline='multi-process' if processes else 'single-process',
+                frames=frames, fps=frames / elapsed if elapsed else 0.0,
+                cpu_ms_per_frame=1000 * cpu / frames if frames else 0.0,
+                stages=dict((stage, percentiles(values)) for stage, values in samples.items()),
+                cue_latency=percentiles(cue_latency), cues=len(recorder.cues),
+                filter_max_interval=c.filter_max_interval if c.filter_enabled else None,
+                filters=dict((name, filter_summary(*total)) for name, total in filters.items()))
+
+
+def regressions(result, baseline, tolerance):
+    """ Lists every metric that is worse than baseline by more than the tolerance """
+    failures = []
+    limit = 1 + tolerance
+    for stage, stats in baseline['stages'].items():
+        current = result['stages'].get(stage, {}).get('p95_ms')
+        if stats['p95_ms'] and current and current > stats['p95_ms'] * limit:
+            failures.append(f"{stage} p95 {current:.2f}ms > {stats['p95_ms']:.2f}ms")
+    base_cue, cue = baseline['cue_latency']['p95_ms'], result['cue_latency']['p95_ms']
+    if base_cue and cue and cue > base_cue * limit:
+        failures.append(f"cue latency p95 {cue:.2f}ms > {base_cue:.2f}ms")
+    if result['fps'] < baseline['fps'] / limit:
+        failures.append(f"fps {result['fps']:.1f} < {baseline['fps']:.1f}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Replay recorded video through the guidance pipeline")
+    parser.add_argument('videos', nargs='+', help="Recorded video files")
+    parser.add_argument('--target', help="Starting box x,y,w,h for every video (overrides sidecar json)")
+    parser.add_argument('--mode', default='voice', choices=('glove', 'voice', 'beep', 'none'))
+    parser.add_argument('--headless', action='store_true', help="Skip overlay drawing as in headless mode")
+    parser.add_argument('--display', action='store_true', help="Show frames in the guidance display thread")
+    parser.add_argument('--no-filter', action='store_true', help="Run inference on every frame without prediction")
+    parser.add_argument('--processes', action='store_true', help="Use the multi-process shared memory pipeline")
+    parser.add_argument('--max-interval', type=int, help="Maximum frames between inferences with the state filter")
+    parser.add_argument('--output', help="Write results json here instead of stdout")
+    parser.add_argument('--baseline', help="Results json to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="Allowed fractional regression")
+    args = parser.parse_args()
+    if args.display and args.headless:
+        parser.error("--display shows the overlays that --headless skips, use one or the other")
+
+    c.headless = args.headless
+    c.filter_enabled = not args.no_filter
+    c.filter_max_interval = args.max_interval or c.filter_max_interval
+    result = run(args.videos, args.target, args.mode, args.processes, args.display)
+    report = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            failed = regressions(result, json.load(f), args.tolerance)
+        for failure in failed:
+            print(f"REGRESSION: {failure}", file=sys.stderr)
+        sys.exit(1 if failed else 0)
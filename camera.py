@@ -0,0 +1,103 @@
+from collections import deque, namedtuple
+from time import perf_counter, sleep
+import threading
+import cv2
+import config as c
+
+# Single captured frame. image is shared between consumers and must be treated as read only
+# unless the consumer is the only one using it (e.g. the guidance loop drawing its overlays)
+Frame = namedtuple('Frame', ['id', 'timestamp', 'image'])
+
+
+def is_file_source(src):
+    """ Camera indices (int or digit string) use the device backend, anything else is a video file """
+    return not (isinstance(src, int) or (isinstance(src, str) and src.isdigit()))
+
+
+class CameraService:
+    """
+    Persistent camera owned by a single capture thread
+    Keeps a small ring buffer of timestamped frames so scan, guidance and display all see the latest frame
+    Accepts a device index or a video file path so the pipeline can run on a machine with no camera
+    """
+    def __init__(self, src=c.cam_src, buffer_size=c.cam_buffer_size):
+        """ Initialises capture parameters, the device is opened by start() """
+        self.src = src
+        self.file_source = is_file_source(src)
+        self.frames = deque(maxlen=buffer_size)
+        self.cond = threading.Condition()
+        self.next_id = 0
+        self.cap = None
+        self.thread = None
+        self.running = False
+        self.ended = False              # File backend reached the end of the video without looping
+
+    def start(self):
+        """ Opens the source and starts the capture thread """
+        print(f"\nInitialising camera service on source: {self.src}")
+        if self.file_source:
+            self.cap = cv2.VideoCapture(self.src)
+        else:
+            self.cap = cv2.VideoCapture(int(self.src))
+            self.cap.set(3, c.cam_width)
+            self.cap.set(4, c.cam_height)
+        if not self.cap.isOpened():
+            raise OSError(f"Could not open camera source {self.src}")
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='camera', daemon=True)
+        self.thread.start()
+        print("Camera service started")
+        return self
+
+    def _run(self):
+        """ Capture loop, the only code that touches the device """
+        # Video files are paced at their native frame rate so they behave like a live camera
+        period = 0.0
+        if self.file_source and c.cam_file_realtime:
+            fps = self.cap.get(cv2.CAP_PROP_FPS)
+            period = 1.0 / fps if fps > 0 else 1.0 / 30
+        next_due = perf_counter()
+        while self.running:
+            grabbed, image = self.cap.read()
+            if not grabbed:
+                if self.file_source and c.cam_file_loop:
+                    self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    continue
+                with self.cond:
+                    self.ended = True
+                    self.cond.notify_all()
+                return
+            with self.cond:
+                self.frames.append(Frame(self.next_id, perf_counter(), image))
+                self.next_id += 1
+                self.cond.notify_all()
+            if period:
+                next_due += period
+                delay = next_due - perf_counter()
+                sleep(delay) if delay > 0 else None
+
+    def latest(self):
+        """ Returns the newest frame without copying it, or None if nothing has been captured yet """
+        with self.cond:
+            return self.frames[-1] if self.frames else None
+
+    def wait_for_frame(self, after_id=-1, timeout=2.0):
+        """
+        Blocks until a frame newer than after_id is available and returns it
+        Returns None on timeout or once a non-looping video file has ended
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: (self.frames and self.frames[-1].id > after_id) or self.ended
+                               or not self.running, timeout)
+            if self.frames and self.frames[-1].id > after_id:
+                return self.frames[-1]
+            return None
+
+    def stop(self):
+        """ Stops capture thread and releases the device """
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+        self.thread.join() if self.thread is not None else None
+        self.cap.release() if self.cap is not None else None
+        print("Camera service stopped")
@@ -1,7 +1,14 @@
+import json
+import os
+
 # CAMERA PARAMETERS -------------------------------------------------------------------------------
 cam_src: int = 1                        # 0 for laptop cam - requires uncommenting of flip screen code
+                                        # A video file path can be used instead of a camera index
 cam_width: int = 640
 cam_height: int = 480
+cam_buffer_size: int = 4                # Number of recent frames held by the camera service
+cam_file_realtime: bool = True          # Play video file sources at their native frame rate
+cam_file_loop: bool = False             # Restart video file sources when they end
 
 # OBJECT DETECTION PARAMETERS ---------------------------------------------------------------------
 ssd_dataset: str = 'ssd/coco.names'                 # Class names for SSD object detect
@@ -10,19 +17,67 @@ weightsPath: str = 'ssd/inference_graph.pb'         # SSD weights file
 detect_thresh: float = 0.45             # Probability threshold for object detection
 nms_thresh: float = 0.2                 # Non-Max Suppression probability threshold
 num_coco_class_names: int = 91          # Current downloaded version has 91 class names
+detect_input_size: tuple = (320, 320)   # SSD input width and height, frames are resized to this once per frame
+detect_backend: str = 'default'         # cv2.dnn backend: default, opencv, inference_engine, cuda, vkcom ...
+detect_target: str = 'cpu'              # cv2.dnn target: cpu, cpu_fp16, opencl, opencl_fp16, cuda, cuda_fp16 ...
+detect_profile: str = 'dnn_profile.json'    # Backend, target and input size tuned for this machine by dnn_tune.py
+detect_max_pending: int = 2             # Frames allowed to wait for the detection engine before submit refuses more
+
+scan_background: bool = True            # Keep detections current in the background while Surah is awake
+scan_interval: float = 1.0              # Seconds between background scene checks
+scan_max_age: float = 5.0               # Seconds a background result stays valid before a scan runs inference
+scan_motion_scale: int = 8              # Downscale factor for the background scan scene change check
+scan_motion_thresh: float = 3.0         # Mean grey level change that counts as a scene change
+scan_tiled: bool = True                 # Second look at low confidence regions on full resolution tiles (small objects)
+scan_tile_size: int = 320               # Tile width and height in frame pixels
+scan_tile_overlap: float = 0.25         # Fraction of a tile shared with its neighbours so seam objects are whole in one
+scan_tile_confident: float = 0.6        # Detections at or above this probability need no second look
+scan_tile_covered: float = 0.5          # Tiles at least this much covered by confident detections are skipped
+scan_tile_workers: int = 2              # Tile detection engines run in parallel (one model copy and thread each)
+
+tracker_backend: str = 'MOSSE'          # Object tracker: MOSSE (fastest), KCF, CSRT (most accurate) or MIL
+tracker_stats_window: int = 1000        # Number of tracker update latencies kept per backend
 
 # HAND TRACKING PARAMETERS ------------------------------------------------------------------------
 mp_detect_conf: float = 0.75            # Mediapipe hand detection probability threshold
 mp_track_conf: float = 0.4              # Mediapipe tracking probability threshold
 max_hands: int = 1                      # Maximum number of hands to detect
+hand_roi_margin: float = 0.6            # ROI padding around the last hand as a fraction of the hand size
+hand_roi_min: int = 160                 # Minimum ROI growth in pixels (half is added on each side)
+hand_roi_edge: float = 0.1              # ROI border, as a fraction of its size, that the hand must enter to move it
+hand_motion_scale: int = 4              # Downscale factor for the frame differencing motion gate
+hand_motion_thresh: float = 4.0         # Mean grey level change in the ROI that counts as motion
+hand_max_skip: int = 5                  # Maximum consecutive frames that can reuse the previous landmarks
+
+# STATE FILTER PARAMETERS ---------------------------------------------------------------------------
+filter_enabled: bool = True             # Predict hand and target positions between inferences (Kalman filter)
+filter_process_noise: float = 1500.0    # Expected hand/target acceleration in px/s^2
+filter_measurement_noise: float = 2.0   # Landmark and tracker position noise in px
+filter_initial_speed: float = 500.0     # Velocity uncertainty for a newly found hand or target in px/s
+filter_error_target: float = 8.0        # Prediction error in px above which inference runs more often
+filter_max_interval: int = 4            # Maximum frames between inferences while predictions stay accurate
+filter_stats_window: int = 1000         # Number of prediction errors kept for the stats
 
 # GUIDANCE SYSTEM PARAMETERS ----------------------------------------------------------------------
 guidance_options: tuple = ('glove', 'voice', 'beep', 'none')
 guidance_mode: str = 'voice'            # none: No guidance gives fastest visual feedback of system
-com_port: str = "COM5"                  # COM port for glove connection
+com_port: str = "COM5"                  # COM port for glove connection (or the glove_emulator.py device)
+glove_buzz_ms: int = 200                # Duration of each glove guidance buzz in milliseconds
+glove_queue_size: int = 4               # Maximum number of glove commands waiting to be written
 target_tolerance: int = 40              # Pixel proximity to assume target is acquired (helps with 2D limitations)
-beep_duration: int = 200                # Duration of beeps in milliseconds
-guide_hand: int = 1                     # Temp mechanism for ending guidance loop
+beep_duration: int = 200                # Duration of beeps in milliseconds ('beep' tone style)
+tone_style: str = 'glide'               # Beep mode tone: 'glide' (continuous pitch) or 'beep' (pulsed)
+tone_sink: str = 'stream'               # Tone output: 'stream' (sound card), 'null' or 'file' (wav recording)
+tone_file: str = 'tone.wav'             # Recording path for the file tone sink
+tone_sample_rate: int = 22050           # Tone sample rate in Hz
+tone_block_size: int = 512              # Samples generated per audio callback
+tone_volume: float = 0.3                # Tone amplitude (0-1)
+tone_min_freq: int = 100                # Lowest guidance tone frequency in Hz (far from target)
+tone_glide: float = 0.15                # Seconds to glide to a new pitch
+tone_fade: float = 0.02                 # Seconds to fade in or out
+tone_hold: float = 0.5                  # Seconds without a cue before the tone fades out (hand lost)
+mp_pipeline: bool = False               # Run hand and object tracking in worker processes over shared memory
+mp_ring_slots: int = 4                  # Shared memory frame slots (frames in flight) for the multi-process pipeline
 
 # MEDIAPIPE LANDMARK DICTIONARY (CAN BE USED FOR FUTURE CUSTOMISING OF LANDMARK CALCULATIONS)
 mp_dict: dict = {0: "wrist", 1: "thumb cmc", 2: "thumb mcp", 3: "thumb ip", 4: "thumb tip",
@@ -32,4 +87,50 @@ mp_dict: dict = {0: "wrist", 1: "thumb cmc", 2: "thumb mcp", 3: "thumb ip", 4: "
                  17: "pinky finger mcp", 18: "pinky finger pip", 19: "pinky finger dip", 20: "pinky finger tip"}
 
 # VOICE ASSISTANT PARAMETERS ----------------------------------------------------------------------
-api_key: str = 'cloud-tts-api-key/a-guiding-hand-service-account.json'      # API key file for Google Cloud
\ No newline at end of file
+api_key: str = 'cloud-tts-api-key/a-guiding-hand-service-account.json'      # API key file for Google Cloud
+tts_voice: dict = {"language_code": "en-IN", "name": "en-IN-Wavenet-D"}
+tts_audio_config: dict = {"audio_encoding": "LINEAR16", "pitch": -2.8, "speaking_rate": 1.15}   # wav playback
+tts_cache_dir: str = 'tts_cache'        # Disk store for synthesised responses (offline playback of known phrases)
+tts_cache_size: int = 256               # Maximum number of responses held in memory (least recently used evicted)
+tts_prewarm: bool = True                # Synthesise all known static phrases in the background at startup
+speech_queue_size: int = 8              # Maximum number of responses waiting for playback
+speech_cue_ttl: float = 1.5             # Seconds before an unplayed guidance cue is considered stale and dropped
+speech_preempt_cues: bool = True        # Newer guidance cues cut off a cue that is still playing
+tts_batch_workers: int = 4              # Phrases of a spoken list synthesised concurrently while the first plays
+tts_backend: str = 'google'             # Speech synthesis backend: 'google' (cloud) or 'espeak' (local)
+tts_fallback: str = 'espeak'            # Backend used when tts_backend fails, '' for none
+tts_retry_after: float = 30.0          # Seconds only the fallback is used after tts_backend fails before it is retried
+asr_backend: str = 'google'             # Speech recognition backend: 'google' (cloud) or 'vosk' (local)
+asr_fallback: str = 'vosk'              # Backend used when asr_backend can't be reached, '' for none
+asr_language: str = 'en-gb'             # Language for google speech recognition
+espeak_path: str = 'espeak-ng'          # espeak-ng executable
+espeak_voice: str = 'en-gb'             # espeak-ng voice
+espeak_speed: int = 175                 # espeak-ng words per minute
+espeak_pitch: int = 40                  # espeak-ng pitch (0-99)
+vosk_model_path: str = 'vosk-model-small-en-us-0.15'   # Vosk model directory (downloaded from alphacephei.com)
+speech_stats_window: int = 200          # Number of latency samples kept per speech backend
+listen_timeout: float = 1.0             # Seconds the always open microphone waits for speech before listening again
+barge_in: bool = True                   # A new command cuts off whatever Surah is saying
+barge_in_echo_overlap: float = 0.8      # Transcripts sharing this fraction of words with recent speech are Surah's own
+runtime_workers: int = 4                # Threads for blocking speech and detection calls made by the assistant runtime
+
+# DISPLAY PARAMETERS ------------------------------------------------------------------------------
+headless: bool = False                  # Skip the camera window and all overlay drawing (guidance is unchanged)
+display_idle_ms: int = 50               # Window event handling interval while the display waits for a new frame
+
+# TELEMETRY PARAMETERS ----------------------------------------------------------------------------
+log_level: str = 'INFO'                 # DEBUG shows per-frame detail, INFO and WARNING keep the hot loop quiet
+trace_spans: bool = True                # Time named pipeline stages into histograms (summary on exit or SIGUSR1)
+log_buffer_size: int = 4096             # Log records held for the background writer before the oldest are dropped
+log_flush_interval: float = 0.25        # Seconds between background log writes
+
+
+# DETECTOR PROFILE --------------------------------------------------------------------------------
+# Settings chosen by benchmarks/dnn_tune.py on this machine replace the object detection defaults above
+if os.path.isfile(detect_profile):
+    with open(detect_profile) as profile:
+        tuned = json.load(profile)
+    detect_backend = tuned.get('detect_backend', detect_backend)
+    detect_target = tuned.get('detect_target', detect_target)
+    detect_input_size = tuple(tuned.get('detect_input_size', detect_input_size))
+    del profile, tuned
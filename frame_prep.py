@@ -0,0 +1,103 @@
+import numpy as np
+import cv2
+import config as c
+
+
+class FramePrep:
+    """
+    Derived views of one frame (RGB, greyscale, downscaled greyscale levels, model input and a drawing canvas)
+    Each view is computed at most once per frame on first use and written into buffers allocated on the first
+    frame and reused afterwards, so stages share conversions and no large arrays are allocated per frame
+    Views are overwritten by the next load() so callers must copy anything they keep between frames
+    """
+    def __init__(self):
+        """ Buffers are allocated on the first frame of each shape """
+        self.image = None               # BGR frame as captured, never modified
+        self.buffers = {}               # View name -> reusable array
+        self.ready = set()              # Views computed for the current frame
+        self.canvas_idx = 0
+
+    def load(self, image):
+        """ Starts a new frame and returns self """
+        self.image = image
+        self.ready.clear()
+        return self
+
+    def buffer(self, name, shape):
+        """ Reusable array for a view, reallocated only when the frame shape changes """
+        buf = self.buffers.get(name)
+        if buf is None or buf.shape != shape:
+            buf = self.buffers[name] = np.empty(shape, dtype=np.uint8)
+        return buf
+
+    def rgb(self):
+        """ RGB copy of the frame (MediaPipe input) """
+        buf = self.buffer('rgb', self.image.shape)
+        if 'rgb' not in self.ready:
+            cv2.cvtColor(self.image, cv2.COLOR_BGR2RGB, dst=buf)
+            self.ready.add('rgb')
+        return buf
+
+    def rgb_crop(self, roi):
+        """
+        Contiguous RGB copy of an (x, y, w, h) region (MediaPipe input for hand ROIs)
+        Written into a frame sized buffer so the ROI can change size every frame without a new allocation,
+        converted from the BGR crop unless the full RGB view has already been computed
+        """
+        x, y, w, h = roi
+        backing = self.buffer('rgb_crop', self.image.shape)
+        buf = backing.reshape(-1)[:h * w * 3].reshape(h, w, 3)
+        if 'rgb' in self.ready:
+            np.copyto(buf, self.rgb()[y:y + h, x:x + w])
+        else:
+            cv2.cvtColor(self.image[y:y + h, x:x + w], cv2.COLOR_BGR2RGB, dst=buf)
+        return buf
+
+    def grey(self, scale=1):
+        """
+        Greyscale frame downscaled by an integer factor (motion and scene change gates)
+        Levels form a pyramid, each is resized from the largest level already computed that it divides
+        """
+        name = f'grey{scale}'
+        height, width = self.image.shape[:2]
+        buf = self.buffer(name, (height // scale, width // scale))
+        if name not in self.ready:
+            if scale == 1:
+                cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY, dst=buf)
+            else:
+                source = max((s for s in range(1, scale) if scale % s == 0 and f'grey{s}' in self.ready), default=1)
+                cv2.resize(self.grey(source), (width // scale, height // scale), dst=buf, interpolation=cv2.INTER_AREA)
+            self.ready.add(name)
+        return buf
+
+    def model_input(self, size=c.detect_input_size):
+        """
+        Frame resized to the detector's input size as RGB (SSD input before scaling and mean subtraction)
+        Resized from the RGB view if it has been computed, otherwise resized first and converted small
+        """
+        width, height = size
+        buf = self.buffer('model', (height, width, 3))
+        if 'model' not in self.ready:
+            if 'rgb' in self.ready:
+                cv2.resize(self.rgb(), size, dst=buf, interpolation=cv2.INTER_LINEAR)
+            else:
+                small = self.buffer('model_bgr', (height, width, 3))
+                cv2.resize(self.image, size, dst=small, interpolation=cv2.INTER_LINEAR)
+                cv2.cvtColor(small, cv2.COLOR_BGR2RGB, dst=buf)
+            self.ready.add('model')
+        return buf
+
+    def model_scale(self, size=c.detect_input_size):
+        """ Multiplier taking (x, y, w, h) boxes from model input coordinates back to frame pixels """
+        height, width = self.image.shape[:2]
+        return np.array([width / size[0], height / size[1]] * 2, dtype=np.float32)
+
+    def canvas(self):
+        """
+        Copy of the frame to draw overlays on
+        Two buffers alternate so the display thread can still be showing the previous canvas
+        """
+        self.canvas_idx ^= 1
+        buf = self.buffer(f'canvas{self.canvas_idx}', self.image.shape)
+        np.copyto(buf, self.image)
+        return buf
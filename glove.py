@@ -0,0 +1,112 @@
+from collections import deque
+from time import perf_counter
+import threading
+import config as c
+import telemetry as tm
+
+# Motor patterns for the glove's location codes (forward, right, backward, left)
+motor_codes = {'fw': '1000', 'r': '0100', 'bw': '0010', 'l': '0001',
+               'tr': '1100', 'br': '0110', 'bl': '0011', 'tl': '1001'}
+
+# Combined diagonal location for an (x, y) direction pair, single axis directions map to themselves
+diagonals = {('r', 'fw'): 'tr', ('r', 'bw'): 'br', ('l', 'bw'): 'bl', ('l', 'fw'): 'tl'}
+
+
+def location(x, y):
+    """ Single location code covering both direction codes, None when both axes are acquired """
+    if x == 'x':
+        return None if y == 'y' else y
+    if y == 'y':
+        return x
+    return diagonals[(x, y)]
+
+
+def command(loc, dur):
+    """ Serial command for buzzing a location for dur ms """
+    return str.encode(motor_codes[loc] + 'buzz' + str(dur) + '.')
+
+
+class GloveDriver:
+    """
+    Writes buzz commands to the glove from a dedicated thread so the frame loop never waits on the serial port
+    The glove buzzes each command for its full duration before reading the next, so the writer paces commands
+    to the buzz duration instead of filling the device buffer. A new cue supersedes any cue still waiting,
+    and a repeat of the cue that is currently buzzing is coalesced into it
+    """
+    def __init__(self, port, queue_size=c.glove_queue_size):
+        """ Initialises queue and stats for an open serial port """
+        self.port = port
+        self.pending = deque(maxlen=queue_size)     # (command, duration in s, queued at)
+        self.cond = threading.Condition()
+        self.running = False
+        self.busy_until = 0.0           # When the glove will finish the last command written
+        self.current = None             # Last command written
+        self.latency = tm.Histogram()   # Queued to written
+        self.sent = 0
+        self.coalesced = 0
+        self.superseded = 0
+        self.worker = None
+
+    def start(self):
+        """ Starts writer thread """
+        self.running = True
+        self.worker = threading.Thread(target=self._run, name='glove-writer', daemon=True)
+        self.worker.start()
+        return self
+
+    def buzz(self, x, y, dur=c.glove_buzz_ms):
+        """ Queues one combined buzz for an (x, y) direction pair, returns immediately """
+        loc = location(x, y)
+        if loc is not None:
+            self.send(loc, dur)
+
+    def send(self, loc, dur=c.glove_buzz_ms, supersede=True):
+        """ Queues a buzz at a location code, by default replacing cues that have not been written yet """
+        data = command(loc, dur)
+        with self.cond:
+            if data == self.current and perf_counter() < self.busy_until and not self.pending:
+                self.coalesced += 1
+                return
+            if supersede:
+                self.superseded += len(self.pending)
+                self.pending.clear()
+            elif len(self.pending) == self.pending.maxlen:
+                self.superseded += 1
+            self.pending.append((data, dur / 1000, perf_counter()))
+            self.cond.notify()
+
+    def _run(self):
+        """ Writer loop, waits for the glove to finish the previous buzz before writing the next command """
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending or not self.running)
+                if not self.running:
+                    return
+                # Sleep until the glove is free, a stop or newer cue wakes us to re-check
+                delay = self.busy_until - perf_counter()
+                if delay > 0:
+                    self.cond.wait(delay)
+                    continue
+                data, dur, queued = self.pending.popleft()
+            self.port.write(data)
+            written = perf_counter()
+            with self.cond:
+                self.current = data
+                self.busy_until = written + dur
+                self.latency.add(written - queued)
+                self.sent += 1
+            tm.debug("Buzzer instructions delivered to glove")
+
+    def stats(self):
+        """ Commands written, coalesced and superseded with write latency in milliseconds """
+        with self.cond:
+            return dict(sent=self.sent, coalesced=self.coalesced, superseded=self.superseded,
+                        write_latency=self.latency.summary())
+
+    def stop(self):
+        """ Drops waiting cues and stops the writer """
+        with self.cond:
+            self.running = False
+            self.pending.clear()
+            self.cond.notify()
+        self.worker.join() if self.worker is not None else None
@@ -0,0 +1,109 @@
+"""
+Serial glove emulator for testing the glove protocol and timing without the hardware (Linux and macOS)
+Opens a pseudo-terminal and behaves like the glove firmware: each 'NNNNbuzzDUR.' command is read in order
+and buzzes its motors for DUR ms before the next command is read, so commands sent faster than they
+are buzzed build up a backlog exactly as they do in the real glove's input buffer
+
+Run it, set com_port in config.py to the device it prints and start main.py in glove mode:
+    python glove_emulator.py
+Ctrl+C prints the timing summary
+"""
+from collections import namedtuple
+from time import perf_counter, sleep
+import os
+import pty
+import re
+import threading
+
+# Received at, buzz started at, motor pattern and duration in ms for every command the glove executed
+Buzz = namedtuple('Buzz', ['received', 'started', 'motors', 'duration'])
+
+command_pattern = re.compile(rb'([01]{4})buzz(\d+)\.')
+motor_names = ('forward', 'right', 'backward', 'left')
+
+
+class GloveEmulator:
+    """ Pseudo-terminal glove, port is the device path to open with serial.Serial """
+    def __init__(self, verbose=True):
+        """ Opens the pseudo-terminal pair """
+        self.master, self.slave = pty.openpty()
+        self.port = os.ttyname(self.slave)
+        self.verbose = verbose
+        self.commands = []              # (received at, motors, duration) waiting to be buzzed
+        self.buzzes = []
+        self.invalid = 0
+        self.cond = threading.Condition()
+        self.running = False
+        self.threads = []
+
+    def start(self):
+        """ Starts the serial reader and the motor thread """
+        self.running = True
+        self.threads = [threading.Thread(target=self._read, name='glove-emulator-read', daemon=True),
+                        threading.Thread(target=self._buzz, name='glove-emulator-motors', daemon=True)]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def _read(self):
+        """ Parses commands out of the byte stream as they arrive """
+        data = b''
+        while self.running:
+            try:
+                data += os.read(self.master, 1024)
+            except OSError:
+                return
+            received = perf_counter()
+            with self.cond:
+                end = 0
+                for match in command_pattern.finditer(data):
+                    self.invalid += len(data[end:match.start()].strip()) > 0
+                    self.commands.append((received, match.group(1).decode(), int(match.group(2))))
+                    end = match.end()
+                data = data[end:]
+                self.cond.notify()
+
+    def _buzz(self):
+        """ Executes commands one at a time for their full duration like the glove firmware """
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.commands or not self.running)
+                if not self.running:
+                    return
+                received, motors, duration = self.commands.pop(0)
+            buzz = Buzz(received, perf_counter(), motors, duration)
+            self.buzzes.append(buzz)
+            if self.verbose:
+                names = '+'.join(name for name, on in zip(motor_names, motors) if on == '1')
+                print(f"...{names:<16} {duration:>4}ms  waited {1000 * (buzz.started - received):7.1f}ms")
+            sleep(duration / 1000)
+
+    def summary(self):
+        """ Commands executed and how long they waited behind earlier buzzes, in milliseconds """
+        waits = sorted(1000 * (b.started - b.received) for b in self.buzzes)
+        summary = dict(buzzes=len(self.buzzes), backlog=len(self.commands), invalid=self.invalid)
+        if waits:
+            summary.update(mean_wait_ms=sum(waits) / len(waits), p95_wait_ms=waits[int(0.95 * (len(waits) - 1))],
+                           max_wait_ms=waits[-1])
+        return summary
+
+    def stop(self):
+        """ Stops both threads and closes the pseudo-terminal """
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        os.close(self.slave)
+        os.close(self.master)
+
+
+if __name__ == "__main__":
+    glove = GloveEmulator().start()
+    print(f"Glove emulator listening on {glove.port}")
+    print("Set com_port in config.py to this device, Ctrl+C to stop")
+    try:
+        while True:
+            sleep(1)
+    except KeyboardInterrupt:
+        pass
+    glove.stop()
+    print(f"\nGlove emulator: {glove.summary()}")
@@ -1,46 +1,159 @@
-import mediapipe as mp
-from cv2 import cvtColor, COLOR_BGR2RGB, line
+from time import perf_counter
+import numpy as np
+from cv2 import line, circle, absdiff
 import config as c
+from landmarks import LandmarkBuffer, target_centre
+from frame_prep import FramePrep
 
 
-def track_hand(frame, hands):
-    """ This is a doc string """
+def track_hand(image, hands):
+    """ Runs MediaPipe hand detection on an RGB image (FramePrep.rgb() or FramePrep.rgb_crop()) """
 
-    # Convert frame for mediapipe
-    image = cvtColor(frame, COLOR_BGR2RGB)
-    # Set writeable flag to false for improved performance
+    # MediaPipe needs contiguous memory, FramePrep views already are so this only copies other callers' arrays
+    image = np.ascontiguousarray(image)
+    # Set writeable flag to false for improved performance, restored as the buffer is reused next frame
     image.flags.writeable = False
-    # Perform hand detections
-    results = hands.process(image)
-    return results
+    try:
+        # Perform hand detections
+        return hands.process(image)
+    finally:
+        image.flags.writeable = True
 
 
-def draw_landmarks(frame, results, selection):
-    """ This is a doc string """
+def draw_landmarks(frame, landmarks, selection):
+    """ Draws hand skeletons and a line from every landmark to the selected target """
+    target = tuple(int(v) for v in np.rint(target_centre(selection)))
+    for hand in landmarks:
+        points = [(int(x), int(y)) for x, y in hand]
+        for start, end in hand_connections:
+            line(frame, points[start], points[end], (250, 44, 250), 2)
+        for point in points:
+            circle(frame, point, 4, (121, 22, 76), 2)
+            # Draw lines from all landmarks to selected target
+            line(frame, point, target, (255, 0, 0), 1)
 
-    # Create empty list of landmarks
-    landmark_list = []
 
-    if results.multi_hand_landmarks:
-        for idx, hand in enumerate(results.multi_hand_landmarks):
-            mp_drawing.draw_landmarks(frame, hand, mp_hands.HAND_CONNECTIONS,
-                                      mp_drawing.DrawingSpec(color=(121, 22, 76), thickness=2, circle_radius=4),
-                                      mp_drawing.DrawingSpec(color=(250, 44, 250), thickness=2, circle_radius=2),)
+class HandScheduler:
+    """
+    Decides per frame whether and where to run MediaPipe
+    Inference runs on an expanded ROI around the last known hand and falls back to the full frame when
+    the hand is lost. Frames whose ROI shows no motion against the last inference frame reuse the previous
+    landmarks, up to c.hand_max_skip frames in a row
+    MediaPipe's tracking mode follows the hand from the previous image's landmarks, which only line up while the
+    crop keeps its place and size, so the ROI is held until the hand reaches its border and crops go to their own
+    tracking instance, the caller's instance only ever sees full frames
+    """
+    def __init__(self, hands, buffer=None):
+        """ Initialises scheduling state for a MediaPipe hands solution (tracking mode, used on full frames) """
+        self.hands = hands
+        self.crop_hands = None          # Tracking mode instance for ROI crops, created on the first crop
+        self.window = None              # Held ROI (x, y, w, h), None while the hand is lost
+        self.buffer = buffer if buffer is not None else landmark_buffer
+        self.landmarks = self.buffer.pixels[:0]     # Last result, empty until a hand is found
+        self.reference = None           # Downscaled grey frame from the last inference
+        self.prep = FramePrep()         # Used when process() is given a plain BGR frame
+        self.skipped_in_row = 0
+        self.measured = False           # True if the last process() call ran inference
+        self.frames = 0
+        self.inferences = 0
+        self.cropped = 0
+        self.skipped = 0
+        self.started = perf_counter()
 
-            # Draw lines from all landmarks to selected target and create a list of landmark coordinates
-            target_x = int(round(selection[0] + (selection[2] / 2), 0))
-            target_y = int(round(selection[1] + (selection[3] / 2), 0))
-            for idx2, landmark in enumerate(hand.landmark):
-                landmark_list.append([idx2, int(landmark.x * c.cam_width), int(landmark.y * c.cam_height)])
-                line(frame, (int(hand.landmark[idx2].x * c.cam_width), int(hand.landmark[idx2].y * c.cam_height)),
-                     (target_x, target_y), (255, 0, 0), 1)
+    def roi(self, frame_shape):
+        """ Expanded bounding box (x, y, w, h) around the last landmarks, held until the hand nears its border """
+        height, width = frame_shape[:2]
+        points = self.landmarks.reshape(-1, 2)
+        x0, y0 = points.min(axis=0)
+        x1, y1 = points.max(axis=0)
+        if self.window is not None:
+            x, y, w, h = self.window
+            ex, ey = int(c.hand_roi_edge * w), int(c.hand_roi_edge * h)
+            # Border edges on the frame boundary don't count, the hand can't leave the crop that way
+            inside = ((x0 >= x + ex or x == 0) and (y0 >= y + ey or y == 0) and
+                      (x1 <= x + w - ex or x + w == width) and (y1 <= y + h - ey or y + h == height))
+            if inside:
+                return self.window
+        # Grow by a fraction of the hand size on every side with a floor so small hands keep some context
+        pad = max(int(c.hand_roi_margin * max(x1 - x0, y1 - y0)), c.hand_roi_min // 2)
+        x0, y0 = max(int(x0) - pad, 0), max(int(y0) - pad, 0)
+        x1, y1 = min(int(x1) + pad, width), min(int(y1) + pad, height)
+        self.window = x0, y0, x1 - x0, y1 - y0
+        return self.window
 
-    return landmark_list
+    def moved(self, grey, roi):
+        """ Cheap frame differencing inside the ROI against the last inference frame """
+        if self.reference is None:
+            return True
+        f = c.hand_motion_scale
+        x, y, w, h = (v // f for v in roi)
+        diff = absdiff(grey[y:y + h + 1, x:x + w + 1], self.reference[y:y + h + 1, x:x + w + 1])
+        return diff.size == 0 or float(diff.mean()) > c.hand_motion_thresh
+
+    def process(self, prep):
+        """
+        Returns the (hands x 21 x 2) landmark array for this frame, running inference only when needed
+        prep is the frame's FramePrep (a BGR array is also accepted) so conversions are shared with other stages
+        """
+        if not isinstance(prep, FramePrep):
+            prep = self.prep.load(prep)
+        self.frames += 1
+        frame = prep.image
+        grey = prep.grey(c.hand_motion_scale)
+        if len(self.landmarks) > 0:
+            roi = self.roi(frame.shape)
+            if self.skipped_in_row < c.hand_max_skip and not self.moved(grey, roi):
+                self.skipped += 1
+                self.skipped_in_row += 1
+                self.measured = False
+                return self.landmarks
+            # Hand was visible last time so look for it near where it was
+            if self.crop_hands is None:
+                self.crop_hands = mp_hands.Hands(min_detection_confidence=c.mp_detect_conf,
+                                                 min_tracking_confidence=c.mp_track_conf, max_num_hands=c.max_hands)
+            self.landmarks = self.buffer.fill(track_hand(prep.rgb_crop(roi), self.crop_hands), roi)
+            self.inferences += 1
+            self.cropped += 1
+        if len(self.landmarks) == 0:
+            # Hand lost or never found, search the whole frame
+            self.window = None
+            self.landmarks = self.buffer.fill(track_hand(prep.rgb(), self.hands))
+            self.inferences += 1
+        # The grey view is overwritten by the next frame so keep a copy in a reused buffer
+        if self.reference is None or self.reference.shape != grey.shape:
+            self.reference = np.empty_like(grey)
+        np.copyto(self.reference, grey)
+        self.skipped_in_row = 0
+        self.measured = True
+        return self.landmarks
+
+    def close(self):
+        """ Releases the crop instance, the tracking instance belongs to the caller """
+        self.crop_hands.close() if self.crop_hands is not None else None
+        self.crop_hands = None
+
+    def stats(self):
+        """ Effective hand tracking rate and how frames were handled """
+        elapsed = perf_counter() - self.started
+        return dict(inference_hz=self.inferences / elapsed if elapsed else 0.0,
+                    frame_hz=self.frames / elapsed if elapsed else 0.0,
+                    frames=self.frames, inferences=self.inferences, cropped=self.cropped, skipped=self.skipped)
+
+
+def init():
+    """ Imports MediaPipe (slow) and creates the hand tracker objects """
+    global mp_hands, hand_connections, landmark_buffer
+    import mediapipe as mp
+    print("\nCreating hand tracker object")
+    mp_hands = mp.solutions.hands
+    hand_connections = tuple(mp_hands.HAND_CONNECTIONS)
+    landmark_buffer = LandmarkBuffer()
+    print("Hand tracker created")
+    return mp_hands
 
 
 # ------------------------------------------------------------------------------
-# Initialise hand tracker
-print("\nCreating hand tracker object")
-mp_drawing = mp.solutions.drawing_utils
-mp_hands = mp.solutions.hands
-print("Hand tracker created")
\ No newline at end of file
+# Hand tracker is created by init() during startup
+mp_hands = None
+hand_connections = ()
+landmark_buffer = None
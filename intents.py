@@ -0,0 +1,80 @@
+from collections import namedtuple
+import re
+
+# Recognised command, objects holds the class names mentioned in order (select only)
+Intent = namedtuple('Intent', ['name', 'objects', 'text'])
+
+# Command grammar in priority order (first wins when an utterance contains several commands)
+# Each entry is the intent name, the phrase pattern and whether the command takes an object name slot
+grammar = (('stop', r'stop|cancel', False),
+           ('intro', r'introduce yourself', False),
+           ('scan', r'scan', False),
+           ('list', r'list', False),
+           ('select', r'select', True),
+           ('awake', r'awake', False),
+           ('sleep', r'sleep', False),
+           ('exit', r'exit', False),
+           ('wake', r'surah', False))
+
+# Intents accepted while Surah is asleep and while she is awake (stop ends guidance or cuts Surah off)
+SLEEPING = frozenset(('exit', 'wake'))
+AWAKE = frozenset(name for name, _, _ in grammar if name != 'wake')
+
+command_pattern = re.compile('|'.join(rf'(?P<{name}>\b(?:{phrase})\b)' for name, phrase, _ in grammar), re.I)
+priority = dict((name, idx) for idx, (name, _, _) in enumerate(grammar))
+takes_object = dict((name, slot) for name, _, slot in grammar)
+
+
+class IntentMatcher:
+    """
+    Matches partial or final transcripts against the command grammar
+    Object names are resolved through an index built once from the class names, so a command fires
+    as soon as its intent and object are unambiguous rather than after the end of speech
+    """
+    def __init__(self, object_names):
+        """ Builds the object name index and pattern, longest names first so 'hot dog' wins over 'dog' """
+        self.index = dict((name.lower(), name) for name in object_names)
+        names = sorted(self.index, key=len, reverse=True)
+        self.object_pattern = re.compile(r'\b(' + '|'.join(map(re.escape, names)) + r')s?\b', re.I)
+        # Names that may still grow into a longer name while the user is speaking (e.g. 'baseball' -> 'baseball bat')
+        self.extendable = frozenset(n for n in names if any(o.startswith(n + ' ') for o in names))
+        # Leading words of names that contain a command (e.g. 'stop' of 'stop sign'), a partial transcript ending
+        # in one waits for the next word before the command is taken
+        leading = (' '.join(n.split()[:i]) for n in names for i in range(1, len(n.split())))
+        self.command_prefixes = frozenset(p for p in leading if command_pattern.search(p))
+
+    def objects(self, text, final):
+        """ Object names in order of mention, None while the last one in a partial transcript could still grow """
+        found = []
+        end = len(text.rstrip())
+        for match in self.object_pattern.finditer(text):
+            name = match.group(1).lower()
+            if not final and match.end() == end and name in self.extendable:
+                return None
+            found.append(self.index[name]) if self.index[name] not in found else None
+        return tuple(found)
+
+    def match(self, text, final=True, allowed=None):
+        """
+        Returns the Intent for a transcript, or None if a partial transcript is not yet unambiguous
+        A final transcript always yields an Intent, 'unknown' when no allowed command was found
+        """
+        if not final and text.rstrip().lower().endswith(tuple(' ' + p for p in self.command_prefixes)):
+            return None
+        # Object names are blanked out so command words inside them (e.g. 'stop sign') are not taken as commands
+        commands = self.object_pattern.sub(lambda match: ' ' * len(match.group(0)), text)
+        best = None
+        for match in command_pattern.finditer(commands):
+            name = match.lastgroup
+            if allowed is not None and name not in allowed:
+                continue
+            if best is None or priority[name] < priority[best]:
+                best = name
+        if best is None:
+            return Intent('unknown', (), text) if final else None
+        if not takes_object[best]:
+            return Intent(best, (), text)
+        objects = self.objects(text, final)
+        if not final and not objects:
+            return None
+        return Intent(best, objects or (), text)
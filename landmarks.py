@@ -0,0 +1,66 @@
+import numpy as np
+import config as c
+
+NUM_LANDMARKS = 21
+X_CODES = ('l', 'x', 'r')           # Indexed by quantised x direction + 1
+Y_CODES = ('fw', 'y', 'bw')         # Indexed by quantised y direction + 1
+
+
+class LandmarkBuffer:
+    """
+    Preallocated (hands x 21 x 2) landmark arrays reused on every frame
+    Pixel coordinates are int32 to match the drawing functions, normalised coordinates are float32
+    """
+    def __init__(self, max_hands=c.max_hands, width=c.cam_width, height=c.cam_height):
+        """ Allocates buffers once for the maximum number of hands """
+        self.normalised = np.zeros((max_hands, NUM_LANDMARKS, 2), dtype=np.float32)
+        self.scaled = np.zeros((max_hands, NUM_LANDMARKS, 2), dtype=np.float32)
+        self.pixels = np.zeros((max_hands, NUM_LANDMARKS, 2), dtype=np.int32)
+        self.scale = np.array([width, height], dtype=np.float32)
+
+    def fill(self, results, roi=None):
+        """
+        Copies MediaPipe output into the buffers and returns a (hands x 21 x 2) int32 view
+        roi (x, y, w, h) maps landmarks detected on a cropped image back to full frame pixels
+        The view is overwritten by the next call so callers must not hold on to it between frames
+        """
+        hands = results.multi_hand_landmarks or ()
+        n = min(len(hands), len(self.pixels))
+        for h in range(n):
+            norm = self.normalised[h]
+            for i, landmark in enumerate(hands[h].landmark):
+                norm[i, 0] = landmark.x
+                norm[i, 1] = landmark.y
+        # Single vectorised scale and truncation to pixels for all hands
+        if roi is None:
+            np.multiply(self.normalised[:n], self.scale, out=self.scaled[:n])
+        else:
+            np.multiply(self.normalised[:n], np.array(roi[2:], dtype=np.float32), out=self.scaled[:n])
+            self.scaled[:n] += np.array(roi[:2], dtype=np.float32)
+        self.pixels[:n] = self.scaled[:n]
+        return self.pixels[:n]
+
+
+def target_centre(selection):
+    """ Centre of an (x, y, w, h) bounding box as float coordinates """
+    return np.array([selection[0] + selection[2] / 2, selection[1] + selection[3] / 2], dtype=np.float32)
+
+
+def guidance_measure(landmarks, selection, tolerance=c.target_tolerance):
+    """
+    Single vectorised pass over all hands and landmarks
+    Returns (hand index, landmark index, closest landmark (x, y), distance in px, x code, y code, target (x, y))
+    Direction codes match the glove/voice protocol: l/x/r and fw/y/bw
+    """
+    centre = target_centre(selection)
+    target = np.rint(centre).astype(np.int32)
+    offsets = centre - landmarks.reshape(-1, 2)
+    dists = np.hypot(offsets[:, 0], offsets[:, 1])
+    closest = int(np.argmin(dists))
+    hand, idx = divmod(closest, NUM_LANDMARKS)
+    point = landmarks[hand, idx]
+    # Quantise direction to -1/0/+1 on each axis using the rounded target as the original logic did
+    delta = target - point
+    quantised = (delta > tolerance).astype(np.int8) - (delta < -tolerance).astype(np.int8)
+    return (hand, idx, (int(point[0]), int(point[1])), int(np.rint(dists[closest])),
+            X_CODES[quantised[0] + 1], Y_CODES[quantised[1] + 1], (int(target[0]), int(target[1])))
@@ -1,11 +1,20 @@
 from sys import exit
+import asyncio
 import cv2
 import config as c
 import voice_assistant as va                  # Custom module for voice assistant
 import object_detect as ssd                   # Custom module for SSD mobilenet
 import guidance_system as gs                  # Custom module for hand guidance system
 import video_thread as vt                     # Custom module for video threading solution
-print("\nAll module dependencies initialised")
+import hand_track as ht                       # Custom module for mediapipe hand tracking
+import speech_backends as sb                  # Custom module for speech recognition and synthesis backends
+import tone                                   # Custom module for beep mode guidance tones
+import telemetry as tm
+from scanner import BackgroundScanner
+from startup import StartupOrchestrator, BACKGROUND, LAZY
+from intents import IntentMatcher
+from runtime import AssistantRuntime
+print("\nAll module dependencies imported")
 
 # Check guidance mode contains a valid value
 print("\nChecking guidance parameter")
@@ -15,152 +24,310 @@ else:
     print("Invalid selection on guidance mode parameter. Check config file.")
     exit()      # sys.exit as per best practice for production code
 
-# # Initialise camera
-cap = vt.assign_base_cam()
+
+def prewarm_class_names(surah, detections):
+    """ Prewarm class names and selection confirmations for every class the detector can name """
+    if c.tts_prewarm:
+        return surah.prewarm(detections.coco_names + [name + " selected." for name in detections.coco_names])
+
+
+def start_scanner(camera, engine):
+    """ Starts the background scanner paused, it runs only while Surah is awake """
+    return BackgroundScanner(camera, engine).start()
+
+
+# Initialise subsystems concurrently. Only the voice assistant, microphone and class names are needed
+# before "Startup complete" (and the glove in glove mode, so a missing glove ends the program straight away), the rest
+# continue in the background until first use. The tone output only starts with the first guidance session in beep mode
+boot = StartupOrchestrator()
+boot.register('voice', va.init)
+boot.register('microphone', va.VoiceAssistant.calibrate, deps=('voice',))
+boot.register('classes', ssd.load_classes)
+boot.register('detector', ssd.start_engine, policy=BACKGROUND)
+boot.register('camera', vt.assign_base_cam, policy=BACKGROUND)
+boot.register('hands', ht.init, policy=BACKGROUND)
+boot.register('glove', gs.init_glove) if c.guidance_mode == 'glove' else None
+boot.register('tone', tone.init, policy=LAZY) if c.guidance_mode == 'beep' else None
+boot.register('cue_prewarm', lambda surah: gs.prewarm_cues(), deps=('voice',), policy=BACKGROUND)
+boot.register('class_prewarm', prewarm_class_names, deps=('voice', 'classes'), policy=BACKGROUND)
+boot.register('scanner', start_scanner, deps=('camera', 'detector'), policy=BACKGROUND) if c.scan_background else None
+boot.start()
+try:
+    boot.wait_eager()
+except (OSError, ValueError) as err:
+    # Surah can't run without the class names (or the glove in glove mode), end before she reports startup complete
+    print(f"Program ended during startup: {err}")
+    boot.shutdown()
+    exit()
 
 # Voice confirmation of system initialisation
 print("\nStartup completed")
+print(boot.report())
 va.surah.respond(va.surah.dict['startup'], 0)
 print("User informed of startup completion")
 
-# Run until Surah is set to surah.operational = False
-while va.surah.operational:
-
-    # Capture voice input
-    print("\nListening for user input")
-    request = va.surah.capture_input()
-
-    # --------------------------------------------------------------------------------------
-    # Option to exit without waking Surah
-    if 'exit' in request:
-        print("\nSurah says goodbye and the program ends")
-        va.surah.respond(va.surah.dict['exit'], 0)
-        va.surah.operational = False
-
-    # --------------------------------------------------------------------------------------
-    # Check for Surah trigger word
-    if 'Surah' in request:
-        va.surah.respond(va.surah.dict['surah'], 0)
-        va.surah.awake = True
-        print("\nSurah is awake")
-
-        # --- INNER CONTROL LOOP STARTS HERE ---
-        while va.surah.awake:
-
-            # Capture voice input for next request
-            print("\nListening for user input")
-            request = va.surah.capture_input()
-
-            # If statement controls the flow of the interaction between Surah and the user
-            # ------------------------------------------------------------------------------
-            if 'introduce yourself' in request:
-                print("\nSurah introduces herself")
-                va.surah.respond(va.surah.dict['intro'], 0)
-
-            # ------------------------------------------------------------------------------
-            elif 'scan' in request:
-                print("\nDetecting objects")
-                va.surah.respond(va.surah.dict['scan'], 0)
-                print("...Clearing previous detection data")
-                ssd.detections.clear_previous_detections()
-
-                # Access cam feed from background and make single frame detection
-                _, frame = cap.read()
-                ssd.detections.get_detections(frame)
-
-                # Provide user with results of object detect request
-                print(f"...Number of objects detected: {len(ssd.detections.detected_ids)}")
-                print(f"\t{ssd.detections.detected_names}") if len(ssd.detections.detected_ids) > 0 else None
-                if len(ssd.detections.detected_ids) == 0:
-                    va.surah.respond(va.surah.dict['no_detections'], 0)
-                else:
-                    va.surah.respond(va.surah.dict['detections'], 0)
-                    for name in ssd.detections.detected_names:
-                        va.surah.respond(name, 0)
-                    va.surah.respond(va.surah.dict['detections_complete'], 0)
-                    print("Detection complete")
-
-            # ------------------------------------------------------------------------------
-            # Repeat list of detected objects
-            elif 'list' in request:
-                print("\nRepeating list of detected objects")
-                va.surah.respond(va.surah.dict['detections_memory'], 0)
-                for name in ssd.detections.detected_names:
-                    va.surah.respond(name, 0)
-                print("Repeat list of detections complete")
-
-            # ------------------------------------------------------------------------------
-            # Object selection and guidance system loop
-            elif 'select' in request:
-                print("\nSelecting an object")
-                # Check scan has been performed.
-                if len(ssd.detections.detected_ids) == 0:
-                    print("...Can't select an object as scan not yet performed")
-                    va.surah.respond(va.surah.dict['no_scan'], 0)
-                else:
-                    # Check each entry in detected objects to see if it is selected (boolean vector)
-                    if ssd.detections.validate_object_selection(request) == 0:
-                        print("...Invalid object selection")
-                        va.surah.respond(va.surah.dict['invalid_selection'], 0)
-                        print("Object selection complete")
-                    elif ssd.detections.validate_object_selection(request) == 2:
-                        print("...Multiple object selection")
-                        va.surah.respond(va.surah.dict['multiple_selection'], 0)
-                        print("Object selection complete")
-                    else:
-                        print(f'...{ssd.detections.selected_object} selected')
-                        va.surah.respond(ssd.detections.selected_object + " selected.", 0)
-                        va.surah.respond(va.surah.dict['selection_made'], 1)
-                        print("Object selection complete")
-
-                        # Start showing video frames
-                        print("\nEntering guidance system")
-                        vt.thread_video_show()
-                        print("\nGuidance complete")
-
-                        # Reassign camera variables due to persistence issue
-                        print("\nResetting cap variable due to persistence issue with multi-threading")
-                        va.surah.respond(va.surah.dict['reset_cam'], 1)
-                        cap = vt.assign_base_cam()
-                        va.surah.respond(va.surah.dict['reset_comp'], 0)
-                        print("Reset complete")
-
-            # ------------------------------------------------------------------------------
-            elif 'awake' in request:
-                print("\nSurah confirms she is still awake")
-                va.surah.respond(va.surah.dict['awake'], 0)
-
-            # ------------------------------------------------------------------------------
-            # Send Surah to sleep without exiting the program. Background listens for trigger
-            elif 'sleep' in request:
-                print("\nSurah informs she is going to sleep")
-                va.surah.respond(va.surah.dict['sleep'], 0)
-                va.surah.awake = False
-
-            # ------------------------------------------------------------------------------
-            elif 'exit' in request:
+# Command grammar resolves object names against every class the detector can name
+commands = IntentMatcher(ssd.detections.coco_names)
+
+
+async def scan(rt):
+    """ Scans for objects, from the background scan when it is current, and announces them """
+    print("\nDetecting objects")
+    print("...Clearing previous detection data")
+    ssd.detections.clear_previous_detections()
+
+    # Nothing to scan without a camera (e.g. none connected when Surah started)
+    camera = await rt.optional('camera')
+    if camera is None:
+        print("...Camera unavailable, scan skipped")
+        await rt.say(va.surah.dict['no_camera'])
+        return
+
+    # Answer from the background scan when the scene was confirmed unchanged recently
+    scanner = await rt.optional('scanner') if c.scan_background else None
+    cached = scanner.fresh() if scanner is not None else None
+    if cached is not None:
+        print(f"...Using background scan of frame {cached.frame_id}")
+        ssd.detections.store_detections(*cached.detections)
+    else:
+        # Submit the latest frame to the detection engine and speak while inference runs
+        frame = await rt.blocking(camera.wait_for_frame)
+        # The camera timed out or a video file source has ended
+        if frame is None:
+            print("...No camera frame available, scan skipped")
+            await rt.say(va.surah.dict['no_camera'])
+            return
+        if scanner is not None:
+            scan_result = await rt.blocking(scanner.submit, frame)
+        else:
+            scan_result = await rt.blocking((await rt.require('detector')).submit, frame.image, block=True)
+        await rt.say(va.surah.dict['scan'])
+        try:
+            ssd.detections.store_detections(*await asyncio.wrap_future(scan_result))
+        except Exception as err:
+            # The engine fails every request if its model could not be loaded, or an inference can fail
+            print(f"...Detection failed: {err}")
+            await rt.say(va.surah.dict['no_detector'])
+            return
+
+    # Provide user with results of object detect request
+    print(f"...Number of objects detected: {len(ssd.detections.detected_ids)}")
+    print(f"\t{ssd.detections.detected_names}") if len(ssd.detections.detected_ids) > 0 else None
+    if len(ssd.detections.detected_ids) == 0:
+        await rt.say(va.surah.dict['no_detections'])
+    else:
+        # Announced as one batch so later names are synthesised while the first are spoken
+        await rt.say_many([va.surah.dict['detections'], *ssd.detections.detected_names,
+                           va.surah.dict['detections_complete']])
+        print("Detection complete")
+
+
+async def select(rt, intent, store=True):
+    """
+    Validates an object selection, returns the (name, box) of the one detected object selected or None
+    store=False leaves the current selection alone (guidance in progress)
+    """
+    print("\nSelecting an object")
+    # Check scan has been performed.
+    if len(ssd.detections.detected_ids) == 0:
+        print("...Can't select an object as scan not yet performed")
+        await rt.say(va.surah.dict['no_scan'])
+        return None
+    # Check each entry in detected objects to see if it is selected (boolean vector)
+    selection, name, box = ssd.detections.validate_object_selection(intent.objects, store)
+    if selection == 0:
+        print("...Invalid object selection")
+        await rt.say(va.surah.dict['invalid_selection'])
+    elif selection == 2:
+        print("...Multiple object selection")
+        await rt.say(va.surah.dict['multiple_selection'])
+    else:
+        print(f'...{name} selected')
+    print("Object selection complete")
+    return (name, box) if selection == 1 else None
+
+
+async def resume_scanner(rt):
+    """ Background scanning runs while Surah is awake, if the camera and detector it needs are available """
+    scanner = await rt.optional('scanner') if c.scan_background else None
+    scanner.resume() if scanner is not None else None
+
+
+async def start_guidance(rt):
+    """ Starts guiding the hand in the background, the control loop keeps listening for stop or a new selection """
+    print("\nEntering guidance system")
+    camera = await rt.optional('camera')
+    if camera is None:
+        print("...Camera unavailable, guidance not started")
+        await rt.say(va.surah.dict['no_camera'])
+        return
+    # Hand tracking and the guidance mode's feedback output, either may have failed to start (e.g. no audio device)
+    needed = ('hands',) + dict(glove=('glove',), beep=('tone',)).get(c.guidance_mode, ())
+    for name in needed:
+        if await rt.optional(name) is None:
+            print(f"...{name} unavailable, guidance not started")
+            await rt.say(va.surah.dict['no_guidance'])
+            return
+    # Detection is not needed while guiding, leave the cores to the guidance loop
+    scanner = await rt.optional('scanner') if c.scan_background else None
+    scanner.pause() if scanner is not None else None
+    task = rt.start_guidance(vt.thread_video_show, camera)
+
+    def finished(done):
+        scanner.resume() if scanner is not None and va.surah.awake else None
+        if done.exception() is not None:
+            tm.warning('Guidance failed: %r', done.exception())
+        print("\nGuidance complete")
+    task.add_done_callback(finished)
+
+
+async def control_loop(rt):
+    """ Handles one command at a time while voice capture and guidance carry on in the background """
+    rt.start()
+    # Run until Surah is set to surah.operational = False
+    while va.surah.operational:
+        intent = await rt.next_intent()
+
+        # --------------------------------------------------------------------------------------
+        # While asleep only exit and Surah's name are listened for
+        if not va.surah.awake:
+            # Option to exit without waking Surah
+            if intent.name == 'exit':
                 print("\nSurah says goodbye and the program ends")
-                va.surah.respond(va.surah.dict['exit'], 0)
-                va.surah.awake = False
+                await rt.say(va.surah.dict['exit'])
                 va.surah.operational = False
 
-            # ------------------------------------------------------------------------------
-            # If utterance does not contain a known command give error
-            # Flag provided so that unrecognised speech capture error is not duplicated
-            else:
-                print("\nVoice assistant reports unknown user request")
-                va.surah.respond(va.surah.dict['unknown'], 0) if va.surah.unheard == 0 else None
+            # Check for Surah trigger word
+            elif intent.name == 'wake':
+                va.surah.awake = True
+                print("\nSurah is awake")
+                await rt.say(va.surah.dict['surah'])
+                await resume_scanner(rt)
+            continue
+
+        # If statement controls the flow of the interaction between Surah and the user
+        # ------------------------------------------------------------------------------
+        # Stop ends guidance, otherwise barge-in has already cut Surah off and there is nothing more to do
+        if intent.name == 'stop':
+            if rt.is_guiding:
+                print("\nStopping guidance")
+                await rt.stop_guidance()
+
+        # ------------------------------------------------------------------------------
+        # Selecting another object during guidance moves guidance to it without leaving the loop
+        elif intent.name == 'select' and rt.is_guiding:
+            selected = await select(rt, intent, store=False)
+            if selected is not None:
+                name, box = selected
+                # Guidance may have ended while the selection was validated, then there is nothing to confirm
+                if rt.guidance.retarget(name, box, rt.heard_at):
+                    await rt.say(name + " selected.")
+                else:
+                    print(f"...Guidance ended before {name} could be selected")
+
+        # ------------------------------------------------------------------------------
+        # Scanning or listing would need the camera and the user's attention, both are busy guiding
+        elif intent.name in ('intro', 'scan', 'list') and rt.is_guiding:
+            await rt.say(va.surah.dict['guiding'])
+
+        # ------------------------------------------------------------------------------
+        elif intent.name == 'intro':
+            print("\nSurah introduces herself")
+            await rt.say(va.surah.dict['intro'])
+
+        # ------------------------------------------------------------------------------
+        elif intent.name == 'scan':
+            await scan(rt)
+
+        # ------------------------------------------------------------------------------
+        # Repeat list of detected objects
+        elif intent.name == 'list':
+            print("\nRepeating list of detected objects")
+            # Refresh from the background scan if it is current, otherwise repeat the last scan
+            scanner = await rt.optional('scanner') if c.scan_background else None
+            cached = scanner.fresh() if scanner is not None else None
+            ssd.detections.store_detections(*cached.detections) if cached is not None else None
+            await rt.say_many([va.surah.dict['detections_memory'], *ssd.detections.detected_names])
+            print("Repeat list of detections complete")
+
+        # ------------------------------------------------------------------------------
+        # Object selection and guidance system
+        elif intent.name == 'select':
+            selected = await select(rt, intent)
+            if selected is not None:
+                await rt.say(selected[0] + " selected.")
+                await rt.blocking(va.surah.respond, va.surah.dict['selection_made'], 1)
+                await start_guidance(rt)
+
+        # ------------------------------------------------------------------------------
+        elif intent.name == 'awake':
+            print("\nSurah confirms she is still awake")
+            await rt.say(va.surah.dict['awake'])
+
+        # ------------------------------------------------------------------------------
+        # Send Surah to sleep without exiting the program. Background listens for trigger
+        elif intent.name == 'sleep':
+            await rt.stop_guidance()
+            print("\nSurah informs she is going to sleep")
+            va.surah.awake = False
+            await rt.say(va.surah.dict['sleep'])
+            scanner = await rt.optional('scanner') if c.scan_background else None
+            scanner.pause() if scanner is not None else None
+
+        # ------------------------------------------------------------------------------
+        elif intent.name == 'exit':
+            await rt.stop_guidance()
+            print("\nSurah says goodbye and the program ends")
+            await rt.say(va.surah.dict['exit'])
+            va.surah.awake = False
+            va.surah.operational = False
+
+        # ------------------------------------------------------------------------------
+        # If utterance does not contain a known command give error
+        # Flag provided so that unrecognised speech capture error is not duplicated
+        else:
+            print("\nVoice assistant reports unknown user request")
+            await rt.say(va.surah.dict['unknown']) if va.surah.unheard == 0 else None
+
+    await rt.close()
+
+
+# Voice capture, command handling and guidance run concurrently until Surah is told to exit
+runtime = AssistantRuntime(va.surah, commands, boot)
+asyncio.run(control_loop(runtime))
+print(f"\nCommand latency: {runtime.stats()}")
 
 
 # Close glove connection if using glove mode
 gs.close_glove() if c.guidance_mode == 'glove' else None
+tone.stop() if c.guidance_mode == 'beep' else None
+
+# Stop background scanner before the camera and detection engine it uses (any that failed to start are skipped)
+scanner = boot.started('scanner')
+if scanner is not None:
+    scanner.stop()
+    print(f"\nBackground scanner: {scanner.stats()}")
+
+# Stop camera service and destroy camera window
+camera = boot.started('camera')
+camera.stop() if camera is not None else None
+if not c.headless:
+    cv2.destroyAllWindows()
+    print("\nCamera windows destroyed")
 
-# Release cap and destroy camera window
-cap.release()
-cv2.destroyAllWindows()
-print("\nCamera windows destroyed")
+# Report speech cache effectiveness and backend latency for the session and stop playback and synthesis workers
+print(f"\nSpeech cache: {va.surah.cache.stats()}")
+print(f"Speech backend latency: {sb.latency_stats()}")
+print(f"Spoken lists: {va.surah.batch_stats()}")
+va.surah.player.stop()
+va.surah.synth_pool.shutdown()
 
-# Destroy objects
+# Stop detection engine and destroy objects
+detector = boot.started('detector')
+detector.stop() if detector is not None else None
+print(f"\nDetection cascade: {detector.stats()}") if detector is not None and c.scan_tiled else None
+print(boot.report())
+boot.shutdown()
 del ssd.detections, va.surah
 print("All objects deleted")
 print("Program ended successfully")
@@ -0,0 +1,97 @@
+from contextlib import contextmanager, redirect_stdout
+from multiprocessing import shared_memory
+from time import perf_counter
+from types import ModuleType
+import os
+import sys
+import numpy as np
+import config as c
+from frame_prep import FramePrep
+
+
+class FrameRing:
+    """
+    Fixed number of frame slots in shared memory
+    The guidance process writes each frame into a slot once and the worker processes attach to the same
+    memory by name, so only the slot index and frame ID cross the process boundary
+    """
+    def __init__(self, slots, shape, name=None):
+        """ Creates the shared block, or attaches to an existing one when name is given """
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=slots * int(np.prod(shape)))
+        self.frames = np.ndarray((slots,) + tuple(shape), dtype=np.uint8, buffer=self.shm.buf)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self):
+        """ Releases the view and the mapping, the creating process also frees the memory """
+        self.frames = None
+        self.shm.close()
+        self.shm.unlink() if self.owner else None
+
+
+def hand_worker(ring_name, slots, shape, requests, results):
+    """ Worker process running MediaPipe hand tracking on published frames """
+    import hand_track as ht                   # MediaPipe is imported in this process only
+    # The guidance process has already reported hand tracker initialisation
+    with open(os.devnull, 'w') as null, redirect_stdout(null):
+        ht.init()
+    ring = FrameRing(slots, shape, ring_name)
+    with ht.mp_hands.Hands(min_detection_confidence=c.mp_detect_conf,
+                           min_tracking_confidence=c.mp_track_conf,
+                           max_num_hands=c.max_hands) as hands:
+        scheduler = ht.HandScheduler(hands)
+        prep = FramePrep()
+        while True:
+            request = requests.get()
+            if request is None:
+                break
+            slot, frame_id = request
+            start = perf_counter()
+            landmarks = scheduler.process(prep.load(ring.frames[slot]))
+            results.put(('hand', slot, frame_id, landmarks.copy(), perf_counter() - start))
+        scheduler.close()
+    ring.close()
+
+
+def tracker_worker(ring_name, slots, shape, requests, results, backend):
+    """ Worker process running the object tracker on published frames """
+    import object_tracker as ot
+    ring = FrameRing(slots, shape, ring_name)
+    tracker = None
+    box = None
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        slot, frame_id, init_box, reinit = request
+        frame = ring.frames[slot]
+        start = perf_counter()
+        # Started on the first frame and again whenever a new object is selected during guidance
+        if tracker is None or reinit:
+            tracker = ot.create_tracker(backend)
+            tracker.init(frame, tuple(init_box))
+            box, confidence = tuple(init_box), 1.0
+        else:
+            success, bbox = tracker.update(frame)
+            # Keep the last known box so guidance still has a target
+            box, confidence = (tuple(int(i) for i in bbox), 1.0) if success else (box, 0.0)
+        results.put(('tracker', slot, frame_id, (box, confidence), perf_counter() - start))
+    frame = None
+    ring.close()
+
+
+@contextmanager
+def detached_main():
+    """
+    Hides the main script while worker processes are started
+    Spawned workers otherwise import it again, which would re-run main.py's top level code in every worker
+    """
+    main = sys.modules['__main__']
+    sys.modules['__main__'] = ModuleType('__main__')
+    try:
+        yield
+    finally:
+        sys.modules['__main__'] = main
@@ -1,16 +1,13 @@
-from sys import exit
-from numpy import array, where
+from concurrent.futures import Future
+from math import ceil
+from time import perf_counter
+from numpy import array, asarray, concatenate, empty, flatnonzero, isin, linspace, zeros, float32, int32, intp, uint8
 import cv2
+import queue
 import threading
 import config as c
-
-
-def contains_word(detected_object, user_request):
-    """
-    Detects if a user selected object is in the detected objects list
-    Returns True/False
-    """
-    return f"{detected_object.lower()}" in f"{user_request.lower()}"
+import telemetry as tm
+from frame_prep import FramePrep
 
 
 class Detections:
@@ -21,92 +18,75 @@ class Detections:
     def __init__(self):
         """ Initialises object with all required variables """
         # Create variables for population upon detection
+        # Results are held as parallel arrays (one row per detection surviving NMS)
         self.coco_names = []            # Full class names list for SSD mobilenet model
-        self.detected_ids = []          # Object IDs returned from SSD model
-        self.detected_names = []        # Conversion of IDs into class names
-        self.detections = []            # Object containing detection results data
-        self.prob = []                  # Object detection confidence probability
-        self.bound_box = []             # Bounding boxes
+        self.labels = array([])         # Class names as an array, indexed by class ID - 1
+        self.detected_ids = empty(0, dtype=int32)           # Object IDs returned from SSD model
+        self.detected_names = self.labels                   # Conversion of IDs into class names
+        self.prob = empty(0, dtype=float32)                 # Object detection confidence probability
+        self.bound_box = empty((0, 4), dtype=int32)         # Bounding boxes (x, y, w, h)
         self.selected_object = []       # Holds the user selected object for the guidance system
         self.selected_object_idx = []   # Holds the selection index for ease of access to bounding box data
         self.selected_bound_box = ()    # Holds bound box info for the selected object and requires tuple
-        self.tracker = cv2.TrackerMOSSE_create()  # Defines tracker from opencv library
+        self.track_confidence = 0.0     # Confidence of the latest tracker update for the selected object
         self.guide_tracking = 0         # Flag to indicate active tracking during guidance
 
     def clear_previous_detections(self):
         """ Clears previous data ready for fresh detections """
-        self.detected_ids = []
-        self.detected_names = []
-        self.prob = []
-        self.bound_box = []
-        self.detections = []
+        self.detected_ids = self.detected_ids[:0]
+        self.detected_names = self.labels[:0]
+        self.prob = self.prob[:0]
+        self.bound_box = self.bound_box[:0]
         self.selected_object = []
         self.selected_object_idx = []
         self.selected_bound_box = ()
 
     def get_detections(self, det_frame):
-        """ Performs SSD-NMS and stores required data for later usage """
-        # Make detections with SSD mobilenet model
-        self.detected_ids, prob, bound_box = ssd.detect(det_frame, confThreshold=c.detect_thresh)
-        # When using laptop selfie style cam you need to comment above and use this flipped line below
-        # self.detected_ids, prob, bound_box = ssd.detect(cv2.flip(det_frame, 1), confThreshold=c.detect_thresh)
-        self.prob = list(map(float, list(array(prob).reshape(1, -1)[0])))
-        self.bound_box = list(bound_box)
-        # Use Non-Max Suppression for higher quality detections
-        self.detections = cv2.dnn.NMSBoxes(self.bound_box, self.prob, c.detect_thresh, c.nms_thresh)
+        """ Performs SSD-NMS on the detection engine and waits for the results """
+        # When using laptop selfie style cam you need to pass cv2.flip(det_frame, 1) instead
+        self.store_detections(*engine.submit(det_frame, block=True).result())
+
+    def store_detections(self, detected_ids, prob, bound_box):
+        """ Applies NMS to raw SSD results and stores the surviving detections for later usage """
+        self.detected_ids, self.prob, self.bound_box = suppress(detected_ids, prob, bound_box)
         # Convert detected object IDs into readable names for Surah
-        flat_list = [i for x in self.detected_ids for i in x]
-        self.detected_names = [self.coco_names[i-1] for i in flat_list]
+        self.detected_names = self.labels[self.detected_ids - 1]
 
     def draw_detections(self, draw_frame):
         """ Draws the bounding boxes and class names of detected objects """
-        print("\ndetections:", self.detected_names, self.detected_ids)
-        for detection in self.detections:
-            print(detection)
-            i = detection[0]
-            box = self.bound_box[i]
-            x, y, w, h = box[0], box[1], box[2], box[3]
+        tm.debug("detections: %s %s", self.detected_names, self.detected_ids)
+        for (x, y, w, h), name in zip(self.bound_box.tolist(), self.detected_names):
             cv2.rectangle(draw_frame, (x, y), (x + w, h + y), color=(0, 255, 0), thickness=2)
-            cv2.putText(draw_frame, self.detected_names[i].upper(),
-                        (box[0]+10, box[1]+30), cv2.FONT_HERSHEY_COMPLEX, 1, (0, 255, 0), 1)
-
-    def validate_object_selection(self, request):
-        """ Checks if the user's selection in present in the list of detected objects """
-        # Check each entry in detected objects to see if it is selected (boolean vector with single True
-        selection = [None] * len(self.detected_ids)
-        for idx, name in enumerate(self.detected_names):
-            selection[idx] = contains_word(name, request)
+            cv2.putText(draw_frame, name.upper(), (x + 10, y + 30), cv2.FONT_HERSHEY_COMPLEX, 1, (0, 255, 0), 1)
+
+    def validate_object_selection(self, objects, store=True):
+        """
+        Checks if the user's selection is present in the list of detected objects
+        objects holds the class names resolved from the request by the intent matcher
+        Returns (result, name, bound box): result is 0 for no match, 1 for a single match and 2 for multiple
+        matches, name and box are None unless there was a single match
+        The selection is stored unless store is False, as during guidance where the guidance thread owns it
+        """
+        # Check each entry in detected objects to see if it is selected (boolean vector with single True)
+        selection = flatnonzero(isin(self.detected_names, objects))
         # Check a valid selection is made and return result (should only be single True)
-        if sum(selection) == 0:
-            return 0
-        elif sum(selection) > 1:
-            return 2
-        else:
-            # Store selection
-            self.selected_object_idx = int(where(selection)[0])
-            self.selected_object = self.detected_names[self.selected_object_idx]
-            self.selected_bound_box = tuple(self.bound_box[self.selected_object_idx])
-            return 1
-
-    def initialise_tracker(self, track_frame):
-        """ Initialises tracker """
-        # Initialise tracker
-        self.tracker.init(track_frame, self.selected_bound_box)
-        print("\nObject tracker initialised")
-
-    def track(self, track_frame):
-        """ Updates location of bounding box for tracked object """
-        # Update tracker and convert float values to int
-        success, bbox = self.tracker.update(track_frame)
-        self.selected_bound_box = tuple(int(i) for i in bbox)
-        print(f"...{self.selected_bound_box}")
-        # record tracking status
-        if success:
-            cv2.putText(track_frame, "Tracking", (10, 50), cv2.FONT_HERSHEY_COMPLEX, 0.7, (255, 0, 0))
-            print("...Tracking object")
-        else:
-            cv2.putText(track_frame, "Track Lost", (10, 50), cv2.FONT_HERSHEY_COMPLEX, 0.7, (0, 0, 255))
-            print("...Not tracking, object lost")
+        if len(selection) == 0:
+            return 0, None, None
+        elif len(selection) > 1:
+            return 2, None, None
+        idx = int(selection[0])
+        name, box = str(self.detected_names[idx]), tuple(self.bound_box[idx].tolist())
+        if store:
+            self.selected_object_idx, self.selected_object, self.selected_bound_box = idx, name, box
+        return 1, name, box
+
+    def update_track(self, result):
+        """ Stores the newest TrackResult from the tracker worker """
+        self.selected_bound_box = result.bound_box
+        self.track_confidence = result.confidence
+        if tm.enabled(tm.DEBUG):
+            tm.debug("...%s %s", self.selected_bound_box,
+                     "tracking object" if result.confidence > 0 else "not tracking, object lost")
 
     def draw_tracker(self, draw_frame):
         """ Draws updated bounding box for tracker """
@@ -118,44 +98,293 @@ class Detections:
         cv2.putText(draw_frame, self.selected_object,
                     (self.selected_bound_box[0]+10, self.selected_bound_box[1]+30),
                     cv2.FONT_HERSHEY_COMPLEX, 1, (0, 255, 0), 1)
+        # Record tracking status
+        if self.track_confidence > 0:
+            cv2.putText(draw_frame, "Tracking", (10, 50), cv2.FONT_HERSHEY_COMPLEX, 0.7, (255, 0, 0))
+        else:
+            cv2.putText(draw_frame, "Track Lost", (10, 50), cv2.FONT_HERSHEY_COMPLEX, 0.7, (0, 0, 255))
 
-    def track_thread(self, thread_frame):
-        """ Starts a new thread for tracker so guidance processing can continue """
-        t2 = threading.Thread(target=self.track(thread_frame))
-        t2.start()
 
+def suppress(detected_ids, prob, bound_box):
+    """ Non-Max Suppression over raw SSD results, returns the surviving (class_ids, confidences, boxes) arrays """
+    detected_ids = asarray(detected_ids, dtype=int32).reshape(-1)
+    prob = asarray(prob, dtype=float32).reshape(-1)
+    bound_box = asarray(bound_box, dtype=int32).reshape(-1, 4)
+    # Use Non-Max Suppression for higher quality detections, only the kept rows are returned
+    keep = asarray(cv2.dnn.NMSBoxes(bound_box, prob, c.detect_thresh, c.nms_thresh), dtype=intp).reshape(-1)
+    return detected_ids[keep], prob[keep], bound_box[keep]
 
-# ------------------------------------------------------------------------------
-# Initialise SSD model
-print("\nInitialising SSD object detection module parameters")
-print("...Defining model and parameters")
-ssd = cv2.dnn_DetectionModel(c.weightsPath, c.configPath)
-ssd.setInputSize((320, 320))
-ssd.setInputScale(1.0 / 127.5)
-ssd.setInputMean((127.5, 127.5, 127.5))
-ssd.setInputSwapRB(True)
-
-print("...Creating object detection results object")
-detections = Detections()
-print("...Results object created")
-
-# Load class names from file and validate
-print("...Loading class names from coco dataset")
-with open(c.ssd_dataset, 'rt') as f:
-    detections.coco_names = f.read().rstrip('\n').split('\n')
-print(f"...Class names: {detections.coco_names}")
-if len(detections.coco_names) != c.num_coco_class_names:  # Allows for future customisation and configuration
-    print("Class names from coco dataset not loaded. Exiting program")
-    exit()
-else:
+
+# cv2.dnn backends and targets by config name, only those this OpenCV build defines
+dnn_backends = dict((name.lower(), getattr(cv2.dnn, f'DNN_BACKEND_{name}')) for name in
+                    ('DEFAULT', 'OPENCV', 'INFERENCE_ENGINE', 'CUDA', 'VKCOM', 'TIMVX', 'CANN', 'WEBNN')
+                    if hasattr(cv2.dnn, f'DNN_BACKEND_{name}'))
+dnn_targets = dict((name.lower(), getattr(cv2.dnn, f'DNN_TARGET_{name}')) for name in
+                   ('CPU', 'CPU_FP16', 'OPENCL', 'OPENCL_FP16', 'MYRIAD', 'CUDA', 'CUDA_FP16', 'VULKAN', 'NPU')
+                   if hasattr(cv2.dnn, f'DNN_TARGET_{name}'))
+
+
+def create_model(backend=c.detect_backend, target=c.detect_target, input_size=c.detect_input_size):
+    """ Loads the SSD mobilenet model with its preprocessing parameters on a cv2.dnn backend and target """
+    model = cv2.dnn_DetectionModel(c.weightsPath, c.configPath)
+    model.setPreferableBackend(dnn_backends[backend])
+    model.setPreferableTarget(dnn_targets[target])
+    # Frames arrive already resized to the input size and converted to RGB by FramePrep.model_input()
+    model.setInputSize(input_size)
+    model.setInputScale(1.0 / 127.5)
+    model.setInputMean((127.5, 127.5, 127.5))
+    model.setInputSwapRB(False)
+    return model
+
+
+class DetectionEngine:
+    """
+    Runs SSD inference on a dedicated worker thread that owns a warm copy of the model
+    Callers submit frames and receive a concurrent.futures.Future, so speech can overlap inference
+    Pending requests are bounded (backpressure) and can be cancelled until the worker picks them up
+    Frames are resized and converted once into reused buffers and boxes are scaled back to frame pixels
+    """
+    def __init__(self, max_pending=c.detect_max_pending, requests=None):
+        """ Initialises request queue (or uses one shared with other engines), the model is loaded by the worker """
+        self.requests = queue.Queue(maxsize=max_pending) if requests is None else requests
+        self.ready = threading.Event()  # Set once the model is loaded and warmed up
+        self.error = None               # Model load failure, if any
+        self.prep = FramePrep()         # Model input buffers for frames submitted as plain arrays
+        self.worker = None
+
+    def start(self):
+        """ Starts worker thread """
+        self.worker = threading.Thread(target=self._run, name='detection-engine', daemon=True)
+        self.worker.start()
+        return self
+
+    def submit(self, frame, block=False, timeout=None):
+        """
+        Queues a frame for detection and returns a Future resolving to (class_ids, confidences, boxes)
+        frame is a BGR array or a FramePrep, which must not be reloaded until the Future completes
+        Raises queue.Full when the engine is saturated unless block is True
+        """
+        future = Future()
+        self.requests.put((frame, future), block=block, timeout=timeout)
+        return future
+
+    def _run(self):
+        """ Worker loop, loads and warms the model then serves requests in order """
+        try:
+            model = create_model()
+            # First inference allocates the network buffers so pay for it before the first scan
+            model.detect(zeros(c.detect_input_size[::-1] + (3,), dtype=uint8), confThreshold=c.detect_thresh)
+        except (cv2.error, SystemError, KeyError) as err:
+            # Requests fail with the load error rather than waiting forever
+            print(f"\nDetection engine could not load the SSD model: {err}")
+            model = None
+            self.error = err
+        self.ready.set()
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            frame, future = request
+            # Skip requests cancelled while waiting in the queue
+            if not future.set_running_or_notify_cancel():
+                continue
+            if model is None:
+                future.set_exception(self.error)
+                continue
+            try:
+                future.set_result(self.detect(model, frame))
+            except Exception as err:
+                # Any failure goes to the caller, the worker must keep serving later scans
+                future.set_exception(err)
+
+    def detect(self, model, frame):
+        """ Runs the model on a BGR frame or FramePrep """
+        return detect_frame(model, frame if isinstance(frame, FramePrep) else self.prep.load(frame))
+
+    def stop(self):
+        """ Finishes queued requests and stops the worker """
+        self.requests.put(None)
+        self.worker.join() if self.worker is not None else None
+
+
+def tile_grid(length, tile, overlap):
+    """ Start positions of overlapping tiles covering length pixels, evenly spread with the last at the edge """
+    if length <= tile:
+        return [0]
+    count = ceil((length - tile) / (tile * (1 - overlap))) + 1
+    return [int(v) for v in linspace(0, length - tile, count).round()]
+
+
+def select_tiles(shape, detected_ids, prob, bound_box):
+    """
+    Tiles (x, y, w, h) worth a second look after a full frame pass
+    Tiles mostly covered by confident detections are skipped, the rest hold only low confidence detections or
+    none at all, which is where small objects missed at full frame scale are
+    """
+    height, width = shape[:2]
+    # Confident detection coverage on a coarse grid, 8 pixel cells are plenty to judge a 320 pixel tile
+    cell = 8
+    covered = zeros((ceil(height / cell), ceil(width / cell)), dtype=uint8)
+    confident = asarray(prob).reshape(-1) >= c.scan_tile_confident
+    for x, y, w, h in asarray(bound_box, dtype=int32).reshape(-1, 4)[confident]:
+        covered[max(y, 0) // cell:(y + h) // cell + 1, max(x, 0) // cell:(x + w) // cell + 1] = 1
+    size_x, size_y = min(c.scan_tile_size, width), min(c.scan_tile_size, height)
+    tiles = []
+    for y in tile_grid(height, size_y, c.scan_tile_overlap):
+        for x in tile_grid(width, size_x, c.scan_tile_overlap):
+            region = covered[y // cell:(y + size_y) // cell, x // cell:(x + size_x) // cell]
+            if region.size == 0 or region.mean() < c.scan_tile_covered:
+                tiles.append((x, y, size_x, size_y))
+    return tiles
+
+
+def detect_frame(model, prep, input_size=c.detect_input_size):
+    """ Runs the model on a FramePrep's shared model input and returns boxes in frame pixels """
+    class_ids, confidences, boxes = model.detect(prep.model_input(input_size), confThreshold=c.detect_thresh)
+    boxes = (asarray(boxes, dtype=float32).reshape(-1, 4) * prep.model_scale(input_size)).round()
+    return class_ids, confidences, boxes.astype(int32)
+
+
+class CascadeEngine:
+    """
+    Two stage detection with the same submit() interface as DetectionEngine
+    The full frame goes through the detection engine as usual, then the regions it did not confidently explain
+    are detected again on overlapping full resolution tiles, spread over tile engines that share one queue so
+    tiles run in parallel. Results are concatenated in frame pixels and merged by NMS in store_detections
+    """
+    def __init__(self, engine, tile_engines, max_pending=c.detect_max_pending):
+        """ Initialises request queue for a started full frame engine and started tile engines """
+        self.engine = engine
+        self.tile_engines = tile_engines
+        self.requests = queue.Queue(maxsize=max_pending)
+        self.ready = threading.Event()  # Set once every engine's model is loaded and warmed up
+        self.single = tm.Histogram()    # Full frame pass latency
+        self.total = tm.Histogram()     # Full frame pass and tiles
+        self.scans = 0
+        self.tiles = 0
+        self.added = 0                  # Detections surviving NMS that the full frame pass alone did not have
+        self.worker = None
+
+    @property
+    def error(self):
+        return self.engine.error
+
+    def start(self):
+        """ Starts coordinating thread """
+        self.worker = threading.Thread(target=self._run, name='detection-cascade', daemon=True)
+        self.worker.start()
+        return self
+
+    def submit(self, frame, block=False, timeout=None):
+        """ Queues a frame (BGR array or FramePrep) and returns a Future resolving to the merged raw results """
+        future = Future()
+        self.requests.put((frame, future), block=block, timeout=timeout)
+        return future
+
+    def _run(self):
+        """ Worker loop, serves requests in order once every engine is warm """
+        for engine in [self.engine] + self.tile_engines:
+            engine.ready.wait()
+        self.ready.set()
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            frame, future = request
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self.detect(frame))
+            except Exception as err:
+                # Engine errors (model load or inference) are passed on to the caller
+                future.set_exception(err)
+
+    def detect(self, frame):
+        """ Full frame pass, then tiles where it was not confident, returns (class_ids, confidences, boxes) """
+        start = perf_counter()
+        single = self.engine.submit(frame, block=True).result()
+        self.single.add(perf_counter() - start)
+        image = frame.image if isinstance(frame, FramePrep) else frame
+        tiles = select_tiles(image.shape, *single)
+        pending = [(x, y, self.tile_engines[0].submit(image[y:y + h, x:x + w], block=True)) for x, y, w, h in tiles]
+        ids, probs, boxes = [], [], []
+        # Tile boxes are in tile pixels, offset them into the frame
+        for x, y, result in [(0, 0, single)] + [(x, y, future.result()) for x, y, future in pending]:
+            ids.append(asarray(result[0], dtype=int32).reshape(-1))
+            probs.append(asarray(result[1], dtype=float32).reshape(-1))
+            boxes.append(asarray(result[2], dtype=int32).reshape(-1, 4) + array([x, y, 0, 0], dtype=int32))
+        merged = concatenate(ids), concatenate(probs), concatenate(boxes)
+        self.total.add(perf_counter() - start)
+        self.scans += 1
+        self.tiles += len(tiles)
+        self.added += len(suppress(*merged)[0]) - len(suppress(*single)[0])
+        return merged
+
+    def stats(self):
+        """ Scan latency with and without tiles, tiles run per scan and detections gained """
+        return dict(scans=self.scans, single_pass=self.single.summary(), cascade=self.total.summary(),
+                    tiles_per_scan=self.tiles / self.scans if self.scans else 0.0, added_detections=self.added)
+
+    def stop(self):
+        """ Finishes queued requests and stops every engine """
+        self.requests.put(None)
+        self.worker.join() if self.worker is not None else None
+        for engine in [self.engine] + self.tile_engines:
+            engine.stop()
+
+
+def load_classes():
+    """
+    Creates the results object and loads the class names
+    Runs on a startup thread, so a missing or incomplete class file is raised for main.py to end the program
+    """
+    global detections
+    print("\nInitialising SSD object detection module parameters")
+    print("...Creating object detection results object")
+    detections = Detections()
+    print("...Results object created")
+
+    # Load class names from file and validate
+    print("...Loading class names from coco dataset")
+    with open(c.ssd_dataset, 'rt') as f:
+        detections.coco_names = f.read().rstrip('\n').split('\n')
+    detections.labels = array(detections.coco_names)
+    detections.clear_previous_detections()
+    print(f"...Class names: {detections.coco_names}")
+    if len(detections.coco_names) != c.num_coco_class_names:  # Allows for future customisation and configuration
+        raise ValueError(f"{len(detections.coco_names)} class names loaded from {c.ssd_dataset}, "
+                         f"expected {c.num_coco_class_names}")
     print(f"...All {c.num_coco_class_names} class names loaded")
+    return detections
+
+
+def start_engine():
+    """ Starts the detection engine and waits until its model is loaded and warm """
+    global engine
+    print(f"...Starting detection engine ({c.detect_backend} backend, {c.detect_target} target, "
+          f"{c.detect_input_size[0]}x{c.detect_input_size[1]} input)")
+    engine = DetectionEngine().start()
+    if c.scan_tiled:
+        print(f"...Starting {c.scan_tile_workers} tile detection engines")
+        tiles = queue.Queue(maxsize=c.scan_tile_workers * c.detect_max_pending)
+        engine = CascadeEngine(engine, [DetectionEngine(requests=tiles).start()
+                                        for _ in range(c.scan_tile_workers)]).start()
+    engine.ready.wait()
     print("SSD object detection module initialised")
+    return engine
+
+
+# ------------------------------------------------------------------------------
+# Results object and detection engine are created during startup
+detections = None
+engine = None
 
 
 # Retain code for debugging in isolation
 # ------------------------------------------------------------------------------
 if __name__ == "__main__":
-    from time import perf_counter
+    load_classes()
+    start_engine()
 
     print("\nInitialising cam feed")
     cap = cv2.VideoCapture(c.cam_src)
@@ -194,4 +423,5 @@ if __name__ == "__main__":
     # Release video capture and clean up
     cap.release()
     cv2.destroyAllWindows()
+    engine.stop()
     del detections
\ No newline at end of file
@@ -0,0 +1,113 @@
+from collections import deque, namedtuple
+from time import perf_counter
+import threading
+import cv2
+import config as c
+
+# Newest tracked position of the selected object
+# confidence is 1.0 when the backend reports a successful update and 0.0 when the object is lost
+# (the OpenCV trackers expose no finer grained score)
+TrackResult = namedtuple('TrackResult', ['bound_box', 'timestamp', 'confidence', 'frame_id'])
+
+# Constructor names for each supported OpenCV tracker (MIL is the only one in builds without contrib)
+tracker_backends = {'MOSSE': 'TrackerMOSSE_create', 'KCF': 'TrackerKCF_create', 'CSRT': 'TrackerCSRT_create',
+                    'MIL': 'TrackerMIL_create'}
+
+# Update latency samples in seconds per backend, kept across guidance sessions for comparison
+latency_samples = {backend: deque(maxlen=c.tracker_stats_window) for backend in tracker_backends}
+
+
+def create_tracker(backend=c.tracker_backend):
+    """ Creates an OpenCV tracker, MOSSE lives in cv2.legacy on OpenCV 4.5.1 and later """
+    name = tracker_backends[backend]
+    for module in (getattr(cv2, 'legacy', None), cv2):
+        if module is not None and hasattr(module, name):
+            return getattr(module, name)()
+    raise ValueError(f"Tracker backend {backend} is not available in this OpenCV build")
+
+
+def latency_stats(backend=None):
+    """ Returns update latency summary in milliseconds for one or all backends """
+    summary = {}
+    for name, samples in latency_samples.items():
+        if (backend is not None and name != backend) or not samples:
+            continue
+        ordered = sorted(samples)
+        summary[name] = dict(updates=len(ordered),
+                             mean_ms=1000 * sum(ordered) / len(ordered),
+                             p95_ms=1000 * ordered[int(0.95 * (len(ordered) - 1))],
+                             max_ms=1000 * ordered[-1])
+    return summary
+
+
+class TrackerWorker:
+    """
+    Long lived object tracker running on its own thread
+    Frames are offered with submit() and only the newest waiting frame is processed, so a slow backend
+    skips frames rather than falling behind. The newest bounding box is published as a TrackResult
+    """
+    def __init__(self, backend=c.tracker_backend):
+        """ Initialises tracker state, start() initialises the backend on the first frame """
+        self.backend = backend
+        self.tracker = create_tracker(backend)
+        self.cond = threading.Condition()
+        self.pending = None             # (frame_id, frame) waiting for the worker
+        self.result = None
+        self.running = False
+        self.worker = None
+
+    def start(self, frame, bound_box, frame_id=0):
+        """ Initialises the backend on the selection frame and starts the worker """
+        self.tracker.init(frame, tuple(bound_box))
+        self.result = TrackResult(tuple(bound_box), perf_counter(), 1.0, frame_id)
+        self.running = True
+        self.worker = threading.Thread(target=self._run, name='object-tracker', daemon=True)
+        self.worker.start()
+        print(f"\nObject tracker initialised ({self.backend})")
+        return self
+
+    def submit(self, frame_id, frame):
+        """ Offers the latest frame to the worker, replacing any frame it has not yet started """
+        with self.cond:
+            self.pending = (frame_id, frame)
+            self.cond.notify_all()
+
+    def latest(self):
+        """ Returns the newest TrackResult """
+        with self.cond:
+            return self.result
+
+    def wait_for(self, frame_id, timeout=1.0):
+        """ Blocks until the result for frame_id (or a later frame) is published and returns it """
+        with self.cond:
+            self.cond.wait_for(lambda: self.result.frame_id >= frame_id or not self.running, timeout)
+            return self.result
+
+    def _run(self):
+        """ Worker loop """
+        samples = latency_samples[self.backend]
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending is not None or not self.running)
+                if not self.running:
+                    return
+                frame_id, frame = self.pending
+                self.pending = None
+            start = perf_counter()
+            success, bbox = self.tracker.update(frame)
+            end = perf_counter()
+            samples.append(end - start)
+            with self.cond:
+                if success:
+                    self.result = TrackResult(tuple(int(i) for i in bbox), end, 1.0, frame_id)
+                else:
+                    # Keep the last known box so guidance still has a target
+                    self.result = self.result._replace(timestamp=end, confidence=0.0, frame_id=frame_id)
+                self.cond.notify_all()
+
+    def stop(self):
+        """ Stops the worker """
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.worker.join() if self.worker is not None else None
@@ -0,0 +1,149 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from time import perf_counter
+import asyncio
+import config as c
+import telemetry as tm
+import session
+from intents import SLEEPING, AWAKE
+
+
+class AssistantRuntime:
+    """
+    asyncio runtime behind the control loop in main.py
+    Voice capture runs as a task over an always open microphone, so commands are heard while Surah speaks and
+    while guidance runs. A recognised command cuts off Surah's current speech (barge-in) and is queued for the
+    control loop. Blocking work (recognisers, speech playback waits, detection, the OpenCV and MediaPipe guidance
+    loop) runs in executors so the event loop is always free to take the next command
+    """
+    def __init__(self, surah, matcher, boot, guidance=None):
+        """ Initialises executors, the voice capture task starts in start() """
+        self.surah = surah
+        self.matcher = matcher
+        self.boot = boot
+        self.guidance = guidance if guidance is not None else session.guidance
+        self.listen_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='listen')
+        self.guide_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='guidance')
+        self.work_pool = ThreadPoolExecutor(max_workers=c.runtime_workers, thread_name_prefix='runtime')
+        self.loop = None
+        self.intents = None             # asyncio.Queue of (intent, heard_at)
+        self.listener = None
+        self.listening = False
+        self.awake = surah.awake        # Commands accepted by the next capture, ahead of the control loop
+        self.guiding = None             # Task running the guidance loop
+        self.heard_at = 0.0             # When the command being handled was heard
+        self.barge_ins = 0
+        self.echoes = 0
+        self.dispatch = tm.Histogram()  # Heard to handler start
+        self.barge_in = tm.Histogram()  # Heard to speech cut off
+
+    def blocking(self, func, *args, **kwargs):
+        """ Runs a blocking call in the worker pool and returns an awaitable for its result """
+        return self.loop.run_in_executor(self.work_pool, partial(func, *args, **kwargs))
+
+    def require(self, name):
+        """ Subsystem from the startup orchestrator, waiting for it off the event loop if it is still starting """
+        return self.blocking(self.boot.require, name)
+
+    async def optional(self, name):
+        """ Like require, but None if the subsystem failed to start (e.g. no camera) so the caller can tell the user """
+        try:
+            return await self.require(name)
+        except Exception as err:
+            tm.warning('%s unavailable: %r', name, err)
+            return None
+
+    async def say(self, text):
+        """ Speaks a response and returns once it has been played or cut off """
+        await self.blocking(self.surah.respond, text, 0)
+
+    async def say_many(self, phrases):
+        """ Speaks a list of phrases, later phrases are synthesised while the first are played """
+        await self.blocking(self.surah.respond_many, phrases, 0)
+
+    def start(self):
+        """ Starts the voice capture task, must be called from the running event loop """
+        self.loop = asyncio.get_running_loop()
+        self.intents = asyncio.Queue()
+        self.listening = True
+        self.listener = asyncio.create_task(self.listen())
+        return self
+
+    async def listen(self):
+        """
+        Voice capture task, one recognition at a time in the listen executor
+        A failed capture (e.g. the reply to an unheard utterance could not be spoken) is logged and listening
+        carries on, otherwise the control loop would wait for a command that can never arrive
+        """
+        print("\nListening for user input")
+        with self.surah.mic as source:
+            while self.listening:
+                try:
+                    heard = await self.loop.run_in_executor(self.listen_pool, self.capture, source)
+                except Exception as err:
+                    tm.warning('...Voice capture failed: %r', err)
+                    continue
+                if heard is not None:
+                    self.intents.put_nowait(heard)
+
+    def capture(self, source):
+        """ Blocking capture of one utterance on the open microphone, returns (intent, heard_at) or None """
+        # Wake and sleep switch the grammar here so a command said straight after them is not missed
+        allowed = AWAKE if self.awake else SLEEPING
+        intent = self.surah.capture_intent(self.matcher, allowed, source, c.listen_timeout)
+        # Nothing said, or not understood (already answered by capture_input)
+        if intent is None or not intent.text:
+            return None
+        # A recognised command is always taken, even one Surah has just said (e.g. 'select' in her instructions),
+        # otherwise a user answering the list being read out would be ignored
+        if intent.name == 'unknown' and self.surah.is_echo(intent.text):
+            self.echoes += 1
+            tm.debug('...Ignored echo of own speech: %s', intent.text)
+            return None
+        heard_at = self.surah.heard_at
+        self.awake = intent.name == 'wake' or (self.awake and intent.name not in ('sleep', 'exit'))
+        if c.barge_in and intent.name != 'unknown' and self.surah.is_speaking():
+            self.surah.player.interrupt()
+            self.barge_ins += 1
+            self.barge_in.add(perf_counter() - heard_at)
+        return intent, heard_at
+
+    async def next_intent(self):
+        """ Waits for the next command, heard_at is kept for latency measurement """
+        intent, self.heard_at = await self.intents.get()
+        self.dispatch.add(perf_counter() - self.heard_at)
+        return intent
+
+    @property
+    def is_guiding(self):
+        return self.guiding is not None and not self.guiding.done()
+
+    def start_guidance(self, guide, *args):
+        """ Starts the guidance session and runs the blocking guidance loop as a task, returns the task """
+        guidance = self.guidance.start()
+        self.guiding = asyncio.ensure_future(self.loop.run_in_executor(self.guide_pool, guide, *args, guidance))
+        return self.guiding
+
+    async def stop_guidance(self):
+        """ Ends guidance on the user's request and waits until the guidance loop has finished """
+        if self.is_guiding:
+            self.guidance.cancel(self.heard_at)
+            await asyncio.shield(self.guiding)
+
+    async def close(self):
+        """ Stops guidance and the voice capture task, then releases every executor """
+        await self.stop_guidance()
+        self.listening = False
+        # The listener ends within c.listen_timeout of the flag, as soon as its current capture returns
+        if self.listener is not None:
+            await self.listener
+        for pool in (self.listen_pool, self.guide_pool, self.work_pool):
+            pool.shutdown()
+
+    def stats(self):
+        """
+        Command latency in milliseconds: heard to handled, barge-in and guidance commands taking effect
+        Also how much speech barge-in cut off
+        """
+        return dict(dispatch=self.dispatch.summary(), barge_in=self.barge_in.summary(), barge_ins=self.barge_ins,
+                    echoes_ignored=self.echoes, speech=self.surah.player.stats(), guidance=self.guidance.stats())
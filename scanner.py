@@ -0,0 +1,117 @@
+from collections import namedtuple
+from time import perf_counter
+import threading
+import cv2
+import config as c
+from frame_prep import FramePrep
+import telemetry as tm
+
+# Latest detection set: frame it came from, capture time, last time the scene was confirmed unchanged
+# and the raw (class_ids, confidences, boxes) output of the detection engine
+ScanResult = namedtuple('ScanResult', ['frame_id', 'timestamp', 'checked', 'detections'])
+
+
+class BackgroundScanner:
+    """
+    Runs object detection at a low duty cycle while Surah is awake and keeps the latest result
+    Inference is skipped while a downscaled frame difference shows nothing in the scene has changed,
+    the previous result is then confirmed as current so "scan" and "list" can answer without waiting
+    """
+    def __init__(self, camera, engine):
+        """ Initialises scanner state for a camera service and detection engine """
+        self.camera = camera
+        self.engine = engine
+        self.result = None              # Latest ScanResult
+        self.reference = None           # Downscaled grey frame from the last inference
+        self.prep = FramePrep()         # Scene check and model input views of the frame being checked
+        self.request_prep = FramePrep()     # The same for on demand scans, which run alongside the worker
+        self.lock = threading.Lock()
+        self.active = threading.Event()     # Set while scanning should run
+        self.stopped = threading.Event()
+        self.checks = 0
+        self.inferences = 0
+        self.worker = None
+
+    def start(self):
+        """ Starts worker thread, scanning begins on resume() """
+        self.worker = threading.Thread(target=self._run, name='background-scanner', daemon=True)
+        self.worker.start()
+        return self
+
+    def resume(self):
+        self.active.set()
+
+    def pause(self):
+        self.active.clear()
+
+    def changed(self, grey):
+        """ True if the scene differs from the last inference frame by more than the threshold """
+        reference = self.reference
+        return reference is None or float(cv2.absdiff(grey, reference).mean()) > c.scan_motion_thresh
+
+    def _run(self):
+        """ Worker loop, checks the newest frame every c.scan_interval seconds while active """
+        frame_id = -1
+        while True:
+            self.active.wait()
+            if self.stopped.is_set():
+                return
+            frame = self.camera.wait_for_frame(frame_id)
+            if frame is not None:
+                frame_id = frame.id
+                self.checks += 1
+                prep = self.prep.load(frame.image)
+                grey = prep.grey(c.scan_motion_scale)
+                if self.result is not None and not self.changed(grey):
+                    with self.lock:
+                        self.result = self.result._replace(checked=frame.timestamp)
+                else:
+                    self.inferences += 1
+                    try:
+                        # The engine reuses this frame's views, it finishes before the next check reloads them
+                        self.submit(frame, grey.copy(), prep).result()
+                    except Exception as err:
+                        tm.warning('...Background scan failed: %s', err)
+            self.stopped.wait(c.scan_interval)
+
+    def submit(self, frame, grey=None, prep=None):
+        """
+        Runs detection on a camera Frame now, returns the engine Future and caches the result once complete
+        Without a prep (an on demand scan) the frame's views come from the request FramePrep, the caller waits for
+        the result before scanning again so the views are not reloaded while the engine reads them
+        """
+        if prep is None:
+            prep = self.request_prep.load(frame.image)
+        # The grey view is overwritten by the next frame but becomes the scene reference, so keep a small copy
+        grey = prep.grey(c.scan_motion_scale).copy() if grey is None else grey
+        future = self.engine.submit(prep, block=True)
+        future.add_done_callback(lambda done: self._store(frame, grey, done))
+        return future
+
+    def _store(self, frame, grey, future):
+        """ Keeps the result unless a newer frame has already been scanned """
+        if future.cancelled() or future.exception() is not None:
+            return
+        with self.lock:
+            if self.result is None or frame.timestamp >= self.result.timestamp:
+                self.result = ScanResult(frame.id, frame.timestamp, frame.timestamp, future.result())
+                self.reference = grey
+
+    def fresh(self, max_age=c.scan_max_age):
+        """ Latest ScanResult if the scene was confirmed within max_age seconds, otherwise None """
+        with self.lock:
+            result = self.result
+        if result is not None and perf_counter() - result.checked <= max_age:
+            return result
+        return None
+
+    def stats(self):
+        """ Scene checks made and how many needed an inference """
+        return dict(checks=self.checks, inferences=self.inferences,
+                    skipped=max(self.checks - self.inferences, 0))
+
+    def stop(self):
+        """ Stops the worker after its current check """
+        self.stopped.set()
+        self.active.set()
+        self.worker.join() if self.worker is not None else None
@@ -0,0 +1,107 @@
+from time import perf_counter
+import threading
+import telemetry as tm
+
+# Guidance lifecycle states
+IDLE = 'idle'                   # No guidance has run yet
+RUNNING = 'running'             # Guiding the hand towards the selected object
+ACQUIRED = 'acquired'           # Hand reached the target
+CANCELLED = 'cancelled'         # User closed the guidance window
+STOPPED = 'stopped'             # Camera ended or guidance was shut down
+
+
+class GuidanceSession:
+    """
+    Owns the guidance lifecycle shared by the guidance loop, the feedback stage and the display thread
+    State changes happen under one lock and only the first end of a session counts: a target acquired and
+    a window closed in the same frame cannot overwrite each other
+    Voice commands given during guidance (stop, select another object) pass their request time along and the
+    session records how long each took to take effect in the guidance loop
+    """
+    def __init__(self):
+        """ Starts idle """
+        self.lock = threading.Lock()
+        self.state = IDLE
+        self.started_at = None
+        self.ended_at = None
+        self.target = None              # New target (name, box) waiting for the guidance loop
+        self.target_requested = None
+        self.cancel_requested = None
+        self.latency = {}               # Command -> request to effect histogram
+
+    def start(self):
+        """ Begins a new guidance session """
+        with self.lock:
+            self.state = RUNNING
+            self.started_at = perf_counter()
+            self.ended_at = None
+            self.target = self.target_requested = self.cancel_requested = None
+        return self
+
+    def acquire(self):
+        """ Target acquired, called from the feedback stage """
+        return self._end(ACQUIRED)
+
+    def cancel(self, requested_at=None):
+        """ User ended guidance, e.g. 'q', closing the window or saying stop at requested_at """
+        with self.lock:
+            self.cancel_requested = requested_at if self.state == RUNNING else self.cancel_requested
+        return self._end(CANCELLED)
+
+    def retarget(self, name, box, requested_at=None):
+        """ Hands a newly selected object to the running guidance loop, False if guidance is not running """
+        with self.lock:
+            if self.state != RUNNING:
+                return False
+            self.target, self.target_requested = (name, box), requested_at
+            return True
+
+    def take_target(self):
+        """ Called by the guidance loop each frame, returns a new target (name, box) once or None """
+        with self.lock:
+            target, self.target = self.target, None
+            if target is not None and self.target_requested is not None:
+                self.record('select', self.target_requested)
+            return target
+
+    def close(self):
+        """ Called by the guidance loop once it has stopped and released the camera window and trackers """
+        with self.lock:
+            if self.state == CANCELLED and self.cancel_requested is not None:
+                self.record('stop', self.cancel_requested)
+
+    def record(self, command, requested_at):
+        """ Adds the time from a command's request to now to its latency histogram """
+        self.latency.setdefault(command, tm.Histogram()).add(perf_counter() - requested_at)
+
+    def stats(self):
+        """ Command to action latency in milliseconds per command """
+        return dict((command, histogram.summary()) for command, histogram in self.latency.items())
+
+    def stop(self):
+        """ Guidance can not continue, e.g. the camera stopped """
+        return self._end(STOPPED)
+
+    def _end(self, state):
+        """ Ends a running session, returns False if it had already ended """
+        with self.lock:
+            if self.state != RUNNING:
+                return False
+            self.state = state
+            self.ended_at = perf_counter()
+            return True
+
+    @property
+    def active(self):
+        return self.state == RUNNING
+
+    def duration(self):
+        """ Seconds the last session ran for, None while it is still running """
+        if self.started_at is None or self.ended_at is None:
+            return None
+        return self.ended_at - self.started_at
+
+
+# ------------------------------------------------------------------------------
+# Guidance session shared by every thread taking part in guidance
+guidance = GuidanceSession()
@@ -0,0 +1,146 @@
+from collections import deque
+from time import perf_counter
+import json
+import os
+import shutil
+import subprocess
+import speech_recognition as sr
+import config as c
+
+# Call latency samples in seconds per kind and backend (e.g. 'tts.google', 'asr.vosk'), used to pick the fastest
+# backend for a site
+latency_samples = {}
+
+
+def timed(kind, name, call, *args, **kwargs):
+    """ Runs a backend call and records its latency, failures are recorded too as they cost the user time """
+    start = perf_counter()
+    try:
+        return call(*args, **kwargs)
+    finally:
+        latency_samples.setdefault(f'{kind}.{name}', deque(maxlen=c.speech_stats_window)).append(perf_counter() - start)
+
+
+def latency_stats():
+    """ Returns call latency summary in milliseconds per kind and backend """
+    summary = {}
+    for name, samples in latency_samples.items():
+        ordered = sorted(samples)
+        summary[name] = dict(calls=len(ordered), mean_ms=1000 * sum(ordered) / len(ordered),
+                             p95_ms=1000 * ordered[int(0.95 * (len(ordered) - 1))], max_ms=1000 * ordered[-1])
+    return summary
+
+
+# ------------------------------------------------------------------------------
+# Speech synthesis backends. synthesize() returns LINEAR16 wav bytes for the speech player
+# settings holds everything that changes the audio so it can be part of the speech cache key
+
+class GoogleCloudSynthesizer:
+    """ Google Cloud text-to-speech (WaveNet voice), requires network access """
+    name = 'google'
+
+    def __init__(self):
+        # Imported here so the slow client import only happens when this backend is selected
+        from google.cloud import texttospeech_v1
+        # Define json file for google cloud credentials (file was manually downloaded from cloud.google.com console)
+        os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = c.api_key
+        self.client = texttospeech_v1.TextToSpeechClient()
+        self.settings = dict(backend=self.name, voice=c.tts_voice, audio_config=c.tts_audio_config)
+
+    def synthesize(self, text):
+        response = timed('tts', self.name, self.client.synthesize_speech,
+                         request={"audio_config": c.tts_audio_config, "input": {"text": text}, "voice": c.tts_voice})
+        return response.audio_content
+
+
+class EspeakSynthesizer:
+    """ Fully local synthesis with espeak-ng, lower quality but no network round trip """
+    name = 'espeak'
+
+    def __init__(self):
+        # Checked here so a missing install means no fallback rather than a failure on the first uncached phrase
+        if shutil.which(c.espeak_path) is None:
+            raise FileNotFoundError(f'espeak-ng executable not found: {c.espeak_path}')
+        self.settings = dict(backend=self.name, voice=c.espeak_voice, speed=c.espeak_speed, pitch=c.espeak_pitch)
+
+    def synthesize(self, text):
+        command = [c.espeak_path, '-v', c.espeak_voice, '-s', str(c.espeak_speed), '-p', str(c.espeak_pitch),
+                   '--stdout', text]
+        return timed('tts', self.name, subprocess.run, command, capture_output=True, check=True).stdout
+
+
+# ------------------------------------------------------------------------------
+# Speech recognition backends. recognize() takes speech_recognition AudioData and returns the transcript
+# raising sr.UnknownValueError when nothing was understood and sr.RequestError when the service failed
+
+class GoogleRecognizer:
+    """ Google web speech recognition, requires network access """
+    name = 'google'
+
+    def __init__(self, recognizer):
+        self.r = recognizer
+
+    def recognize(self, audio):
+        return timed('asr', self.name, self.r.recognize_google, audio, language=c.asr_language)
+
+
+class VoskRecognizer:
+    """ Fully local recognition with a Vosk (Kaldi) model from c.vosk_model_path """
+    name = 'vosk'
+    sample_rate = 16000
+
+    def __init__(self, recognizer=None):
+        # Imported here so the model is only loaded when this backend is selected
+        from vosk import Model, KaldiRecognizer, SetLogLevel
+        SetLogLevel(-1)
+        self.model = Model(c.vosk_model_path)
+        self.kaldi_recognizer = KaldiRecognizer
+
+    def recognize(self, audio):
+        return timed('asr', self.name, self._recognize, audio)
+
+    def _recognize(self, audio):
+        recognizer = self.kaldi_recognizer(self.model, self.sample_rate)
+        recognizer.AcceptWaveform(audio.get_raw_data(convert_rate=self.sample_rate, convert_width=2))
+        text = json.loads(recognizer.FinalResult()).get('text', '')
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+    def stream(self, source, timeout=None):
+        """
+        Yields (transcript, final) while the user speaks into an open sr.Microphone source
+        Partial transcripts are yielded as they change and the stream ends at the first non-empty final result,
+        or without a result if nobody has started speaking within timeout seconds
+        """
+        recognizer = self.kaldi_recognizer(self.model, source.SAMPLE_RATE)
+        partial = ''
+        start = perf_counter()
+        while True:
+            if timeout is not None and not partial and perf_counter() - start > timeout:
+                return
+            if recognizer.AcceptWaveform(source.stream.read(source.CHUNK)):
+                text = json.loads(recognizer.Result()).get('text', '')
+                if text:
+                    yield text, True
+                    return
+                partial = ''
+                continue
+            text = json.loads(recognizer.PartialResult()).get('partial', '')
+            if text and text != partial:
+                partial = text
+                yield text, False
+
+
+synthesizers = {'google': GoogleCloudSynthesizer, 'espeak': EspeakSynthesizer}
+recognizers = {'google': GoogleRecognizer, 'vosk': VoskRecognizer}
+
+
+def create_synthesizer(name=c.tts_backend):
+    """ Creates the configured synthesis backend """
+    return synthesizers[name]()
+
+
+def create_recognizer(recognizer, name=c.asr_backend):
+    """ Creates the configured recognition backend around a speech_recognition Recognizer """
+    return recognizers[name](recognizer)
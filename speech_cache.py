@@ -0,0 +1,103 @@
+from collections import OrderedDict
+from hashlib import sha256
+import json
+import os
+import tempfile
+import threading
+import config as c
+import telemetry as tm
+
+
+def cache_key(text, settings):
+    """ Content address for a response: hash of the text plus the backend settings (voice, audio) that shape it """
+    payload = json.dumps({"text": text, "settings": settings}, sort_keys=True)
+    return sha256(payload.encode('utf-8')).hexdigest()
+
+
+class SpeechCache:
+    """
+    Two level cache for synthesised speech
+    Memory layer is an LRU of audio bytes, disk layer persists every response between sessions
+    Allows repeated phrases to be played without a round trip to google cloud (and offline once warmed)
+    """
+    def __init__(self, cache_dir=c.tts_cache_dir, max_items=c.tts_cache_size):
+        """ Initialises cache and creates disk store if it does not exist """
+        self.cache_dir = cache_dir
+        self.max_items = max_items
+        self.memory = OrderedDict()     # key -> audio bytes, most recently used at the end
+        self.lock = threading.Lock()
+        self.hits = 0                   # Served from memory or disk
+        self.disk_hits = 0              # Subset of hits that required a disk read
+        self.misses = 0                 # Required synthesis
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def path(self, key):
+        """ Disk location for a cache key """
+        return os.path.join(self.cache_dir, key + '.tts')
+
+    def get(self, *keys):
+        """ Returns cached audio bytes for the first of the keys found or None, one hit or miss is counted per call """
+        with self.lock:
+            for key in keys:
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    self.hits += 1
+                    return self.memory[key]
+        for key in keys:
+            if os.path.isfile(self.path(key)):
+                with open(self.path(key), 'rb') as f:
+                    audio = f.read()
+                self._remember(key, audio)
+                with self.lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                return audio
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, audio):
+        """
+        Stores audio bytes in memory and on disk
+        A failed disk write only loses the persisted copy, the response itself is already in memory
+        """
+        self._remember(key, audio)
+        # Write to a temporary file of this writer's own then rename, so a partially written file is never read
+        # back and concurrent writers of the same key (prewarm and respond, repeated names in a list) don't collide
+        try:
+            fd, tmp_path = tempfile.mkstemp(suffix='.part', dir=self.cache_dir)
+        except OSError as err:
+            tm.warning('Speech cache write failed: %s', err)
+            return
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(audio)
+            os.replace(tmp_path, self.path(key))
+        except OSError as err:
+            tm.warning('Speech cache write failed: %s', err)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def contains(self, key):
+        """ Checks either cache layer without affecting the counters """
+        with self.lock:
+            if key in self.memory:
+                return True
+        return os.path.isfile(self.path(key))
+
+    def _remember(self, key, audio):
+        """ Adds audio to the memory layer and evicts the least recently used entries """
+        with self.lock:
+            self.memory[key] = audio
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_items:
+                self.memory.popitem(last=False)
+
+    def stats(self):
+        """ Returns hit/miss counters """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return dict(hits=self.hits, disk_hits=self.disk_hits, misses=self.misses,
+                        hit_rate=self.hits / lookups if lookups else 0.0, memory_items=len(self.memory))
@@ -0,0 +1,195 @@
+from collections import deque
+from io import BytesIO
+from itertools import count
+from time import perf_counter
+import heapq
+import threading
+import wave
+import simpleaudio as sa
+import config as c
+
+# Lower value is played first
+PRIORITY_SPEECH = 0             # Assistant responses, always delivered
+PRIORITY_CUE = 1                # Guidance cues, superseded by newer cues
+
+
+def decode_wav(audio):
+    """ Decodes LINEAR16 (wav) bytes into raw PCM and the parameters needed for playback """
+    with wave.open(BytesIO(audio), 'rb') as wav:
+        return wav.readframes(wav.getnframes()), wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+
+
+class SpeechItem:
+    """ Single queued utterance """
+    def __init__(self, pcm, priority, seq, cue, text=''):
+        self.pcm = pcm                  # Tuple from decode_wav
+        self.text = text                # What is being said, for recognising it as echo
+        self.priority = priority
+        self.seq = seq                  # Preserves FIFO order within a priority
+        self.cue = cue
+        self.queued_at = perf_counter()
+        self.started_at = None          # When playback began
+        self.done = threading.Event()   # Set once played, dropped or pre-empted
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class SpeechPlayer:
+    """
+    Dedicated audio worker that plays decoded speech straight from memory
+    Utterances wait in a bounded priority queue, guidance cues are dropped when a newer cue arrives
+    and are discarded if they have waited longer than c.speech_cue_ttl seconds
+    """
+    def __init__(self, max_queue=c.speech_queue_size):
+        """ Initialises queue and playback state """
+        self.max_queue = max_queue
+        self.heap = []
+        self.seq = count()
+        self.cond = threading.Condition()
+        self.current = None             # Item being played
+        self.play_obj = None            # simpleaudio handle for the current item
+        self.preempt = threading.Event()
+        self.running = False
+        self.worker = None
+        self.dropped_cues = 0           # Cues superseded by a newer cue, stale, or with no room in the queue
+        self.interrupted = 0            # Utterances (cues included) cut off or dropped by barge-in
+        self.generation = 0             # Counts barge-ins, speech started before one is not queued after it
+        self.idle_since = 0.0           # When the last utterance finished
+        self.recent = deque(maxlen=max_queue)   # Texts of the latest utterances to start playing
+
+    def start(self):
+        """ Starts playback thread """
+        self.running = True
+        self.worker = threading.Thread(target=self._run, name='speech-player', daemon=True)
+        self.worker.start()
+        return self
+
+    def say(self, audio, priority=PRIORITY_SPEECH, cue=False, generation=None, text=''):
+        """
+        Queues wav bytes for playback and returns the queued item
+        Callers wanting blocking speech wait on item.done
+        generation is self.generation when the response was started, the item is dropped (done but not played)
+        if the user has barged in since, e.g. while the response was still being synthesised
+        """
+        item = SpeechItem(decode_wav(audio), PRIORITY_CUE if cue else priority, next(self.seq), cue, text)
+        with self.cond:
+            # Nothing plays once stopped, so nobody must be left waiting on the item
+            if not self.running:
+                item.done.set()
+                return item
+            if cue:
+                # Only the newest cue is relevant to where the hand is now
+                self.dropped_cues += self._drop_where(lambda queued: queued.cue)
+                if self.current is not None and self.current.cue and c.speech_preempt_cues:
+                    self.preempt.set()
+            while len(self.heap) >= self.max_queue:
+                if cue:
+                    # Never block the frame loop, drop the new cue instead
+                    self.dropped_cues += 1
+                    item.done.set()
+                    return item
+                self.cond.wait()
+                if not self.running:
+                    item.done.set()
+                    return item
+            if generation is not None and generation != self.generation:
+                self.interrupted += 1
+                item.done.set()
+                return item
+            heapq.heappush(self.heap, item)
+            self.cond.notify_all()
+        return item
+
+    def _drop_where(self, predicate):
+        """ Removes matching items from the queue and returns how many, must be called holding self.cond """
+        kept = [queued for queued in self.heap if not predicate(queued)]
+        for queued in self.heap:
+            if predicate(queued):
+                queued.done.set()
+        dropped = len(self.heap) - len(kept)
+        self.heap = kept
+        heapq.heapify(self.heap)
+        return dropped
+
+    def interrupt(self):
+        """ Barge-in, cuts off the current utterance and drops everything queued behind it """
+        with self.cond:
+            self.generation += 1
+            self.interrupted += self._drop_where(lambda queued: True)
+            if self.current is not None:
+                self.interrupted += 1
+                self.preempt.set()
+            self.cond.notify_all()
+
+    def is_speaking(self):
+        """ True while an utterance is playing or waiting to be played """
+        with self.cond:
+            return self.current is not None or len(self.heap) > 0
+
+    def spoke_since(self, t):
+        """ True if anything was playing at or after time t (whether the microphone could have heard Surah) """
+        with self.cond:
+            return self.current is not None or len(self.heap) > 0 or self.idle_since >= t
+
+    def recent_text(self):
+        """ Texts of the utterances that most recently started playing, queued ones have not been heard yet """
+        with self.cond:
+            return list(self.recent)
+
+    def wait_idle(self, timeout=None):
+        """ Blocks until everything queued has been played """
+        with self.cond:
+            return self.cond.wait_for(lambda: self.current is None and len(self.heap) == 0, timeout)
+
+    def stats(self):
+        """ Utterances cut off or dropped by barge-in and guidance cues dropped, each utterance is counted once """
+        with self.cond:
+            return dict(interrupted=self.interrupted, dropped_cues=self.dropped_cues)
+
+    def stop(self):
+        """ Stops playback and ends the worker """
+        with self.cond:
+            self.running = False
+            self._drop_where(lambda queued: True)
+            self.preempt.set()
+            self.cond.notify_all()
+        self.worker.join() if self.worker is not None else None
+
+    def _run(self):
+        """ Worker loop, plays one item at a time """
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: len(self.heap) > 0 or not self.running)
+                if not self.running:
+                    return
+                item = heapq.heappop(self.heap)
+                # Stale cues describe a hand position that has already changed
+                if item.cue and perf_counter() - item.queued_at > c.speech_cue_ttl:
+                    self.dropped_cues += 1
+                    item.done.set()
+                    self.cond.notify_all()
+                    continue
+                self.current = item
+                item.started_at = perf_counter()
+                self.recent.append(item.text)
+                self.preempt.clear()
+                self.cond.notify_all()
+            self._play(item)
+            with self.cond:
+                self.current = None
+                self.idle_since = perf_counter()
+                item.done.set()
+                self.cond.notify_all()
+
+    def _play(self, item):
+        """ Plays PCM and returns early if pre-empted """
+        pcm, channels, sampwidth, rate = item.pcm
+        self.play_obj = sa.play_buffer(pcm, channels, sampwidth, rate)
+        # Sleep for the length of the clip, waking early only if pre-empted, then wait out the device latency
+        timeout = len(pcm) / (channels * sampwidth * rate)
+        while self.play_obj.is_playing():
+            if self.preempt.wait(timeout):
+                self.play_obj.stop()
+                return
+            timeout = 0.01
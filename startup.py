@@ -0,0 +1,105 @@
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+import threading
+
+# Subsystem start policies
+EAGER = 'eager'                 # Started immediately, startup is not complete until it has finished
+BACKGROUND = 'background'       # Started immediately, startup does not wait for it
+LAZY = 'lazy'                   # Started on first require()
+
+
+class Subsystem:
+    """ Single unit of startup work and its timing """
+    def __init__(self, name, init, deps, policy):
+        self.name = name
+        self.init = init
+        self.deps = deps
+        self.policy = policy
+        self.future = None
+        self.started = None             # Seconds after orchestrator start
+        self.duration = None
+
+
+class StartupOrchestrator:
+    """
+    Initialises subsystems concurrently on a thread pool
+    Each subsystem waits only for its own dependencies, slow ones not needed yet run in the background
+    or on first use, and every subsystem's start time and duration are recorded for the startup report
+    """
+    def __init__(self, workers=8):
+        """ Initialises registry and thread pool """
+        self.subsystems = {}
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='startup')
+        self.lock = threading.RLock()       # _submit recurses into dependencies
+        self.t0 = None
+        self.complete_at = None
+
+    def register(self, name, init, deps=(), policy=EAGER):
+        """ Adds a subsystem, init receives its dependencies' results in order and require() returns its result """
+        self.subsystems[name] = Subsystem(name, init, tuple(deps), policy)
+
+    def start(self):
+        """ Starts every eager and background subsystem """
+        self.t0 = perf_counter()
+        for subsystem in self.subsystems.values():
+            if subsystem.policy != LAZY:
+                self._submit(subsystem)
+        return self
+
+    def _submit(self, subsystem):
+        """ Schedules a subsystem once, dependencies are scheduled first so a lazy dependency can't stall it """
+        with self.lock:
+            if subsystem.future is not None:
+                return subsystem.future
+            for dep in subsystem.deps:
+                self._submit(self.subsystems[dep])
+            subsystem.future = self.pool.submit(self._run, subsystem)
+            return subsystem.future
+
+    def _run(self, subsystem):
+        """ Waits for dependencies then runs and times the subsystem """
+        deps = [self.subsystems[dep].future.result() for dep in subsystem.deps]
+        subsystem.started = perf_counter() - self.t0
+        try:
+            return subsystem.init(*deps)
+        finally:
+            subsystem.duration = perf_counter() - self.t0 - subsystem.started
+
+    def require(self, name):
+        """ Returns the result of a subsystem, starting it now if it is lazy and blocking until it is ready """
+        return self._submit(self.subsystems[name]).result()
+
+    def started(self, name):
+        """ Result of a subsystem for teardown, None if it was never started or failed to start """
+        subsystem = self.subsystems.get(name)
+        if subsystem is None or subsystem.future is None:
+            return None
+        try:
+            return subsystem.future.result()
+        except Exception:
+            return None
+
+    def wait_eager(self):
+        """ Blocks until every eager subsystem is ready and records time to startup complete """
+        for subsystem in self.subsystems.values():
+            if subsystem.policy == EAGER:
+                subsystem.future.result()
+        self.complete_at = perf_counter() - self.t0
+        return self.complete_at
+
+    def report(self):
+        """ Per subsystem startup timing breakdown """
+        lines = [f"\nStartup timing (startup complete at {self.complete_at:.2f}s)",
+                 f"...{'subsystem':<16}{'policy':<12}{'start':>8}{'duration':>10}"]
+        for s in sorted(self.subsystems.values(), key=lambda s: (s.started is None, s.started or 0)):
+            if s.started is None:
+                lines.append(f"...{s.name:<16}{s.policy:<12}{'not started':>18}")
+            elif s.duration is None:
+                lines.append(f"...{s.name:<16}{s.policy:<12}{s.started:>7.2f}s{'running':>10}")
+            else:
+                lines.append(f"...{s.name:<16}{s.policy:<12}{s.started:>7.2f}s{s.duration:>9.2f}s")
+        return '\n'.join(lines)
+
+    def shutdown(self):
+        """ Releases pool threads without waiting for background work """
+        self.pool.shutdown(wait=False)
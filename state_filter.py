@@ -0,0 +1,95 @@
+from collections import deque
+import numpy as np
+import config as c
+
+
+class StateFilter:
+    """
+    Constant velocity Kalman filter over a fixed shape array of pixel coordinates (e.g. hands x 21 x 2 landmarks
+    or an x, y, w, h box) with an adaptive measurement rate
+    Every coordinate shares the same motion model, noise and measurement times, so one 2x2 covariance serves
+    them all and each step is a handful of vectorised operations
+    The inference interval grows by one frame while predictions land within c.filter_error_target pixels of the
+    next measurement and halves when they miss, so inference runs only as often as the motion requires
+    """
+    def __init__(self, process_noise=c.filter_process_noise, measurement_noise=c.filter_measurement_noise,
+                 max_interval=c.filter_max_interval, error_target=c.filter_error_target):
+        """ Initialises noise parameters and rate control, the state starts on the first measurement """
+        self.q = process_noise ** 2     # Acceleration variance (px/s^2)^2
+        self.r = measurement_noise ** 2     # Measurement variance px^2
+        self.max_interval = max_interval
+        self.error_target = error_target
+        self.position = None            # Posterior coordinates at self.time
+        self.velocity = None            # px/s
+        self.cov = None                 # Shared posterior covariance of (position, velocity)
+        self.time = 0.0
+        self.interval = 1               # Frames between measurements
+        self.countdown = 0
+        self.frames = 0
+        self.measurements = 0
+        self.errors = deque(maxlen=c.filter_stats_window)  # Prediction error at each measurement, px
+
+    def reset(self):
+        """ Drops the state (target lost) and measures every frame until it is re-established """
+        self.position = self.velocity = self.cov = None
+        self.interval = 1
+        self.countdown = 0
+
+    def due(self):
+        """ Called once per frame, True if this frame should run inference """
+        self.frames += 1
+        self.countdown -= 1
+        if self.position is None or self.countdown <= 0:
+            self.countdown = self.interval
+            return True
+        return False
+
+    def predict(self, t):
+        """ Extrapolated coordinates at time t, does not change the filter state """
+        return self.position + self.velocity * (t - self.time)
+
+    def update(self, measurement, t, inferred=True):
+        """
+        Corrects the state with a measurement taken at time t and returns the filtered coordinates
+        inferred is False for a measurement that did not need inference (e.g. a motion gate reporting no change),
+        it corrects the state and the interval the same way but is not counted in the measurement rate
+        """
+        z = np.asarray(measurement, dtype=np.float64)
+        self.measurements += inferred
+        if self.position is None or self.position.shape != z.shape:
+            self.position, self.velocity = z.copy(), np.zeros_like(z)
+            self.cov = np.array([[self.r, 0.0], [0.0, (c.filter_initial_speed ** 2)]])
+            self.time = t
+            return self.position
+        dt = max(t - self.time, 0.0)
+        # Predict covariance forward under constant velocity with white acceleration noise
+        f = np.array([[1.0, dt], [0.0, 1.0]])
+        q = self.q * np.array([[dt ** 4 / 4, dt ** 3 / 2], [dt ** 3 / 2, dt ** 2]])
+        cov = f @ self.cov @ f.T + q
+        predicted = self.position + self.velocity * dt
+        # Gain is the same for every coordinate
+        gain = cov[:, 0] / (cov[0, 0] + self.r)
+        innovation = z - predicted
+        self.position = predicted + gain[0] * innovation
+        self.velocity = self.velocity + gain[1] * innovation
+        self.cov = cov - np.outer(gain, cov[0])
+        self.time = t
+        self.adapt(float(np.hypot(*innovation.reshape(-1, 2).T).mean()))
+        return self.position
+
+    def adapt(self, error):
+        """ Grows or shrinks the measurement interval from the latest prediction error """
+        self.errors.append(error)
+        if error > self.error_target:
+            self.interval = max(1, self.interval // 2)
+        elif self.interval < self.max_interval:
+            self.interval += 1
+
+    def stats(self):
+        """ Measurement rate against prediction error in pixels """
+        errors = np.asarray(self.errors)
+        return dict(frames=self.frames, measurements=self.measurements,
+                    measurement_ratio=self.measurements / self.frames if self.frames else 0.0,
+                    interval=self.interval,
+                    mean_error_px=float(errors.mean()) if len(errors) else None,
+                    p95_error_px=float(np.percentile(errors, 95)) if len(errors) else None)
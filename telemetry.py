@@ -0,0 +1,216 @@
+from bisect import bisect_left
+from collections import deque
+from time import perf_counter, sleep, strftime
+import atexit
+import signal
+import sys
+import threading
+import config as c
+
+DEBUG, INFO, WARNING = 10, 20, 30
+level_names = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING'}
+level_values = {'DEBUG': DEBUG, 'INFO': INFO, 'WARNING': WARNING}
+
+# Histogram bucket upper bounds in seconds, 5 per decade from 10us to 10s
+bucket_bounds = [10 ** (e / 5) for e in range(-25, 6)]
+
+
+class Histogram:
+    """ Fixed bucket histogram of durations with exact count, total, min and max """
+    def __init__(self):
+        self.counts = [0] * (len(bucket_bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect_left(bucket_bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if value < self.min else self.min
+        self.max = value if value > self.max else self.max
+
+    def percentile(self, q):
+        """ Upper bound of the bucket holding the q-th percentile, capped at the observed maximum """
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for idx, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(bucket_bounds[idx] if idx < len(bucket_bounds) else self.max, self.max)
+        return self.max
+
+    def summary(self):
+        """ Durations in milliseconds """
+        return dict(count=self.count, mean_ms=1000 * self.total / self.count if self.count else 0.0,
+                    p50_ms=1000 * self.percentile(50), p95_ms=1000 * self.percentile(95),
+                    p99_ms=1000 * self.percentile(99), max_ms=1000 * self.max)
+
+
+class Span:
+    """ Times a named stage and adds the duration to its histogram """
+    __slots__ = ('name', 'start', 'duration')
+
+    def __init__(self, name):
+        self.name = name
+        self.duration = 0.0
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.duration = perf_counter() - self.start
+        with hist_lock:
+            histogram = histograms.get(self.name)
+            if histogram is None:
+                histogram = histograms[self.name] = Histogram()
+            histogram.add(self.duration)
+        return False
+
+
+class NullSpan:
+    """ Shared do-nothing span used when tracing is switched off """
+    __slots__ = ()
+    name = None
+    duration = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class RingSink:
+    """
+    Asynchronous log output
+    Records go into a bounded ring buffer and a background thread writes them out in batches,
+    so the caller never waits on the console. When the buffer overruns the oldest records are dropped
+    The writer thread sleeps until the first record of a batch arrives, so an idle process never wakes it
+    """
+    def __init__(self, stream=None, size=c.log_buffer_size, interval=c.log_flush_interval):
+        self.stream = stream
+        self.buffer = deque(maxlen=size)
+        self.dropped = 0
+        self.interval = interval
+        self.wake = threading.Event()
+        self.pending = False            # A batch is building up and the writer has been woken for it
+        self.thread = threading.Thread(target=self._run, name='telemetry-sink', daemon=True)
+        self.thread.start()
+
+    def write(self, record):
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append(record)
+        if not self.pending:
+            self.pending = True
+            self.wake.set()
+
+    def _run(self):
+        while True:
+            self.wake.wait()
+            # Let the rest of the batch arrive so it is written in one call
+            sleep(self.interval)
+            self.wake.clear()
+            self.pending = False
+            self.flush()
+
+    def flush(self):
+        """ Writes out everything buffered so far in a single call """
+        records = []
+        while self.buffer:
+            try:
+                records.append(self.buffer.popleft())
+            except IndexError:
+                break
+        if records:
+            stream = self.stream or sys.stdout
+            stream.write('\n'.join(records) + '\n')
+            stream.flush()
+
+
+def _log(lvl, msg, *args):
+    """ Formats lazily and hands the record to the sink """
+    if lvl >= threshold:
+        sink.write(f"{strftime('%H:%M:%S')} {level_names[lvl]:<7} {msg % args if args else msg}")
+
+
+def _noop(*args):
+    return None
+
+
+def debug(msg, *args):
+    _log(DEBUG, msg, *args)
+
+
+def info(msg, *args):
+    _log(INFO, msg, *args)
+
+
+def warning(msg, *args):
+    _log(WARNING, msg, *args)
+
+
+def configure(level=None, spans=None):
+    """
+    Sets the log threshold and span tracing
+    Disabled levels are rebound to a no-op so a filtered call costs only the call itself
+    """
+    global threshold, debug, info, span
+    if level is not None:
+        threshold = level
+        debug = _debug if DEBUG >= threshold else _noop
+        info = _info if INFO >= threshold else _noop
+    if spans is not None:
+        span = Span if spans else _null_span
+
+
+def _null_span(name):
+    return null_span
+
+
+def enabled(lvl):
+    """ True if records at lvl will be written, for guarding expensive log arguments """
+    return lvl >= threshold
+
+
+def stage_summary():
+    """ Summary of every span histogram in milliseconds """
+    with hist_lock:
+        return dict((name, histogram.summary()) for name, histogram in sorted(histograms.items()))
+
+
+def dump_summary(*args):
+    """ Writes the stage timing summary, registered for exit and for the dump signal """
+    sink.flush()
+    summary = stage_summary()
+    if not summary:
+        return
+    lines = ["\nStage timings (ms)", f"{'stage':<28}{'count':>8}{'mean':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"]
+    for name, s in summary.items():
+        lines.append(f"{name:<28}{s['count']:>8}{s['mean_ms']:>9.2f}{s['p50_ms']:>9.2f}{s['p95_ms']:>9.2f}"
+                     f"{s['p99_ms']:>9.2f}{s['max_ms']:>9.2f}")
+    lines.append(f"Log records dropped: {sink.dropped}") if sink.dropped else None
+    sys.stdout.write('\n'.join(lines) + '\n')
+    sys.stdout.flush()
+
+
+# ------------------------------------------------------------------------------
+# Initialise telemetry
+histograms = {}
+hist_lock = threading.Lock()
+null_span = NullSpan()
+sink = RingSink()
+_debug, _info = debug, info
+threshold = WARNING
+span = Span
+configure(level=level_values[c.log_level], spans=c.trace_spans)
+atexit.register(dump_summary)
+# SIGUSR1 on Linux/macOS, Ctrl+Break on Windows
+dump_signal = getattr(signal, 'SIGUSR1', None) or getattr(signal, 'SIGBREAK', None)
+if dump_signal is not None and threading.current_thread() is threading.main_thread():
+    signal.signal(dump_signal, dump_summary)
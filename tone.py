@@ -0,0 +1,171 @@
+from math import ceil, hypot, pi
+from time import perf_counter
+import threading
+import wave
+import numpy as np
+import config as c
+
+# Guidance tone frequency for every whole pixel distance the camera can produce (3000Hz at the target,
+# falling 3Hz per pixel) so a cue is a table lookup
+max_distance = ceil(hypot(c.cam_width, c.cam_height))
+freq_table = np.maximum(3000 - 3 * np.arange(max_distance + 1), c.tone_min_freq).astype(np.float64)
+
+# One cycle of a sine wave, samples are read from it by phase rather than calling sin per sample
+wavetable_size = 4096
+wavetable = np.sin(2 * pi * np.arange(wavetable_size + 1) / wavetable_size).astype(np.float32)
+
+
+def distance_freq(target_distance):
+    """ Tone frequency in Hz for a distance to target in pixels """
+    return freq_table[min(max(int(target_distance), 0), max_distance)]
+
+
+class ToneEngine:
+    """
+    Generates guidance tones as PCM for a persistent audio stream
+    play() only sets the target pitch, the audio callback glides to it over c.tone_glide seconds so the pitch
+    follows the hand continuously. In 'beep' style the tone is gated into c.beep_duration ms pulses instead
+    of sounding continuously. The tone fades out if no cue arrives for c.tone_hold seconds (hand lost)
+    """
+    def __init__(self, sample_rate=c.tone_sample_rate, style=c.tone_style):
+        """ Initialises synthesis state, a sink calls render() for each block of audio """
+        self.sample_rate = sample_rate
+        self.style = style
+        self.lock = threading.Lock()
+        self.freq = 0.0                 # Current frequency, glides towards target_freq
+        self.target_freq = 0.0
+        self.phase = 0.0                # Position in the wavetable as a fraction of a cycle
+        self.amp = 0.0                  # Current amplitude, ramps towards target_amp to avoid clicks
+        self.target_amp = 0.0
+        self.last_cue = 0.0
+        self.samples = 0                # Samples rendered, drives the beep gate
+        self.cues = 0
+
+    def play(self, target_distance):
+        """ Sounds (or re-pitches) the guidance tone for a distance to target, returns immediately """
+        freq = distance_freq(target_distance)
+        with self.lock:
+            self.freq = freq if self.amp == 0.0 else self.freq
+            self.target_freq = freq
+            self.target_amp = c.tone_volume
+            self.last_cue = perf_counter()
+            self.cues += 1
+        return freq
+
+    def silence(self):
+        """ Fades the tone out, e.g. on target acquired """
+        with self.lock:
+            self.target_amp = 0.0
+
+    def render(self, frames):
+        """ Returns the next block of float32 samples """
+        with self.lock:
+            if self.target_amp and perf_counter() - self.last_cue > c.tone_hold:
+                self.target_amp = 0.0
+            freq, target_freq, amp, target_amp = self.freq, self.target_freq, self.amp, self.target_amp
+            # Glide and fade linearly, a full glide takes c.tone_glide seconds
+            step = min(1.0, frames / (c.tone_glide * self.sample_rate)) if c.tone_glide else 1.0
+            self.freq = end_freq = freq + (target_freq - freq) * step
+            fade = min(1.0, frames / (c.tone_fade * self.sample_rate)) if c.tone_fade else 1.0
+            self.amp = end_amp = amp + (target_amp - amp) * fade
+            start = self.samples
+            self.samples += frames
+        if amp == 0.0 and end_amp == 0.0:
+            return np.zeros(frames, dtype=np.float32)
+        ramp = np.arange(frames, dtype=np.float64) / frames
+        # Phase is carried across blocks so pitch changes never click
+        phases = self.phase + np.cumsum(freq + (end_freq - freq) * ramp) / self.sample_rate
+        self.phase = float(phases[-1] % 1.0)
+        block = wavetable[((phases % 1.0) * wavetable_size).astype(np.intp)]
+        block *= (amp + (end_amp - amp) * ramp).astype(np.float32)
+        if self.style == 'beep':
+            period = 2 * c.beep_duration * self.sample_rate // 1000
+            block *= ((np.arange(start, start + frames) % period) < period // 2)
+        return block
+
+
+class StreamSink:
+    """ Plays the engine through a sounddevice output stream whose callback pulls each block """
+    def __init__(self, engine):
+        # Imported here so headless and test setups don't need an audio device or PortAudio
+        import sounddevice as sd
+        self.engine = engine
+        self.stream = sd.OutputStream(samplerate=engine.sample_rate, channels=1, dtype='float32',
+                                      blocksize=c.tone_block_size, callback=self._callback)
+
+    def _callback(self, outdata, frames, time, status):
+        outdata[:, 0] = self.engine.render(frames)
+
+    def start(self):
+        self.stream.start()
+        return self
+
+    def stop(self):
+        self.stream.stop()
+        self.stream.close()
+
+
+class NullSink:
+    """ Pulls blocks in real time without an audio device, for headless runs and tests """
+    def __init__(self, engine):
+        self.engine = engine
+        self.stopped = threading.Event()
+        self.worker = None
+
+    def start(self):
+        self.worker = threading.Thread(target=self._run, name='tone-sink', daemon=True)
+        self.worker.start()
+        return self
+
+    def _run(self):
+        interval = c.tone_block_size / self.engine.sample_rate
+        while not self.stopped.wait(interval):
+            self.write(self.engine.render(c.tone_block_size))
+
+    def write(self, block):
+        pass
+
+    def stop(self):
+        self.stopped.set()
+        self.worker.join() if self.worker is not None else None
+
+
+class FileSink(NullSink):
+    """ Records the tone to a 16 bit wav file in real time, for checking cues without listening to them """
+    def __init__(self, engine, path=c.tone_file):
+        super().__init__(engine)
+        self.wav = wave.open(path, 'wb')
+        self.wav.setnchannels(1)
+        self.wav.setsampwidth(2)
+        self.wav.setframerate(engine.sample_rate)
+
+    def write(self, block):
+        self.wav.writeframes((block * 32767).astype('<i2').tobytes())
+
+    def stop(self):
+        super().stop()
+        self.wav.close()
+
+
+sinks = {'stream': StreamSink, 'null': NullSink, 'file': FileSink}
+
+
+def init(sink=None):
+    """ Creates the tone engine and starts its output sink, only needed in beep mode """
+    global engine, output
+    print("\nInitialising tone engine")
+    engine = ToneEngine()
+    output = sinks[sink or c.tone_sink](engine).start()
+    print(f"Tone engine started ({sink or c.tone_sink} output)")
+    return engine
+
+
+def stop():
+    """ Stops the output sink """
+    output.stop() if output is not None else None
+
+
+# ------------------------------------------------------------------------------
+# Tone engine is created during startup in beep mode
+engine = None
+output = None
@@ -1,24 +1,29 @@
-from threading import Thread
+from threading import Thread, Condition
+from contextlib import nullcontext
 from datetime import datetime
-from time import sleep
-from keyboard import press_and_release
-import os
+from time import perf_counter
+import multiprocessing as mp
+import queue
+import numpy as np
 import cv2
 import config as c
+import telemetry as tm
+from camera import CameraService
 import hand_track as ht
 import guidance_system as gs
 import object_detect as ssd
+import object_tracker as ot
 import voice_assistant as va
+from landmarks import NUM_LANDMARKS
+from state_filter import StateFilter
+from frame_prep import FramePrep
+import mp_pipeline as mpp
+import session
 
 
 def assign_base_cam():
-    """ Assigns background cam feed for object detections """
-    print("\nInitialising camera parameters")
-    cap = cv2.VideoCapture(c.cam_src)
-    cap.set(3, c.cam_width)
-    cap.set(4, c.cam_height)
-    print("Camera parameters initialised")
-    return cap
+    """ Starts the shared camera service used for object detections and guidance """
+    return CameraService(c.cam_src).start()
 
 
 class CountsPerSec:
@@ -51,118 +56,411 @@ def put_iterations_per_sec(frame, iterations_per_sec):
 
 
 class VideoShow:
-    """ Class that continuously shows a frame using a dedicated thread """
-    def __init__(self, frame=None):
+    """
+    Class that shows frames using a dedicated thread
+    The thread sleeps until a new frame is posted, waking every c.display_idle_ms to keep the window responsive
+    Pressing 'q' or closing the window cancels the guidance session. The window is created and destroyed by
+    the display thread itself, as HighGUI requires, so stop() just wakes and joins it
+    """
+    def __init__(self, frame=None, guidance=None):
         """ Initialises camera feed object """
         self.frame = frame
+        self.guidance = guidance if guidance is not None else session.guidance
+        self.cond = Condition()
+        self.new_frame = frame is not None
         self.stopped = False
+        self.thread = None
+        self.shown = 0
 
     def start(self):
         """ Starts new thread """
-        Thread(target=self.show, args=()).start()
+        self.thread = Thread(target=self.show, name='video-show')
+        self.thread.start()
         return self
 
+    def post(self, frame):
+        """ Hands the next frame to the display thread """
+        with self.cond:
+            self.frame = frame
+            self.new_frame = True
+            self.cond.notify()
+
     def show(self):
-        """ Shows frames """
-        while not self.stopped:
-            cv2.imshow('Cam Feed', self.frame)
-            self.stopped = True if (cv2.waitKey(1) & 0xFF == ord("q")) else None
+        """ Shows frames as they are posted until stopped """
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.new_frame or self.stopped, c.display_idle_ms / 1000)
+                if self.stopped:
+                    break
+                frame = self.frame if self.new_frame else None
+                self.new_frame = False
+            if frame is not None:
+                cv2.imshow('Cam Feed', frame)
+                self.shown += 1
+            if cv2.waitKey(1) & 0xFF == ord("q") or \
+                    (self.shown and cv2.getWindowProperty('Cam Feed', cv2.WND_PROP_VISIBLE) < 1):
+                self.guidance.cancel()
+                break
+        cv2.destroyWindow('Cam Feed') if self.shown else None
+        cv2.waitKey(1)
 
     def stop(self):
-        """ Stops cam feed """
-        self.stopped = True
+        """ Stops cam feed and waits for the window to close """
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        self.thread.join() if self.thread is not None else None
 
 
-def thread_video_show():
+class GuidancePipeline:
+    """
+    Per frame guidance stages: object tracking, hand tracking, drawing, distance and feedback
+    Shared by the live guidance loop and the replay benchmark so both exercise the same code
+    Stage durations for the latest frame are kept in self.timings
+    Headless pipelines skip every overlay, guidance output is unaffected
+    With filtering on, hand and target positions are predicted between inferences and the state filters
+    decide how often MediaPipe and the tracker actually run
+    """
+    stages = ('tracker', 'hand', 'draw', 'distance', 'feedback')
+
+    def __init__(self, hands, detections, sync_tracker=False, headless=None, filtered=None, guidance=None,
+                 clock=None):
+        """
+        Initialises stages, the tracker starts on the first frame
+        clock gives the time a Frame's content was captured for the state filters, its timestamp by default
+        (the replay benchmark uses video time so filtering doesn't depend on the machine's speed)
+        """
+        self.clock = clock if clock is not None else (lambda latest: latest.timestamp)
+        self.guidance = guidance if guidance is not None else session.guidance
+        self.scheduler = ht.HandScheduler(hands)
+        self.prep = FramePrep()             # Colour conversions and downscales shared by the stages
+        self.headless = c.headless if headless is None else headless
+        self.detections = detections
+        self.sync_tracker = sync_tracker    # Wait for the tracker on every frame (deterministic replay)
+        self.tracker = None
+        filtered = c.filter_enabled if filtered is None else filtered
+        self.hand_filter = StateFilter() if filtered else None
+        self.box_filter = StateFilter() if filtered else None
+        self.hand_pixels = np.zeros((c.max_hands, NUM_LANDMARKS, 2), dtype=np.int32)
+        self.submitted = {}                 # Capture time of frames offered to the tracker, by frame ID
+        self.track_id = -1                  # Frame ID of the last tracker result fed to the box filter
+        self.cps = CountsPerSec().start()
+        self.timings = dict.fromkeys(self.stages, 0.0)
+        self.cue_latency = None             # Capture to cue emitted in seconds, None if no cue this frame
+        self.completed = []                 # (capture to guidance latency, stage timings) for frames finished by step
+
+    def step(self, latest):
+        """ Runs every stage on a camera Frame and returns the display frame with overlays (None if headless) """
+        frame = latest.image
+        prep = self.prep.load(frame)
+        self.cue_latency = None
+        self.completed = []
+        self.apply_target()
+
+        # SELECTED OBJECT TRACKING START ----------------------------------------------------------------
+        # Tracker worker updates in parallel with hand detection on the same frame
+        # With filtering the target filter decides whether the tracker runs on this frame
+        with tm.span('guidance.tracker_submit') as submit:
+            tracked = self.box_filter is None or self.box_filter.due()
+            if self.tracker is None:
+                self.tracker = ot.TrackerWorker().start(frame, self.detections.selected_bound_box, latest.id)
+            elif tracked:
+                self.tracker.submit(latest.id, frame)
+            if tracked and self.box_filter is not None:
+                self.submitted[latest.id] = self.clock(latest)
+        # SELECTED OBJECT TRACKING END ------------------------------------------------------------------
+
+        # HAND DETECTION START ----------------------------------------------------------------
+        # Scheduler crops to the last hand and skips inference when nothing has moved
+        with tm.span('guidance.hand') as span:
+            if self.hand_filter is None:
+                hand_landmarks = self.scheduler.process(prep)
+            else:
+                hand_landmarks = self.filter_hand(prep, self.clock(latest))
+        self.timings['hand'] = span.duration
+        # HAND DETECTION END ------------------------------------------------------------------
+
+        # Use the newest published box, which may lag the current frame if the backend is slow
+        with tm.span('guidance.tracker_result') as span:
+            if self.sync_tracker and tracked:
+                result = self.tracker.wait_for(latest.id)
+            else:
+                result = self.tracker.latest()
+            if self.box_filter is not None:
+                result = self.filter_box(result, self.clock(latest))
+            self.detections.update_track(result)
+        self.timings['tracker'] = submit.duration + span.duration
+        return self.guide(latest, prep, hand_landmarks)
+
+    def guide(self, latest, prep, hand_landmarks):
+        """ Drawing, distance and feedback stages once the tracker and hand results for a frame are in (FramePrep) """
+        # FRAME DRAWING START -----------------------------------------------------------------
+        # Result boxes drawn last to avoid confusion for object detectors
+        display = None
+        self.timings['draw'] = 0.0
+        if not self.headless:
+            with tm.span('guidance.draw') as span:
+                display = put_iterations_per_sec(prep.canvas(), self.cps.fps())
+                ht.draw_landmarks(display, hand_landmarks, self.detections.selected_bound_box)
+                self.detections.draw_tracker(display)
+            self.timings['draw'] = span.duration
+        # FRAME DRAWING & DISTANCE CALCULATIONS END -------------------------------------------
+
+        # GUIDANCE SYSTEM START ---------------------------------------------------------------
+        # Check if landmarks have been detected before calling guidance system
+        self.timings['distance'] = self.timings['feedback'] = 0.0
+        if len(hand_landmarks) > 0:
+            # Calculate distance to target, call guidance function and direct user
+            with tm.span('guidance.distance') as span:
+                closest_lm, target_dist, direction = gs.calc_min_dist(display, hand_landmarks,
+                                                                      self.detections.selected_bound_box)
+            self.timings['distance'] = span.duration
+            # Only issue a new cue once Surah has finished speaking
+            # 10fps for glove, 5 for voice
+            # The beep tone is re-pitched every frame, playing it never blocks and it fades out after c.tone_hold
+            # without a cue, so gating it like speech would break the continuous tone at low frame rates
+            if c.guidance_mode == 'beep' or (self.cps.num_occurrences % 10 == 0 and not va.surah.is_speaking()):
+                with tm.span('guidance.feedback') as span:
+                    gs.guidance_feedback(direction, target_dist)
+                self.timings['feedback'] = span.duration
+                self.cue_latency = perf_counter() - latest.timestamp
+        # GUIDANCE SYSTEM END -----------------------------------------------------------------
+
+        # Increment frame
+        self.cps.increment()
+        self.completed.append((perf_counter() - latest.timestamp, dict(self.timings)))
+        tm.debug("Frame %s complete", latest.id)
+        return display
+
+    def apply_target(self):
+        """
+        Switches to an object selected by voice during guidance, hand tracking carries on undisturbed
+        The selection is only applied here, on the guidance thread, which owns the live tracking state
+        """
+        target = self.guidance.take_target()
+        if target is None:
+            return
+        self.detections.selected_object, box = target
+        self.retarget(box)
+        self.detections.selected_bound_box = box
+
+    def retarget(self, box):
+        """ Restarts object tracking, the tracker is created again from the new box on this frame """
+        self.tracker.stop() if self.tracker is not None else None
+        self.tracker = None
+        self.box_filter.reset() if self.box_filter is not None else None
+        self.submitted = {}
+        self.track_id = -1
+
+    def filter_hand(self, prep, timestamp):
+        """ Landmarks for this frame, measured when the hand filter asks for inference and predicted otherwise """
+        f = self.hand_filter
+        if f.due():
+            landmarks = self.scheduler.process(prep)
+            if len(landmarks) == 0:
+                f.reset()
+                return landmarks
+            # A frame the motion gate skipped is a zero motion measurement: the hand is where it last was, so the
+            # filter slows down instead of extrapolating off a still hand and the interval hears about the miss
+            estimate = f.update(landmarks, timestamp, inferred=self.scheduler.measured)
+        elif f.position is None:
+            return self.hand_pixels[:0]
+        else:
+            estimate = f.predict(timestamp)
+        pixels = self.hand_pixels[:len(estimate)]
+        pixels[...] = np.rint(estimate)
+        return pixels
+
+    def filter_box(self, result, timestamp):
+        """ Target box for this frame, corrected by new tracker results and predicted in between """
+        f = self.box_filter
+        if result.confidence <= 0:
+            # Target lost, use the tracker's last known box and measure every frame until it is found again
+            f.reset()
+            return result
+        if result.frame_id != self.track_id:
+            self.track_id = result.frame_id
+            # Measurement time is the capture time of the frame the tracker processed
+            measured_at = self.submitted.get(result.frame_id, timestamp)
+            self.submitted = dict((i, t) for i, t in self.submitted.items() if i > result.frame_id)
+            f.update(result.bound_box, measured_at)
+        box = np.rint(f.predict(timestamp)).astype(int)
+        return result._replace(bound_box=tuple(box.tolist()))
+
+    def close(self):
+        """ Stops the tracker worker and reports its update latency and the effective hand tracking rate """
+        self.tracker.stop() if self.tracker is not None else None
+        self.scheduler.close()
+        print(f"\nTracker latency: {ot.latency_stats(c.tracker_backend)}")
+        print(f"Hand tracking: {self.scheduler.stats()}")
+        if self.hand_filter is not None:
+            print(f"Hand filter: {self.hand_filter.stats()}")
+            print(f"Target filter: {self.box_filter.stats()}")
+
+
+class MultiProcessPipeline(GuidancePipeline):
+    """
+    Guidance pipeline with hand tracking and object tracking in separate worker processes
+    Each frame is copied once into a shared memory ring slot, both workers process it by frame ID in parallel
+    and guidance (drawing, distance, feedback) runs here once both results for that frame have arrived
+    A slot is reused only after both workers have finished with it. When every slot is busy new frames are
+    dropped (live camera) or the publisher waits (block=True, replay)
+    """
+    def __init__(self, detections, headless=None, block=False, guidance=None):
+        """ Initialises guidance stages, the ring and workers start on the first frame """
+        super().__init__(None, detections, headless=headless, filtered=False, guidance=guidance)
+        self.block = block
+        self.context = mp.get_context('spawn')     # Same start method on every platform
+        self.ring = None
+        self.busy = [0] * c.mp_ring_slots       # Results still expected per slot
+        self.next_slot = 0
+        self.pending = {}                   # frame_id -> frame, slot and worker results so far
+        self.results = self.context.Queue()
+        self.hand_requests = self.context.Queue()
+        self.tracker_requests = self.context.Queue()
+        self.workers = []
+        self.dropped = 0
+        self.reinit = False                 # Restart the tracker worker on the next published frame
+        self.retarget_from = -1             # Tracker results for earlier frames follow the previous target
+
+    def start(self, shape):
+        """ Creates the ring for the camera's frame shape and starts both workers """
+        self.ring = mpp.FrameRing(c.mp_ring_slots, shape)
+        args = (self.ring.name, c.mp_ring_slots, shape)
+        self.workers = [self.context.Process(target=mpp.hand_worker, name='hand-worker', daemon=True,
+                                             args=args + (self.hand_requests, self.results)),
+                        self.context.Process(target=mpp.tracker_worker, name='tracker-worker', daemon=True,
+                                             args=args + (self.tracker_requests, self.results, c.tracker_backend))]
+        with mpp.detached_main():
+            for worker in self.workers:
+                worker.start()
+
+    def publish(self, latest):
+        """ Copies a frame into a free slot and hands its ID to both workers, False if it was dropped """
+        if self.ring is None:
+            self.start(latest.image.shape)
+        slot = self.next_slot
+        while self.busy[slot]:
+            if not self.block:
+                self.dropped += 1
+                return False
+            self.collect(block=True)
+        np.copyto(self.ring.frames[slot], latest.image)
+        self.busy[slot] = 2
+        self.next_slot = (slot + 1) % len(self.busy)
+        self.pending[latest.id] = dict(frame=latest, slot=slot)
+        self.hand_requests.put((slot, latest.id))
+        self.tracker_requests.put((slot, latest.id, self.detections.selected_bound_box, self.reinit))
+        if self.reinit:
+            self.retarget_from, self.reinit = latest.id, False
+        return True
+
+    def collect(self, block=False):
+        """ Merges worker results by frame ID and runs guidance on every frame that is complete """
+        display = None
+        while True:
+            try:
+                kind, slot, frame_id, result, duration = self.results.get(block=block, timeout=1.0)
+            except queue.Empty:
+                return display
+            block = False
+            entry = self.pending[frame_id]
+            entry[kind] = result
+            entry.setdefault('timings', {})[kind] = duration
+            if 'hand' in entry and 'tracker' in entry:
+                display = self.merge(frame_id, entry)
+
+    def merge(self, frame_id, entry):
+        """ Guidance for one frame, the slot is released only once its display copy has been taken """
+        latest, slot = entry['frame'], entry['slot']
+        box, confidence = entry['tracker']
+        if frame_id >= self.retarget_from:
+            self.detections.update_track(ot.TrackResult(box, perf_counter(), confidence, frame_id))
+        self.timings.update(entry['timings'])
+        display = self.guide(latest, self.prep.load(self.ring.frames[slot]), entry['hand'])
+        del self.pending[frame_id]
+        self.busy[slot] = 0
+        return display
+
+    def step(self, latest=None):
+        """
+        Publishes a camera Frame and returns the display for the newest frame completed meanwhile (None if none)
+        With no frame it waits for the next outstanding frame to complete, used to drain the pipeline
+        """
+        self.cue_latency = None
+        self.completed = []
+        self.apply_target()
+        with tm.span('guidance.publish'):
+            self.publish(latest) if latest is not None else None
+        return self.collect(block=latest is None and bool(self.pending))
+
+    def retarget(self, box):
+        """ The tracker worker starts again from the new box with the next published frame """
+        self.reinit = True
+
+    def close(self):
+        """ Stops the workers and frees the ring """
+        for requests in (self.hand_requests, self.tracker_requests):
+            requests.put(None)
+        for worker in self.workers:
+            worker.join(timeout=5)
+            worker.terminate() if worker.is_alive() else None
+        self.ring.close() if self.ring is not None else None
+        print(f"\nMulti-process pipeline: {len(self.workers)} workers, {self.dropped} frames dropped")
+
+
+def thread_video_show(cam, guidance=None):
     """
     Dedicated thread for showing video frames with VideoShow object
-    Main thread grabs video frames
+    Main thread consumes frames from the shared camera service
+    guidance is an already started GuidanceSession (the assistant runtime starts it before handing over so a
+    stop heard straight away is not lost), otherwise the shared session is started here
+    Overlays are drawn on a display copy so the tracker worker and hand tracking see the clean frame
+    In headless mode there is no display thread and nothing is drawn
     """
-    print("\nInitialising guidance camera parameters")
-    guide_cap = cv2.VideoCapture(c.cam_src)
-    guide_cap.set(3, c.cam_width)
-    guide_cap.set(4, c.cam_height)
     # out = cv2.VideoWriter_fourcc(*'mp4')
     # guide_out = cv2.VideoWriter('output.mp4', out, 20.0, (c.cam_width, c.cam_height))
-    print("Guidance camera parameters initialised")
-
-    (grabbed, frame) = guide_cap.read()
-    video_shower = VideoShow(frame).start()
-    cps = CountsPerSec().start()
+    latest = cam.wait_for_frame()
+    frame = latest.image if latest is not None else None
+    guidance = guidance if guidance is not None else session.guidance.start()
+    video_shower = VideoShow(frame, guidance).start() if not c.headless else None
 
-    # Set c.guide_hand to True
-    c.guide_hand = 1
+    pipeline = None
+    try:
+        # Define "hands" outside of guidance loop for efficiency, the multi-process pipeline has its own
+        with nullcontext() if c.mp_pipeline else ht.mp_hands.Hands(min_detection_confidence=c.mp_detect_conf,
+                                                                   min_tracking_confidence=c.mp_track_conf,
+                                                                   max_num_hands=c.max_hands) as hands:
+            pipeline = (MultiProcessPipeline(ssd.detections, guidance=guidance) if c.mp_pipeline
+                        else GuidancePipeline(hands, ssd.detections, guidance=guidance))
 
-    # Define "hands" outside of guidance loop for efficiency
-    with ht.mp_hands.Hands(min_detection_confidence=c.mp_detect_conf,
-                           min_tracking_confidence=c.mp_track_conf,
-                           max_num_hands=c.max_hands) as hands:
+            # Repeat loop until the target is acquired or the user closes the window
+            while guidance.active:
+                # Wait for a frame newer than the last one processed
+                latest = cam.wait_for_frame(latest.id if latest is not None else -1)
+                # If using laptop webcam uncomment to flip image selfie style
+                # latest = latest._replace(image=cv2.flip(latest.image, 1))
 
-        # repeat loop whilst hand guidance is true
-        while c.guide_hand == 1:
-            (grabbed, frame) = guide_cap.read()
-            # If using laptop webcam uncomment to flip image selfie style
-            # frame = cv2.flip(frame, 1)
-
-            if not grabbed or video_shower.stopped:
-                video_shower.stop()
-                break
+                if latest is None:
+                    break
 
-            frame = put_iterations_per_sec(frame, cps.fps())
-            video_shower.frame = frame
-
-            # SELECTED OBJECT START
-            if cps.num_occurrences == 0:
-                ssd.detections.initialise_tracker(frame)
-
-            # HAND DETECTION START ----------------------------------------------------------------
-            if cps.num_occurrences % 2 == 0:       # Detect hand every x frames as laptop is slow
-                print("\nTracking hands")
-                results = ht.track_hand(frame, hands)
-                print("Hand track complete")
-            # HAND DETECTION END ------------------------------------------------------------------
-
-            # SELECTED OBJECT TRACKING START ----------------------------------------------------------------
-            print("\nTracking target")
-            ssd.detections.track_thread(frame)
-            print("Target track complete")
-            # SELECTED OBJECT TRACKING END ------------------------------------------------------------------
-
-            # FRAME DRAWING START -----------------------------------------------------------------
-            # Result boxes drawn last to avoid confusion for object detectors
-            print("\nDrawing landmarks")
-            print("...Drawing hand landmarks")
-            hand_landmarks = ht.draw_landmarks(frame, results, ssd.detections.selected_bound_box)
-            print("...Drawing target landmarks")
-            ssd.detections.draw_tracker(frame)
-            print("Landmarks drawing complete")
-            # FRAME DRAWING & DISTANCE CALCULATIONS END -------------------------------------------
-
-            # GUIDANCE SYSTEM START ---------------------------------------------------------------
-            # Check if landmarks have been detected before calling guidance system
-            if len(hand_landmarks) > 0:
-                # Calculate distance to target, call guidance function and direct user
-                print("\nStarting frame guidance calculations")
-                closest_lm, target_dist = gs.calc_min_dist(frame, hand_landmarks, ssd.detections.selected_bound_box)
-                # If response_file exists then Surah is still speaking
-                # 10fps for glove, 5 for voice
-                if cps.num_occurrences % 10 == 0 and not os.path.isfile(va.surah.response_file):
-                    gs.guidance_feedback(closest_lm, target_dist, ssd.detections.selected_bound_box)
-                print("Frame guidance complete")
-            # GUIDANCE SYSTEM END -----------------------------------------------------------------
-
-            # Increment frame
-            cps.increment()
-
-    # Close window with simulated keystroke and release
-    press_and_release('q')
-    sleep(1)
-    guide_cap.release()
+                display = pipeline.step(latest)
+                if video_shower is not None and display is not None:
+                    video_shower.post(display)
+    finally:
+        # A stage failing mid guidance still ends the session and closes the window and workers
+        guidance.stop()
+        # Close the window and wait for the display thread before tearing down the pipeline
+        try:
+            video_shower.stop() if video_shower is not None else None
+            pipeline.close() if pipeline is not None else None
+        finally:
+            guidance.close()
+    print(f"\nGuidance {guidance.state} after {guidance.duration():.1f}s")
     # guide_out.release()
 
-    # While loop until previous speech has finished to avoid response file error
-    while os.path.isfile(va.surah.response_file):
-        sleep(1)
-    print("\nReturning to inner control loop")
+    # Let any final cue (e.g. target acquired) finish before the next response
+    va.surah.player.wait_idle()
+    print("\nReturning to control loop")
     va.surah.respond(va.surah.dict['guide_comp'], 0)
-    return None
\ No newline at end of file
+    return None
@@ -1,9 +1,16 @@
-from google.cloud import texttospeech_v1
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from time import perf_counter
 from playsound import playsound
-import os
+import re
 import threading
 import speech_recognition as sr
 import config as c
+import telemetry as tm
+import session
+import speech_backends as sb
+from speech_cache import SpeechCache, cache_key
+from speech_output import SpeechPlayer
 
 
 class VoiceAssistant:
@@ -11,27 +18,31 @@ class VoiceAssistant:
     Class object for voice assistant
     """
     def __init__(self):
-        # Define json file for google cloud credentials (file was manually downloaded from cloud.google.com console)
-        print('...Assigning google cloud credentials')
-        os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = c.api_key
-        # Initialise text to speech client
-        print('...Assigning text-to-speech client')
-        self.client = texttospeech_v1.TextToSpeechClient()
-        self.response_file = 'response.mp3'
-        # Check and remove response_file if already existing
-        os.remove(self.response_file) if os.path.isfile(self.response_file) else None
+        # Initialise text to speech backend, local fallbacks are loaded on the first failure (see fallback())
+        print(f'...Assigning {c.tts_backend} text-to-speech backend')
+        self.tts = sb.create_synthesizer()
+        self.fallbacks = {}             # 'tts' / 'asr' -> fallback backend or None once first needed
+        self.fallback_lock = threading.Lock()
+        self.tts_retry_at = 0.0         # Until then synthesis goes straight to the fallback, the primary has failed
+        # Content addressed cache of synthesised responses so repeated phrases skip the network
+        print('...Opening text-to-speech cache')
+        self.cache = SpeechCache()
+        # Dedicated audio worker plays responses from memory
+        print('...Starting speech playback worker')
+        self.player = SpeechPlayer().start()
+        # Synthesis workers for spoken lists, phrases after the first are synthesised while it plays
+        self.synth_pool = ThreadPoolExecutor(max_workers=c.tts_batch_workers, thread_name_prefix='tts-batch')
+        self.first_audio = tm.Histogram()   # Batch call to first phrase playing
+        self.announce = tm.Histogram()      # Batch call to last phrase played
         # Initialize the speech recognizer and microphone for listening
-        print('...Assigning google speech recognition variables')
+        print(f'...Assigning {c.asr_backend} speech recognition backend')
         self.r = sr.Recognizer()
         self.mic = sr.Microphone()
-        # Adjust for background noise
-        with self.mic as source:
-            print("...Calibrating microphone")
-            # Adjust microphone for ambient noise and dynamically adjust on ongoing basis
-            self.r.adjust_for_ambient_noise(source, duration=2)
-            self.r.dynamic_energy_threshold = True
+        self.asr = sb.create_recognizer(self.r)
         # Define flag so unknown command and unheard utterance don't cause repetitive statements
         self.unheard = 0
+        self.phrase_start = 0.0         # When the last captured utterance began
+        self.heard_at = 0.0             # When it ended (or matched, for streaming recognition)
         # Define Surah's keyword response dictionary
         self.dict = dict(startup="Startup complete. AI assistant operational. Activate me by saying my name: Surah.",
                          surah="This is Surah. How can I help?",
@@ -43,6 +54,9 @@ class VoiceAssistant:
                          detections_complete="To select an object just say select followed by an object I named. \
                                 For example. Select cell phone.",
                          no_detections="No items have been detected.",
+                         no_detector="Object detection is unavailable. Please check the detection model files.",
+                         no_camera="I can't see anything. Please check that the camera is connected and try again.",
+                         no_guidance="Guidance is unavailable. Please check the hand tracking and feedback devices.",
                          no_scan="There are no objects in my memory. You cannot select undetected objects. \
                                 Ask me to scan if you are looking for something.",
                          detections_memory="Sure no problem. I detected the following objects.",
@@ -59,65 +73,241 @@ class VoiceAssistant:
                          unheard="Sorry. I didn't catch that. What did you say?",
                          unknown="Sorry. I didn't recognise that command. What did you say?",
                          acquired="Target acquired.",
-                         guide_comp="Guidance complete. Returning to inner control loop.",
-                         reset_cam="Resetting camera. Please wait a few seconds.",
-                         reset_comp="Reset complete. Would you like help with anything else?")
+                         guide_comp="Guidance complete. Would you like help with anything else?",
+                         guiding="I am guiding your hand. Say stop to end guidance or select another object.")
+        # Synthesise fixed phrases in the background so first use is served from the cache
+        self.prewarm(self.dict.values()) if c.tts_prewarm else None
         # Declare voice assistant operational as final step
         self.operational = True
         # self.awake used to avoid giving unknown/unheard error when she is asleep
         self.awake = False
 
-    def respond(self, text, is_thread):
+    @staticmethod
+    def create_fallback(factory, name, primary):
+        """ Creates a fallback backend if one is configured, a missing fallback must not stop Surah """
+        if not name or name == primary:
+            return None
+        try:
+            print(f'...Assigning {name} fallback backend')
+            return factory(name)
+        except Exception as err:
+            print(f'...Fallback backend {name} unavailable: {err}')
+            return None
+
+    def fallback(self, kind):
         """
-        Define function for calling Surah's cloud_google_tts response engine
-        Receives text input to generate response on google cloud text-to-speech
-        Option to play response on separate thread (to avoid frame interruption)
+        Fallback backend for 'tts' or 'asr', None if there is none
+        Created when the primary first fails rather than at startup, as loading e.g. the Vosk model is slow
+        """
+        with self.fallback_lock:
+            if kind not in self.fallbacks:
+                if kind == 'tts':
+                    backend = self.create_fallback(sb.create_synthesizer, c.tts_fallback, c.tts_backend)
+                else:
+                    backend = self.create_fallback(lambda name: sb.create_recognizer(self.r, name),
+                                                   c.asr_fallback, c.asr_backend)
+                self.fallbacks[kind] = backend
+            return self.fallbacks[kind]
+
+    def calibrate(self):
+        """ Adjusts for background noise, must run before the first capture_input """
+        with self.mic as source:
+            print("...Calibrating microphone")
+            # Adjust microphone for ambient noise and dynamically adjust on ongoing basis
+            self.r.adjust_for_ambient_noise(source, duration=2)
+            self.r.dynamic_energy_threshold = True
+        print("Microphone calibrated")
+        return self
+
+    def respond(self, text, is_thread, cue=False):
+        """
+        Speaks a response through the configured synthesis backend (or the speech cache) and the speech player
+        Option to return as soon as the response is queued (to avoid frame interruption)
+        Guidance cues (cue=True) are superseded by newer cues rather than queued behind them
+        """
+        generation = self.player.generation
+        audio = self.synthesize(text)
+        tm.debug('...Response received and queued for playback')
+        item = self.player.say(audio, cue=cue, generation=generation, text=text)
+        # Block until played unless threading is required for response
+        if not is_thread:
+            item.done.wait()
+            tm.debug('...Response delivered to user')
+
+    def respond_many(self, phrases, is_thread):
+        """
+        Speaks a sequence of phrases in order (e.g. the objects from a scan)
+        All phrases are synthesised concurrently and each is queued for playback as soon as it and every
+        phrase before it are ready, so the first phrase plays while the rest are still being synthesised
+        A barge-in ends the announcement, phrases not yet queued are neither queued nor synthesised
+        Blocking calls record time to first audio and total announcement time
+        """
+        start = perf_counter()
+        generation = self.player.generation
+        pending = [self.synth_pool.submit(self.synthesize, text) for text in phrases]
+        items = []
+        try:
+            for text, future in zip(phrases, pending):
+                items.append(self.player.say(future.result(), generation=generation, text=text))
+                if self.player.generation != generation:
+                    tm.debug('...Announcement interrupted after %d of %d phrases', len(items), len(phrases))
+                    break
+        finally:
+            # Phrases after a failure or a barge-in are not spoken so stop synthesising them
+            for future in pending:
+                future.cancel()
+        tm.debug('...%d responses queued for playback', len(items))
+        if not is_thread and items:
+            items[-1].done.wait()
+            total = perf_counter() - start
+            self.announce.add(total)
+            # Phrases cut off by stop() never start playing
+            played = [item.started_at for item in items if item.started_at is not None]
+            self.first_audio.add(played[0] - start) if played else None
+            tm.info('...%d phrases announced in %.0fms, first audio after %.0fms', len(items), 1000 * total,
+                    1000 * (played[0] - start) if played else 0.0)
+        return items
+
+    def batch_stats(self):
+        """ Time to first audio and total announcement time of blocking respond_many calls in milliseconds """
+        return dict(first_audio=self.first_audio.summary(), total=self.announce.summary())
+
+    def is_speaking(self):
+        """ True while Surah is talking or has responses waiting to be played """
+        return self.player.is_speaking()
+
+    def is_echo(self, text):
+        """
+        True if a transcript is most likely Surah's own voice picked up by the open microphone
+        Only utterances overlapping her speech are checked, they are echo if nearly all their words were in what
+        she has actually started saying (not what is still queued, which the user may well be answering)
+        """
+        if not self.player.spoke_since(self.phrase_start):
+            return False
+        words = re.findall(r"[a-z']+", text.lower())
+        spoken = set(re.findall(r"[a-z']+", ' '.join(self.player.recent_text()).lower()))
+        return bool(words) and sum(word in spoken for word in words) >= c.barge_in_echo_overlap * len(words)
+
+    def listening(self, source=None):
+        """ Context for a capture, an already open microphone source is used as is """
+        return nullcontext(source) if source is not None else self.mic
+
+    def synthesize(self, text):
+        """
+        Returns audio bytes for the given text
+        Served from the speech cache when available, otherwise synthesised by the backend and cached
+        Falls back to the local backend (cached under its own settings) if the primary backend fails, and keeps
+        using it for c.tts_retry_after seconds so an offline session doesn't wait on the primary for every phrase
+        """
+        key = cache_key(text, self.tts.settings)
+        fallback = self.fallback('tts') if perf_counter() < self.tts_retry_at else None
+        if fallback is not None:
+            # Phrases the primary synthesised earlier are still preferred over the fallback's
+            fallback_key = cache_key(text, fallback.settings)
+            audio = self.cache.get(key, fallback_key)
+            if audio is None:
+                audio = fallback.synthesize(text)
+                self.cache.put(fallback_key, audio)
+            return audio
+        audio = self.cache.get(key)
+        if audio is None:
+            try:
+                audio = self.tts.synthesize(text)
+            except Exception as err:
+                fallback = self.fallback('tts')
+                if fallback is None:
+                    raise
+                tm.warning('%s synthesis failed, using %s for %.0fs: %s', self.tts.name, fallback.name,
+                           c.tts_retry_after, err)
+                self.tts_retry_at = perf_counter() + c.tts_retry_after
+                key = cache_key(text, fallback.settings)
+                audio = fallback.synthesize(text)
+            self.cache.put(key, audio)
+        return audio
+
+    def prewarm(self, phrases):
+        """ Synthesises any uncached phrases on a background thread """
+        t = threading.Thread(target=self._prewarm, args=(list(phrases),), daemon=True)
+        t.start()
+        return t
+
+    def _prewarm(self, phrases):
+        """ Worker for prewarm, stops at the first failure as it is most likely a lost connection """
+        synthesised = 0
+        for text in phrases:
+            key = cache_key(text, self.tts.settings)
+            if self.cache.contains(key):
+                continue
+            try:
+                audio = self.tts.synthesize(text)
+            except Exception as err:
+                print(f"\n...Speech cache prewarm stopped: {err}")
+                return
+            self.cache.put(key, audio)
+            synthesised += 1
+        print(f"\n...Speech cache prewarm complete ({synthesised} new phrases)")
+
+    def recognize(self, audio):
+        """ Transcribes captured audio, retrying on the fallback backend when the primary cannot be reached """
+        try:
+            return self.asr.recognize(audio)
+        except sr.RequestError as err:
+            fallback = self.fallback('asr')
+            if fallback is None:
+                raise
+            tm.warning('%s recognition failed, using %s: %s', self.asr.name, fallback.name, err)
+            return fallback.recognize(audio)
+
+    def capture_intent(self, matcher, allowed=None, source=None, timeout=None):
+        """
+        Listens for the next command and returns it as an intents.Intent, None if nobody spoke within timeout
+        Streaming backends are matched on partial transcripts so a command fires as soon as it is unambiguous
+        instead of after the end of speech timeout, other backends are matched on the final transcript
+        source is an open microphone kept open between captures, otherwise the microphone is opened for this one
+        """
+        stream = getattr(self.asr, 'stream', None)
+        if stream is None:
+            speech = self.capture_input(source, timeout)
+            return matcher.match(speech, allowed=allowed) if speech is not None else None
+        self.unheard = 0
+        with self.listening(source) as source:
+            started = None
+            for text, final in stream(source, timeout):
+                started = started or perf_counter()
+                intent = matcher.match(text, final, allowed)
+                if intent is not None:
+                    self.phrase_start, self.heard_at = started, perf_counter()
+                    print(f"...User said: {text}")
+                    tm.debug('...Intent %s %s matched on %s transcript', intent.name, intent.objects,
+                             'final' if final else 'partial')
+                    return intent
+        return None
+
+    # Define function for Surah's speech recognition
+    def capture_input(self, source=None, timeout=None):
+        """
+        Uses the configured recognition backend, falling back to the local backend if the service fails
+        Returns None if nobody started speaking within timeout seconds
         """
-        response = self.client.synthesize_speech(  # Define REST json for desired response
-            request={
-                "audio_config": {"audio_encoding": "MP3", "pitch": -2.8, "speaking_rate": 1.15},
-                "input": {"text": text},
-                "voice": {"language_code": "en-IN", "name": "en-IN-Wavenet-D"}
-            }
-        )
-        # Write response to file
-        with open('response.mp3', 'wb') as output:
-            output.write(response.audio_content)
-        print('...Response received from google cloud and saved')
-        # Check if threading is required for response
-        if is_thread:
-            self.thread()
-        else:
-            self.speak()
-        print('...Response delivered to user and file removed')
-
-    # For a smooth cam feed, use a separate thread to avoid GIL conflicts
-    def thread(self):
-        """ Optional threading for use when guidance system (video) is running """
-        t1 = threading.Thread(target=self.speak)
-        t1.start()
-
-    def speak(self):
-        """ Plays response file and then deletes ready for next response """
-        # Play audio and cleanup
-        playsound(self.response_file)
-        os.remove(self.response_file)
-
-    # Define function for Surah's google speech recognition
-    def capture_input(self):
-        """ Uses Google Audio for speech recognition """
         # Each speech loop resets the unheard to zero for efficient error handling
         self.unheard = 0
-        with self.mic as source:
-            request = self.r.listen(source)
+        with self.listening(source) as source:
+            try:
+                request = self.r.listen(source, timeout=timeout)
+            except sr.WaitTimeoutError:
+                return None
+            self.heard_at = perf_counter()
+            self.phrase_start = self.heard_at - len(request.frame_data) / (request.sample_rate * request.sample_width)
             speech: str = ''  # Initialise speech capture variable in case no speech is detected
             try:  # Convert speech into text
-                speech = self.r.recognize_google(request, language='en-gb')
+                speech = self.recognize(request)
                 print(f"...User said: {speech}")
             # With full integration this line yields double unknown response as covered in main.py inner control loop
             except sr.UnknownValueError:
-                if self.awake:
-                    self.respond(surah.dict['unheard'], 0)
+                # Surah's own voice caught by the open microphone is not worth a reply, and while guiding the cues
+                # and the user's movement are heard all the time so a reply would only talk over the guidance
+                if self.awake and not session.guidance.active and not self.player.spoke_since(self.phrase_start):
+                    self.respond(self.dict['unheard'], 1)
                     self.unheard = 1
                 else:
                     print("...User utterance not understood")
@@ -128,9 +318,16 @@ class VoiceAssistant:
             return speech
 
 
+def init():
+    """ Creates the voice assistant, microphone calibration is a separate startup step """
+    global surah
+    print("\nInitialise voice assistant")
+    print("...Creating voice assistant object")
+    surah = VoiceAssistant()
+    print("Voice assistant initialised")
+    return surah
+
+
 # ------------------------------------------------------------------------------
-# Initialise voice assistant
-print("\nInitialise voice assistant")
-print("...Creating voice assistant object")
-surah = VoiceAssistant()
-print("Voice assistant initialised")
\ No newline at end of file
+# Voice assistant is created by init() during startup
+surah = None
\ No newline at end of file